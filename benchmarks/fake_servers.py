@@ -0,0 +1,160 @@
+"""
+Local stand-ins for the Telegram Bot API and the Deepseek chat completions endpoint
+"""
+
+import asyncio
+import itertools
+import random
+import time
+from collections import Counter
+
+from aiohttp import web
+
+class FakeServer:
+    """Base aiohttp server with configurable latency and error rate"""
+
+    def __init__(self, latency: float = 0.0, error_rate: float = 0.0, host: str = '127.0.0.1', port: int = 0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.host = host
+        self.port = port
+        self.calls = Counter()
+        self.errors = Counter()
+        self.first_call_at = {}
+        self.runner = None
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    def build_app(self) -> web.Application:
+        raise NotImplementedError
+
+    async def _delay_or_fail(self, name: str):
+        """Apply latency, return True if this call should fail"""
+        self.calls[name] += 1
+        self.first_call_at.setdefault(name, time.monotonic())
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.error_rate and random.random() < self.error_rate:
+            self.errors[name] += 1
+            return True
+        return False
+
+    async def start(self):
+        self.runner = web.AppRunner(self.build_app(), access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, self.host, self.port)
+        await site.start()
+        if not self.port:
+            self.port = site._server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        if self.runner:
+            await self.runner.cleanup()
+            self.runner = None
+
+class FakeTelegramServer(FakeServer):
+    """Minimal Bot API: answers every method, returning Message objects where aiogram expects them"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.message_ids = itertools.count(1)
+        self.tokens = Counter()
+
+    def build_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post('/bot{token}/{method}', self.handle)
+        return app
+
+    def _message(self, chat_id, text=None) -> dict:
+        try:
+            chat_id = int(chat_id)
+            chat = {'id': chat_id, 'type': 'private' if chat_id > 0 else 'channel'}
+        except (TypeError, ValueError):
+            chat = {'id': -1000000000001, 'type': 'channel', 'username': str(chat_id).lstrip('@')}
+        message = {'message_id': next(self.message_ids), 'date': int(time.time()), 'chat': chat}
+        if text is not None:
+            message['text'] = text
+        return message
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info['method']
+        self.tokens[request.match_info['token']] += 1
+        data = await request.post()
+        if await self._delay_or_fail(method):
+            return web.json_response(
+                {'ok': False, 'error_code': 500, 'description': 'Internal Server Error: fake failure'},
+                status=500
+            )
+        chat_id = data.get('chat_id')
+        if method == 'getMe':
+            result = {'id': 1, 'is_bot': True, 'first_name': 'Fake', 'username': 'fake_bot'}
+        elif method == 'sendMediaGroup':
+            result = [self._message(chat_id), self._message(chat_id)]
+        elif method in ('sendMessage', 'editMessageText', 'sendPhoto', 'sendVideo', 'copyMessage'):
+            result = self._message(chat_id, data.get('text'))
+        elif method == 'getFile':
+            result = {'file_id': data.get('file_id'), 'file_unique_id': 'u' + str(data.get('file_id')), 'file_size': 1024}
+        elif method == 'getUpdates':
+            # Stand-in for long polling so the dispatcher does not spin
+            await asyncio.sleep(0.1)
+            result = []
+        else:
+            result = True
+        return web.json_response({'ok': True, 'result': result})
+
+class FakeDeepseekServer(FakeServer):
+    """Chat completions endpoint echoing the text back with a usage block"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.in_flight = 0
+        self.max_in_flight = 0
+        # System prompts seen before, served "from cache" like the provider's context cache
+        self.prefixes = set()
+
+    def build_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post('/v1/chat/completions', self.handle)
+        app.router.add_get('/v1/models', self.handle_models)
+        return app
+
+    @property
+    def completions_url(self) -> str:
+        return f"{self.url}/v1/chat/completions"
+
+    async def handle_models(self, request: web.Request) -> web.Response:
+        if await self._delay_or_fail('models'):
+            return web.json_response({'error': {'message': 'fake failure'}}, status=500)
+        return web.json_response({'object': 'list', 'data': [{'id': 'deepseek-chat', 'object': 'model'}]})
+
+    async def handle(self, request: web.Request) -> web.Response:
+        payload = await request.json()
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            failed = await self._delay_or_fail('chat.completions')
+        finally:
+            self.in_flight -= 1
+        if failed:
+            return web.json_response({'error': {'message': 'fake failure'}}, status=500)
+        content = payload['messages'][-1]['content']
+        prompt_tokens = sum(len(message['content']) for message in payload['messages']) // 4
+        prefix = payload['messages'][0]['content']
+        cached_tokens = len(prefix) // 4 if prefix in self.prefixes else 0
+        self.prefixes.add(prefix)
+        return web.json_response({
+            'id': 'fake',
+            'object': 'chat.completion',
+            'model': payload.get('model'),
+            'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': f"[edited] {content}"}, 'finish_reason': 'stop'}],
+            'usage': {
+                'prompt_tokens': prompt_tokens,
+                'prompt_cache_hit_tokens': cached_tokens,
+                'prompt_cache_miss_tokens': prompt_tokens - cached_tokens,
+                'completion_tokens': len(content) // 4,
+                'total_tokens': prompt_tokens + len(content) // 4
+            }
+        })
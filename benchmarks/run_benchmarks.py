@@ -0,0 +1,543 @@
+#!/usr/bin/env python3
+"""
+Offline performance benchmarks against local fake Telegram and Deepseek servers
+
+Usage:
+    python benchmarks/run_benchmarks.py --output bench_results.json
+    python benchmarks/run_benchmarks.py --only scheduler_burst --posts 10000 --latency 0.01
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# Project modules read configuration at import time, so the environment is prepared first
+WORK_DIR = tempfile.mkdtemp(prefix='bot-bench-')
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(WORK_DIR, 'bench.db')}"
+os.environ.setdefault('BOT_TOKEN', '123456:BENCHMARK')
+os.environ.setdefault('DEEPSEEK_API_KEY', 'benchmark')
+os.environ.setdefault('TARGET_CHANNEL_ID', '-1001000000001')
+os.environ.setdefault('PUBLISH_RATE_LIMIT', '0')
+os.environ.setdefault('METRICS_ENABLED', 'false')
+os.environ.setdefault('LOG_LEVEL', 'WARNING')
+os.environ.setdefault('LOG_FILE', os.path.join(WORK_DIR, 'bot.log'))
+
+import logging
+
+from fake_servers import FakeDeepseekServer, FakeTelegramServer
+
+BENCHMARKS = {}
+
+def benchmark(func):
+    BENCHMARKS[func.__name__.replace('bench_', '')] = func
+    return func
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+def make_bot(telegram_url: str, token: str = None):
+    from aiogram import Bot
+    from aiogram.client.session.aiohttp import AiohttpSession
+    from aiogram.client.telegram import TelegramAPIServer
+    from aiogram.enums import ParseMode
+    from config import Config
+
+    session = AiohttpSession(api=TelegramAPIServer.from_base(telegram_url))
+    return Bot(token=token or Config.BOT_TOKEN, parse_mode=ParseMode.HTML, session=session)
+
+def reset_database():
+    from database.database import engine, init_db, get_db, create_default_templates
+    from database.models import Base
+
+    Base.metadata.drop_all(bind=engine)
+    init_db()
+    db_gen = get_db()
+    db = next(db_gen)
+    try:
+        create_default_templates(db)
+    finally:
+        db_gen.close()
+
+def insert_posts(count: int, due: datetime, status: str = 'scheduled', spread_seconds: int = 0):
+    """Bulk insert posts (with one target each) for a single user"""
+    from config import Config
+    from database.database import engine
+    from database.database import SessionLocal, store_text
+    from database.models import Post, PostTarget, User, make_preview
+
+    text = "Benchmark post"
+    db = SessionLocal()
+    try:
+        text_hash = store_text(db, text)
+        db.commit()
+    finally:
+        db.close()
+    with engine.begin() as conn:
+        user_id = conn.execute(User.__table__.insert().values(telegram_id=10 ** 9, first_name='bench')).inserted_primary_key[0]
+        batch = 5000
+        for offset in range(0, count, batch):
+            rows = []
+            for i in range(offset, min(count, offset + batch)):
+                rows.append({
+                    'user_id': user_id,
+                    'original_hash': text_hash,
+                    'preview': make_preview(text),
+                    'scheduled_time': due + timedelta(seconds=(i * spread_seconds) if spread_seconds else 0),
+                    'status': status,
+                    'target_channel': Config.TARGET_CHANNEL_ID
+                })
+            conn.execute(Post.__table__.insert(), rows)
+        ids = [row[0] for row in conn.execute(Post.__table__.select().with_only_columns(Post.id))]
+        conn.execute(PostTarget.__table__.insert(), [
+            {'post_id': post_id, 'chat_id': Config.TARGET_CHANNEL_ID, 'status': 'pending', 'attempts': 0}
+            for post_id in ids
+        ])
+
+@benchmark
+async def bench_scheduler_burst(args, telegram, deepseek):
+    """Publish N posts that are all due at once through SchedulerService"""
+    from database.database import get_db
+    from database.models import Post
+    from services.scheduler_service import SchedulerService
+
+    reset_database()
+    insert_posts(args.posts, datetime.utcnow() - timedelta(seconds=1))
+    bot = make_bot(telegram.url)
+    scheduler = SchedulerService(bot)
+    calls_before = sum(telegram.calls.values())
+    start = time.perf_counter()
+    try:
+        await scheduler._refill_window()
+        await asyncio.gather(*scheduler._dispatch_due())
+    finally:
+        elapsed = time.perf_counter() - start
+        await bot.session.close()
+
+    db_gen = get_db()
+    db = next(db_gen)
+    try:
+        published = db.query(Post).filter(Post.status == 'published').count()
+    finally:
+        db_gen.close()
+    return {
+        'posts': args.posts,
+        'published': published,
+        'seconds': round(elapsed, 3),
+        'posts_per_second': round(published / elapsed, 1) if elapsed else None,
+        'api_calls': sum(telegram.calls.values()) - calls_before
+    }
+
+@benchmark
+async def bench_publish_lag(args, telegram, deepseek):
+    """Delay between scheduled_time and publishing for posts due at the same minute, by prepare lead"""
+    from config import Config
+    from database.database import get_db
+    from database.models import PostTarget
+    from services.scheduler_service import SchedulerService
+
+    results = {}
+    for lead in args.prepare_leads:
+        reset_database()
+        due = datetime.utcnow() + timedelta(seconds=2)
+        insert_posts(args.lag_posts, due)
+        Config.PUBLISH_PREPARE_LEAD = lead
+        bot = make_bot(telegram.url)
+        scheduler = SchedulerService(bot)
+        try:
+            await scheduler.start()
+            deadline = time.monotonic() + 60
+            while time.monotonic() < deadline:
+                await asyncio.sleep(0.2)
+                if datetime.utcnow() > due and not scheduler.window_ids and not scheduler.publish_tasks:
+                    break
+        finally:
+            await scheduler.stop()
+            await bot.session.close()
+
+        db_gen = get_db()
+        db = next(db_gen)
+        try:
+            lags = [
+                (published_time - due).total_seconds()
+                for (published_time,) in db.query(PostTarget.published_time).filter(PostTarget.status == 'published')
+            ]
+        finally:
+            db_gen.close()
+        results[str(lead)] = {
+            'published': len(lags),
+            'p50_ms': round(percentile(lags, 50) * 1000, 1) if lags else None,
+            'p95_ms': round(percentile(lags, 95) * 1000, 1) if lags else None
+        }
+    return {'posts': args.lag_posts, 'prepare_lead_s': results}
+
+@benchmark
+async def bench_publisher_pool(args, telegram, deepseek):
+    """Publish throughput over several channels by number of publisher tokens, each with its own rate bucket"""
+    from database.database import engine
+    from database.models import PostTarget
+    from services.publisher_pool import PublisherPool
+    from services.scheduler_service import SchedulerService
+
+    results = {}
+    for size in args.pool_sizes:
+        reset_database()
+        insert_posts(args.pool_posts, datetime.utcnow() - timedelta(seconds=1))
+        with engine.begin() as conn:
+            conn.execute(PostTarget.__table__.update().values(
+                chat_id=(PostTarget.post_id % args.pool_channels - 1001000000001).cast(PostTarget.chat_id.type)
+            ))
+        bot = make_bot(telegram.url)
+        publishers = [make_bot(telegram.url, f"{900 + index}:PUBLISHER") for index in range(size)]
+        pool = PublisherPool(bot, publishers, rate=args.pool_rate, affinity='')
+        scheduler = SchedulerService(bot, pool)
+        tokens_before = dict(telegram.tokens)
+        start = time.perf_counter()
+        try:
+            await scheduler._refill_window()
+            await asyncio.gather(*scheduler._dispatch_due())
+        finally:
+            elapsed = time.perf_counter() - start
+            await pool.close()
+            await bot.session.close()
+        calls = {token: count - tokens_before.get(token, 0) for token, count in telegram.tokens.items()}
+        results[str(size)] = {
+            'seconds': round(elapsed, 3),
+            'posts_per_second': round(args.pool_posts / elapsed, 1) if elapsed else None,
+            'calls_per_token': sorted(count for count in calls.values() if count)
+        }
+    return {'posts': args.pool_posts, 'channels': args.pool_channels, 'rate_per_token': args.pool_rate, 'pool_sizes': results}
+
+def _user(user_id):
+    from aiogram.types import User
+    return User(id=user_id, is_bot=False, first_name=f"user{user_id}")
+
+def _message_update(update_id, user_id, text):
+    from aiogram.types import Chat, Message, Update
+    return Update(update_id=update_id, message=Message(
+        message_id=update_id, date=datetime.now(), chat=Chat(id=user_id, type='private'),
+        from_user=_user(user_id), text=text
+    ))
+
+def _callback_update(update_id, user_id, data):
+    from aiogram.types import CallbackQuery, Chat, Message, Update
+    message = Message(
+        message_id=update_id, date=datetime.now(), chat=Chat(id=user_id, type='private'),
+        from_user=_user(user_id), text='keyboard'
+    )
+    return Update(update_id=update_id, callback_query=CallbackQuery(
+        id=str(update_id), from_user=_user(user_id), chat_instance='bench', data=data, message=message
+    ))
+
+@benchmark
+async def bench_handler_fsm_flow(args, telegram, deepseek):
+    """Drive concurrent users through the full FSM flow via Dispatcher.feed_update"""
+    from aiogram import Dispatcher
+    from aiogram.fsm.storage.memory import MemoryStorage
+    from config import Config
+    from database.database import get_db
+    from database.models import Template
+    from handlers.user_handlers import router as user_router, init_user_handlers
+    from services.scheduler_service import SchedulerService
+
+    reset_database()
+    Config.DEEPSEEK_API_URL = deepseek.completions_url
+    bot = make_bot(telegram.url)
+    dp = Dispatcher(storage=MemoryStorage())
+    scheduler = SchedulerService(bot)
+    init_user_handlers(scheduler).deepseek_service.api_url = deepseek.completions_url
+    dp.include_router(user_router)
+
+    db_gen = get_db()
+    db = next(db_gen)
+    try:
+        template_id = db.query(Template).filter(Template.is_default == True).order_by(Template.id).first().id
+    finally:
+        db_gen.close()
+
+    publish_at = (datetime.utcnow() + timedelta(hours=1)).strftime('%H:%M')
+    update_ids = iter(range(1, 10 ** 9))
+    latencies = {}
+
+    async def step(name, update):
+        start = time.perf_counter()
+        await dp.feed_update(bot, update)
+        latencies.setdefault(name, []).append(time.perf_counter() - start)
+
+    async def user_flow(user_id):
+        await step('start', _message_update(next(update_ids), user_id, '/start'))
+        await step('content', _message_update(next(update_ids), user_id, f"Новость для пользователя {user_id}"))
+        await step('edit_template', _callback_update(next(update_ids), user_id, 'edit_template'))
+        await step('template_selected', _callback_update(next(update_ids), user_id, f"template_{template_id}"))
+        await step('confirm_edit', _callback_update(next(update_ids), user_id, 'confirm_edit'))
+        await step('schedule_time', _message_update(next(update_ids), user_id, publish_at))
+        await step('confirm_publish', _callback_update(next(update_ids), user_id, 'confirm_publish'))
+
+    start = time.perf_counter()
+    try:
+        await asyncio.gather(*(user_flow(1000 + i) for i in range(args.users)))
+        elapsed = time.perf_counter() - start
+    finally:
+        await scheduler.stop()
+        await bot.session.close()
+        user_router.message.handlers.clear()
+        user_router.callback_query.handlers.clear()
+        # Let bench_startup attach the router to the bot's own dispatcher
+        dp.sub_routers.remove(user_router)
+        user_router._parent_router = None
+
+    updates = sum(len(values) for values in latencies.values())
+    return {
+        'users': args.users,
+        'updates': updates,
+        'seconds': round(elapsed, 3),
+        'updates_per_second': round(updates / elapsed, 1) if elapsed else None,
+        'steps_ms': {
+            name: {
+                'p50': round(statistics.median(values) * 1000, 2),
+                'p95': round(percentile(values, 95) * 1000, 2)
+            } for name, values in latencies.items()
+        }
+    }
+
+@benchmark
+async def bench_handler_abuse(args, telegram, deepseek):
+    """Latency of well-behaved users while one user floods the bot, with and without ThrottlingMiddleware"""
+    from aiogram import Dispatcher
+    from aiogram.fsm.storage.memory import MemoryStorage
+    from handlers.user_handlers import PostCreationStates, router as user_router, init_user_handlers
+    from prometheus_client import REGISTRY
+    from services.scheduler_service import SchedulerService
+    from services.throttling import ThrottlingMiddleware
+
+    reset_database()
+    results = {}
+    for throttled in (False, True):
+        bot = make_bot(telegram.url)
+        dp = Dispatcher(storage=MemoryStorage())
+        if throttled:
+            dp.update.outer_middleware(ThrottlingMiddleware(coalesce_states=(
+                None, PostCreationStates.waiting_for_content.state, PostCreationStates.waiting_for_edit_method.state
+            )))
+        scheduler = SchedulerService(bot)
+        init_user_handlers(scheduler)
+        dp.include_router(user_router)
+        def dropped(reason):
+            return REGISTRY.get_sample_value('bot_throttled_updates_total', {'reason': reason}) or 0
+
+        dropped_before = {reason: dropped(reason) for reason in ('rate', 'in_flight', 'coalesced')}
+        update_ids = iter(range(1, 10 ** 9))
+        latencies = []
+        abuser = 999
+
+        async def well_behaved(user_id):
+            for text in ('/start', '/help', '/my_posts'):
+                start = time.perf_counter()
+                await dp.feed_update(bot, _message_update(next(update_ids), user_id, text))
+                latencies.append(time.perf_counter() - start)
+                await asyncio.sleep(0.05)
+
+        try:
+            # Polling handles updates as concurrent tasks, so does the flood here
+            flood = [
+                asyncio.create_task(dp.feed_update(bot, _message_update(next(update_ids), abuser, f"спам {i}")))
+                for i in range(args.abuse_messages)
+            ]
+            await asyncio.gather(*(well_behaved(2000 + i) for i in range(args.users)))
+            await asyncio.gather(*flood)
+        finally:
+            await scheduler.stop()
+            await bot.session.close()
+            user_router.message.handlers.clear()
+            user_router.callback_query.handlers.clear()
+            dp.sub_routers.remove(user_router)
+            user_router._parent_router = None
+
+        results['throttled' if throttled else 'unthrottled'] = {
+            'p50_ms': round(statistics.median(latencies) * 1000, 2),
+            'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+            'dropped': {reason: dropped(reason) - before for reason, before in dropped_before.items()}
+        }
+    return {'users': args.users, 'abuse_messages': args.abuse_messages, 'modes': results}
+
+@benchmark
+async def bench_ai_edit_concurrency(args, telegram, deepseek):
+    """Concurrent DeepseekService.edit_text calls at several concurrency levels"""
+    from services.deepseek_service import DeepseekService
+
+    service = DeepseekService()
+    service.api_url = deepseek.completions_url
+    results = {}
+    for concurrency in args.concurrency:
+        deepseek.max_in_flight = 0
+        latencies = []
+
+        async def one(i):
+            start = time.perf_counter()
+            edited = await service.edit_text(f"Текст номер {i}", "Перепиши этот текст в формальном стиле:")
+            latencies.append(time.perf_counter() - start)
+            return edited is not None
+
+        start = time.perf_counter()
+        outcomes = await asyncio.gather(*(one(i) for i in range(concurrency)))
+        elapsed = time.perf_counter() - start
+        results[str(concurrency)] = {
+            'seconds': round(elapsed, 3),
+            'success': sum(outcomes),
+            'p50_ms': round(statistics.median(latencies) * 1000, 2),
+            'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+            'server_max_in_flight': deepseek.max_in_flight
+        }
+    return {'latency_s': deepseek.latency, 'levels': results}
+
+@benchmark
+async def bench_db_tick_query(args, telegram, deepseek):
+    """Cost of the scheduler's window refill query at several posts table sizes"""
+    from config import Config
+    from database.database import get_db
+    from database.models import Post
+
+    results = {}
+    for size in args.table_sizes:
+        reset_database()
+        # Mostly future posts with a handful due, like a real backlog
+        insert_posts(size, datetime.utcnow() + timedelta(minutes=1), spread_seconds=60)
+        db_gen = get_db()
+        db = next(db_gen)
+        try:
+            timings = []
+            for _ in range(args.repeat):
+                window_end = datetime.utcnow() + timedelta(seconds=Config.SCHEDULER_WINDOW)
+                start = time.perf_counter()
+                db.query(Post.id, Post.scheduled_time).filter(Post.status == 'scheduled', Post.scheduled_time <= window_end).all()
+                timings.append(time.perf_counter() - start)
+                db.expunge_all()
+        finally:
+            db_gen.close()
+        results[str(size)] = {
+            'mean_ms': round(statistics.mean(timings) * 1000, 3),
+            'p95_ms': round(percentile(timings, 95) * 1000, 3)
+        }
+    return {'repeat': args.repeat, 'sizes': results}
+
+@benchmark
+async def bench_startup(args, telegram, deepseek):
+    """Import time of main and time from ScheduledContentEditorBot.start() to the first getUpdates"""
+    from config import Config
+
+    start = time.perf_counter()
+    subprocess.run([sys.executable, '-c', 'import main'], cwd=ROOT, env=os.environ.copy(), check=True)
+    import_seconds = time.perf_counter() - start
+
+    reset_database()
+    # A month of future posts, the warm-up must not hold back polling
+    insert_posts(args.startup_posts, datetime.utcnow() + timedelta(minutes=1), spread_seconds=30 * 24 * 3600 // max(1, args.startup_posts))
+    Config.TELEGRAM_API_URL = telegram.url
+    Config.DEEPSEEK_API_URL = deepseek.completions_url
+    Config.METRICS_ENABLED = False
+
+    from main import ScheduledContentEditorBot
+
+    app = ScheduledContentEditorBot()
+    telegram.first_call_at.pop('getUpdates', None)
+    began = time.monotonic()
+    task = asyncio.create_task(app.start())
+    while 'getUpdates' not in telegram.first_call_at and not task.done():
+        await asyncio.sleep(0.005)
+    polling_seconds = telegram.first_call_at.get('getUpdates', time.monotonic()) - began
+    await app.scheduler_service.warmup_task
+    warmup_seconds = time.monotonic() - began
+    window_posts = len(app.scheduler_service.window_ids)
+    await app.dp.stop_polling()
+    await task
+    await app.stop()
+    return {
+        'import_main_seconds': round(import_seconds, 3),
+        'future_posts': args.startup_posts,
+        'time_to_polling_seconds': round(polling_seconds, 3),
+        'scheduler_warmup_seconds': round(warmup_seconds, 3),
+        'window_posts': window_posts
+    }
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, text=True).strip()
+    except Exception:
+        return None
+
+async def run(args):
+    telegram = await FakeTelegramServer(latency=args.latency, error_rate=args.error_rate).start()
+    deepseek = await FakeDeepseekServer(latency=args.ai_latency, error_rate=args.error_rate).start()
+    results = []
+    try:
+        for name in args.only or list(BENCHMARKS):
+            logging.getLogger(__name__).warning(f"Running {name}...")
+            start = time.perf_counter()
+            metrics = await BENCHMARKS[name](args, telegram, deepseek)
+            results.append({'name': name, 'wall_seconds': round(time.perf_counter() - start, 3), 'metrics': metrics})
+    finally:
+        await telegram.stop()
+        await deepseek.stop()
+    return {
+        'timestamp': datetime.utcnow().isoformat() + 'Z',
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'params': {
+            'telegram_latency_s': args.latency,
+            'ai_latency_s': args.ai_latency,
+            'error_rate': args.error_rate
+        },
+        'results': results
+    }
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--only', nargs='*', choices=sorted(BENCHMARKS), help='Benchmarks to run (default: all)')
+    parser.add_argument('--output', help='Write JSON results to this file (default: stdout)')
+    parser.add_argument('--latency', type=float, default=0.0, help='Fake Telegram latency per call, seconds')
+    parser.add_argument('--ai-latency', type=float, default=0.2, help='Fake Deepseek latency per call, seconds')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Share of fake API calls that fail')
+    parser.add_argument('--posts', type=int, default=10000, help='Due posts for scheduler_burst')
+    parser.add_argument('--lag-posts', type=int, default=200, help='Posts due at once for publish_lag')
+    parser.add_argument('--prepare-leads', type=int, nargs='*', default=[0, 120], help='PUBLISH_PREPARE_LEAD levels for publish_lag')
+    parser.add_argument('--pool-sizes', type=int, nargs='*', default=[0, 1, 3], help='Publisher tokens for publisher_pool (0: main bot only)')
+    parser.add_argument('--pool-posts', type=int, default=300, help='Due posts for publisher_pool')
+    parser.add_argument('--pool-channels', type=int, default=6, help='Channels the publisher_pool posts are spread over')
+    parser.add_argument('--pool-rate', type=float, default=20, help='Calls per second per token for publisher_pool')
+    parser.add_argument('--users', type=int, default=50, help='Concurrent users for handler_fsm_flow')
+    parser.add_argument('--abuse-messages', type=int, default=500, help='Messages from the flooding user for handler_abuse')
+    parser.add_argument('--concurrency', type=int, nargs='*', default=[1, 10, 50], help='Levels for ai_edit_concurrency')
+    parser.add_argument('--table-sizes', type=int, nargs='*', default=[1000, 10000, 100000], help='Rows for db_tick_query')
+    parser.add_argument('--startup-posts', type=int, default=10000, help='Future posts in the DB for startup')
+    parser.add_argument('--repeat', type=int, default=20, help='Query repetitions for db_tick_query')
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    logging.basicConfig(level=os.environ['LOG_LEVEL'], format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    report = asyncio.run(run(args))
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    else:
+        print(output)
+
+if __name__ == '__main__':
+    main()
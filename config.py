@@ -7,22 +7,125 @@ load_dotenv()
 class Config:
     # Telegram Bot Configuration
     BOT_TOKEN = os.getenv('BOT_TOKEN')
+    # Custom Bot API server (local telegram-bot-api or the benchmark fake), empty means api.telegram.org
+    TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL')
     
     # Deepseek API Configuration
     DEEPSEEK_API_KEY = os.getenv('DEEPSEEK_API_KEY')
     DEEPSEEK_API_URL = os.getenv('DEEPSEEK_API_URL', 'https://api.deepseek.com/v1/chat/completions')
+    # Background availability check at startup (GET /models, spends no tokens)
+    DEEPSEEK_STARTUP_PROBE = os.getenv('DEEPSEEK_STARTUP_PROBE', 'true').lower() == 'true'
     
     # Database Configuration
     DATABASE_URL = os.getenv('DATABASE_URL', 'sqlite:///scheduled_content_editor.db')
     
-    # Target Channel/Group ID for publishing posts
+    # Target Channel/Group ID for publishing posts (comma-separated for several targets)
     TARGET_CHANNEL_ID = os.getenv('TARGET_CHANNEL_ID')
+    TARGET_CHANNEL_IDS = [chat.strip() for chat in (TARGET_CHANNEL_ID or '').split(',') if chat.strip()]
+    
+    # Publishing Configuration
+    PUBLISH_RATE_LIMIT = float(os.getenv('PUBLISH_RATE_LIMIT', 20))  # Telegram calls per second
+    PUBLISH_MAX_ATTEMPTS = int(os.getenv('PUBLISH_MAX_ATTEMPTS', 3))  # per target
+    PUBLISH_RETRY_DELAY = int(os.getenv('PUBLISH_RETRY_DELAY', 60))  # seconds
+    # Extra bot tokens that publish to channels (each an admin there), the main bot then only talks to users
+    PUBLISHER_BOT_TOKENS = [token.strip() for token in os.getenv('PUBLISHER_BOT_TOKENS', '').split(',') if token.strip()]
+    # Optional channel pins to a publisher, 1-based index in PUBLISHER_BOT_TOKENS: @channel:1,-1001234567890:2
+    PUBLISHER_AFFINITY = os.getenv('PUBLISHER_AFFINITY', '')
+    # Seconds before a publisher that had no rights in a channel is tried there again
+    PUBLISHER_EXCLUDE_TTL = int(os.getenv('PUBLISHER_EXCLUDE_TTL', 3600))
+    # Journal every publish call so a restart never re-sends what was already published
+    PUBLISH_JOURNAL_ENABLED = os.getenv('PUBLISH_JOURNAL_ENABLED', 'true').lower() == 'true'
     
     # Bot Configuration
     ADMIN_USER_ID = int(os.getenv('ADMIN_USER_ID', 0))
     
+    # Scheduler sliding window: only posts due within SCHEDULER_WINDOW are kept in memory
+    SCHEDULER_WINDOW = int(os.getenv('SCHEDULER_WINDOW', 900))  # seconds
+    SCHEDULER_REFILL_INTERVAL = int(os.getenv('SCHEDULER_REFILL_INTERVAL', 60))  # seconds
+    # Posts published at once, keep below the DB connection pool size
+    PUBLISH_CONCURRENCY = int(os.getenv('PUBLISH_CONCURRENCY', 4))
+    # Deepseek prices per million tokens, for /ai_usage cost reports
+    DEEPSEEK_PRICE_CACHE_HIT = float(os.getenv('DEEPSEEK_PRICE_CACHE_HIT', 0.07))
+    DEEPSEEK_PRICE_CACHE_MISS = float(os.getenv('DEEPSEEK_PRICE_CACHE_MISS', 0.27))
+    DEEPSEEK_PRICE_OUTPUT = float(os.getenv('DEEPSEEK_PRICE_OUTPUT', 1.10))
+    
+    # Speculative AI edits: start the most likely template edit as soon as content arrives (opt-in)
+    SPECULATIVE_EDITS_ENABLED = os.getenv('SPECULATIVE_EDITS_ENABLED', 'false').lower() == 'true'
+    SPECULATIVE_EDIT_TEMPLATE = os.getenv('SPECULATIVE_EDIT_TEMPLATE', '')  # fallback template name
+    SPECULATIVE_EDIT_DAILY_BUDGET = int(os.getenv('SPECULATIVE_EDIT_DAILY_BUDGET', 20))  # per user
+    SPECULATIVE_EDIT_TTL = int(os.getenv('SPECULATIVE_EDIT_TTL', 600))  # seconds
+    
+    # Catch-up after downtime: posts overdue by more than CATCHUP_GRACE are handled by CATCHUP_POLICY
+    CATCHUP_POLICY = os.getenv('CATCHUP_POLICY', 'rate')  # rate, spread, skip or ask
+    CATCHUP_GRACE = int(os.getenv('CATCHUP_GRACE', 300))  # seconds, less overdue posts are published as usual
+    CATCHUP_RATE = float(os.getenv('CATCHUP_RATE', 6))  # posts per minute for 'rate'
+    CATCHUP_SPREAD_WINDOW = int(os.getenv('CATCHUP_SPREAD_WINDOW', 3600))  # seconds for 'spread'
+    CATCHUP_MAX_AGE = int(os.getenv('CATCHUP_MAX_AGE', 86400))  # seconds, older posts are skipped, 0 disables
+    CATCHUP_PAGE_SIZE = int(os.getenv('CATCHUP_PAGE_SIZE', 200))
+    
+    # Per-user throttling of incoming updates
+    THROTTLE_ENABLED = os.getenv('THROTTLE_ENABLED', 'true').lower() == 'true'
+    THROTTLE_RATE = float(os.getenv('THROTTLE_RATE', 1))  # updates per second
+    THROTTLE_BURST = int(os.getenv('THROTTLE_BURST', 10))
+    THROTTLE_MAX_IN_FLIGHT = int(os.getenv('THROTTLE_MAX_IN_FLIGHT', 3))
+    THROTTLE_COALESCE_DELAY = float(os.getenv('THROTTLE_COALESCE_DELAY', 0.5))  # seconds, 0 disables
+    
+    # Slot allocation: posts to the same channel are moved apart by SLOT_SPACING, at most SLOT_MAX_SHIFT later
+    SLOT_ALLOCATION_ENABLED = os.getenv('SLOT_ALLOCATION_ENABLED', 'false').lower() == 'true'
+    SLOT_SPACING = int(os.getenv('SLOT_SPACING', 60))  # seconds
+    SLOT_MAX_SHIFT = int(os.getenv('SLOT_MAX_SHIFT', 900))  # seconds
+    
+    # Telegram requests of a post are built this long before scheduled_time, keep below SCHEDULER_WINDOW
+    PUBLISH_PREPARE_LEAD = int(os.getenv('PUBLISH_PREPARE_LEAD', 120))  # seconds
+    
+    # Post text storage: bodies larger than TEXT_COMPRESS_MIN_SIZE bytes are compressed (zlib or zstd)
+    TEXT_COMPRESSION = os.getenv('TEXT_COMPRESSION', 'zlib')
+    TEXT_COMPRESS_MIN_SIZE = int(os.getenv('TEXT_COMPRESS_MIN_SIZE', 512))
+    
+    # Media: file_ids of posts due within MEDIA_VALIDATION_LEAD are checked with getFile ahead of publishing
+    MEDIA_VALIDATION_ENABLED = os.getenv('MEDIA_VALIDATION_ENABLED', 'true').lower() == 'true'
+    MEDIA_VALIDATION_LEAD = int(os.getenv('MEDIA_VALIDATION_LEAD', 600))  # seconds
+    MEDIA_VALIDATION_INTERVAL = int(os.getenv('MEDIA_VALIDATION_INTERVAL', 60))  # seconds
+    MEDIA_VALIDATION_TTL = int(os.getenv('MEDIA_VALIDATION_TTL', 3600))  # seconds a check stays fresh
+    # Album messages arriving within this quiet period are combined into one draft
+    MEDIA_GROUP_DELAY = float(os.getenv('MEDIA_GROUP_DELAY', 1.0))  # seconds
+    
+    # Archival: published/failed posts older than ARCHIVE_AFTER_DAYS move to posts_archive
+    ARCHIVE_ENABLED = os.getenv('ARCHIVE_ENABLED', 'true').lower() == 'true'
+    ARCHIVE_AFTER_DAYS = int(os.getenv('ARCHIVE_AFTER_DAYS', 30))
+    ARCHIVE_BATCH_SIZE = int(os.getenv('ARCHIVE_BATCH_SIZE', 500))
+    ARCHIVE_INTERVAL = int(os.getenv('ARCHIVE_INTERVAL', 3600))  # seconds
+    DB_MAINTENANCE_INTERVAL = int(os.getenv('DB_MAINTENANCE_INTERVAL', 86400))  # seconds, ANALYZE, 0 disables
+    # VACUUM locks the whole SQLite database while it runs, enable only with an off-peak DB_MAINTENANCE_HOUR
+    DB_VACUUM_ENABLED = os.getenv('DB_VACUUM_ENABLED', 'false').lower() == 'true'
+    DB_MAINTENANCE_HOUR = int(os.getenv('DB_MAINTENANCE_HOUR', -1))  # UTC hour to run maintenance in, -1 any
+    
+    # Timezone used for recurring posts (cron/RRULE are evaluated in this zone)
+    TIMEZONE = os.getenv('TIMEZONE', 'UTC')
+    
+    # Metrics Configuration (Prometheus text format at /metrics)
+    METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'true').lower() == 'true'
+    METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+    METRICS_PORT = int(os.getenv('METRICS_PORT', 9101))
+    
+    # Tracing Configuration (OpenTelemetry-compatible JSON spans)
+    TRACING_ENABLED = os.getenv('TRACING_ENABLED', 'false').lower() == 'true'
+    TRACING_EXPORTER = os.getenv('TRACING_EXPORTER', 'file')  # file, console
+    TRACING_FILE = os.getenv('TRACING_FILE', 'traces.jsonl')
+    TRACING_SERVICE_NAME = os.getenv('TRACING_SERVICE_NAME', 'scheduled-content-bot')
+    
+    # Profiling Configuration (/profile N admin command)
+    PROFILER_BACKEND = os.getenv('PROFILER_BACKEND', 'cprofile')  # cprofile, yappi
+    PROFILE_DIR = os.getenv('PROFILE_DIR', 'profiles')
+    
     # Logging Configuration
     LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+    LOG_FORMAT = os.getenv('LOG_FORMAT', 'text')  # text, json
+    LOG_FILE = os.getenv('LOG_FILE', 'bot.log')
+    LOG_ASYNC = os.getenv('LOG_ASYNC', 'true').lower() == 'true'  # write logs from a background thread
+    LOG_MAX_BYTES = int(os.getenv('LOG_MAX_BYTES', 10 * 1024 * 1024))
+    LOG_BACKUP_COUNT = int(os.getenv('LOG_BACKUP_COUNT', 5))
+    LOG_ROTATE_WHEN = os.getenv('LOG_ROTATE_WHEN', '')  # e.g. midnight, rotate by time instead of size
     
     # Default templates for text editing
     DEFAULT_TEMPLATES = {
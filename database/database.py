@@ -1,14 +1,26 @@
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker, Session
 from sqlalchemy.ext.declarative import declarative_base
+from typing import Optional
 from config import Config
+import hashlib
 import logging
+import zlib
 
 logger = logging.getLogger(__name__)
 
 # Create database engine
 engine = create_engine(Config.DATABASE_URL, echo=False)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Objects stay readable after commit without re-acquiring a connection while handlers await Telegram
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=engine)
+
+if Config.METRICS_ENABLED:
+    from services.metrics import instrument_engine
+    instrument_engine(engine)
+
+if Config.TRACING_ENABLED:
+    from services.tracing import trace_engine
+    trace_engine(engine)
 
 def get_db() -> Session:
     """Get database session"""
@@ -18,10 +30,49 @@ def get_db() -> Session:
     finally:
         db.close()
 
+def _compress(data: bytes):
+    """Pick the codec for a text body, small bodies are stored as is"""
+    if len(data) < Config.TEXT_COMPRESS_MIN_SIZE:
+        return 'raw', data
+    if Config.TEXT_COMPRESSION == 'zstd':
+        try:
+            import zstandard
+            return 'zstd', zstandard.ZstdCompressor().compress(data)
+        except ImportError:
+            logger.warning("zstandard is not installed, falling back to zlib")
+    return 'zlib', zlib.compress(data)
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+def blob_row(text: str) -> dict:
+    """Column values of the text_blobs row for text"""
+    data = text.encode('utf-8')
+    codec, body = _compress(data)
+    return {'hash': hashlib.sha256(data).hexdigest(), 'codec': codec, 'body': body, 'size': len(data)}
+
+def store_text(db: Session, text: Optional[str]) -> Optional[str]:
+    """Store text as a content-addressed blob and return its hash, identical texts share one row"""
+    if text is None:
+        return None
+    from database.models import TextBlob
+    
+    digest = text_hash(text)
+    if db.get(TextBlob, digest) is None:
+        db.add(TextBlob(**blob_row(text)))
+        db.flush()
+    return digest
+
 def init_db():
     """Initialize database tables"""
     from database.models import Base
+    from database.migrations import run_migrations
     Base.metadata.create_all(bind=engine)
+    run_migrations(engine)
+    # create_all skips existing tables, add indexes introduced later
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
     logger.info("Database initialized successfully")
 
 def create_default_templates(db: Session):
@@ -0,0 +1,165 @@
+"""
+Schema upgrades for databases created by earlier versions
+
+create_all only creates missing tables, columns added to or removed from existing tables are
+handled here. Every step inspects the live schema first, so it is a no-op on an up-to-date database.
+"""
+
+import json
+import logging
+from typing import Set
+
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Connection, Engine
+
+logger = logging.getLogger(__name__)
+
+MIGRATION_BATCH_SIZE = 1000
+
+def _columns(conn: Connection, table: str) -> Set[str]:
+    return {column['name'] for column in inspect(conn).get_columns(table)}
+
+def add_post_recurrence(conn: Connection):
+    """posts.recurrence_id for recurring posts"""
+    if 'recurrence_id' not in _columns(conn, 'posts'):
+        conn.execute(text("ALTER TABLE posts ADD COLUMN recurrence_id INTEGER REFERENCES recurrences(id)"))
+        logger.info("Added posts.recurrence_id")
+
+def move_post_texts(conn: Connection):
+    """posts.original_text/edited_text -> text_blobs, referenced by original_hash/edited_hash"""
+    from database.database import blob_row, text_hash
+    from database.models import PREVIEW_LENGTH, TextBlob, make_preview
+
+    columns = _columns(conn, 'posts')
+    if 'original_text' not in columns:
+        return
+    for name, ddl in (
+        ('original_hash', "VARCHAR(64) REFERENCES text_blobs(hash)"),
+        ('edited_hash', "VARCHAR(64) REFERENCES text_blobs(hash)"),
+        ('preview', f"VARCHAR({PREVIEW_LENGTH})"),
+    ):
+        if name not in columns:
+            conn.execute(text(f"ALTER TABLE posts ADD COLUMN {name} {ddl}"))
+
+    moved = 0
+    last_id = 0
+    while True:
+        rows = conn.execute(text(
+            "SELECT id, original_text, edited_text FROM posts "
+            "WHERE id > :last_id AND original_hash IS NULL ORDER BY id LIMIT :size"
+        ), {'last_id': last_id, 'size': MIGRATION_BATCH_SIZE}).all()
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        for post_id, original_text, edited_text in rows:
+            # As on confirmation: an edit identical to the original is not stored twice
+            if edited_text == original_text:
+                edited_text = None
+            hashes = {}
+            for name, value in (('original_hash', original_text), ('edited_hash', edited_text)):
+                if value is None:
+                    hashes[name] = None
+                    continue
+                digest = text_hash(value)
+                if conn.execute(TextBlob.__table__.select().with_only_columns(TextBlob.hash).where(
+                    TextBlob.hash == digest
+                )).first() is None:
+                    conn.execute(TextBlob.__table__.insert().values(**blob_row(value)))
+                hashes[name] = digest
+            conn.execute(text(
+                "UPDATE posts SET original_hash = :original_hash, edited_hash = :edited_hash, preview = :preview "
+                "WHERE id = :id"
+            ), {**hashes, 'preview': make_preview(edited_text or original_text), 'id': post_id})
+            moved += 1
+
+    for name in ('original_text', 'edited_text'):
+        conn.execute(text(f"ALTER TABLE posts DROP COLUMN {name}"))
+    logger.info(f"Moved texts of {moved} posts to text_blobs")
+
+def move_post_media(conn: Connection):
+    """posts.media_files JSON -> media/post_media rows"""
+    from database.models import Media, PostMedia
+
+    if 'media_files' not in _columns(conn, 'posts'):
+        return
+    media_table = Media.__table__
+    moved = 0
+    last_id = 0
+    while True:
+        rows = conn.execute(text(
+            "SELECT id, media_files FROM posts WHERE id > :last_id AND media_files IS NOT NULL ORDER BY id LIMIT :size"
+        ), {'last_id': last_id, 'size': MIGRATION_BATCH_SIZE}).all()
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        for post_id, media_files in rows:
+            items = json.loads(media_files) if isinstance(media_files, str) else media_files
+            if not items or conn.execute(PostMedia.__table__.select().where(PostMedia.post_id == post_id)).first():
+                continue
+            for position, item in enumerate(items):
+                # Old rows carry no file_unique_id, MediaService.register falls back to file_id the same way
+                unique_id = item.get('file_unique_id') or item['file_id']
+                media_id = conn.execute(media_table.select().with_only_columns(media_table.c.id).where(
+                    media_table.c.file_unique_id == unique_id
+                )).scalar()
+                if media_id is None:
+                    media_id = conn.execute(media_table.insert().values(
+                        file_unique_id=unique_id, file_id=item['file_id'], type=item['type'], is_valid=True
+                    )).inserted_primary_key[0]
+                conn.execute(PostMedia.__table__.insert().values(post_id=post_id, media_id=media_id, position=position))
+            moved += 1
+
+    conn.execute(text("ALTER TABLE posts DROP COLUMN media_files"))
+    logger.info(f"Moved media of {moved} posts to post_media")
+
+def posts_autoincrement(conn: Connection):
+    """SQLite only: rebuild posts with AUTOINCREMENT so archived ids are never reused"""
+    from sqlalchemy import MetaData
+    from sqlalchemy.schema import CreateTable
+    from database.models import Base, Post
+
+    if conn.dialect.name != 'sqlite':
+        return
+    ddl = conn.execute(text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'posts'")).scalar()
+    if not ddl or 'AUTOINCREMENT' in ddl.upper():
+        return
+    # The documented SQLite way to change a table definition: create, copy, drop, rename
+    # A scratch copy of the models, so foreign keys resolve without touching Base.metadata
+    scratch = MetaData()
+    for table in Base.metadata.sorted_tables:
+        table.to_metadata(scratch)
+    rebuilt = Post.__table__.to_metadata(scratch, name='posts_rebuild')
+    rebuilt.indexes.clear()
+    conn.execute(CreateTable(rebuilt))
+    columns = ', '.join(name for name in rebuilt.columns.keys() if name in _columns(conn, 'posts'))
+    conn.execute(text(f"INSERT INTO posts_rebuild ({columns}) SELECT {columns} FROM posts"))
+    conn.execute(text("DROP TABLE posts"))
+    conn.execute(text("ALTER TABLE posts_rebuild RENAME TO posts"))
+    # Continue after archived posts too, their ids are gone from posts already
+    last_id = conn.execute(text(
+        "SELECT MAX(id) FROM (SELECT MAX(id) AS id FROM posts UNION ALL SELECT MAX(id) FROM posts_archive)"
+    )).scalar() or 0
+    conn.execute(text("DELETE FROM sqlite_sequence WHERE name = 'posts'"))
+    conn.execute(text("INSERT INTO sqlite_sequence (name, seq) VALUES ('posts', :seq)"), {'seq': last_id})
+    logger.info("Rebuilt posts with AUTOINCREMENT")
+
+def add_journal_step_key(conn: Connection):
+    """publish_journal.step_key, rows written before it are not matched on resume"""
+    if 'step_key' not in _columns(conn, 'publish_journal'):
+        conn.execute(text("ALTER TABLE publish_journal ADD COLUMN step_key VARCHAR(80)"))
+        logger.info("Added publish_journal.step_key")
+
+# Applied in order, after create_all has created the new tables they fill
+MIGRATIONS = [
+    add_post_recurrence,
+    move_post_texts,
+    move_post_media,
+    posts_autoincrement,
+    add_journal_step_key,
+]
+
+def run_migrations(engine: Engine):
+    """Bring tables created by an older version up to the current models"""
+    for step in MIGRATIONS:
+        with engine.begin() as conn:
+            step(conn)
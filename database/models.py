@@ -1,10 +1,19 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, Boolean, ForeignKey, JSON
+import zlib
+from sqlalchemy import Column, Integer, String, Text, Date, DateTime, Boolean, ForeignKey, JSON, Index, UniqueConstraint, LargeBinary
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from datetime import datetime
 
 Base = declarative_base()
 
+PREVIEW_LENGTH = 100
+
+def make_preview(text):
+    """Short plain prefix of a post text for listings"""
+    if not text:
+        return None
+    return text if len(text) <= PREVIEW_LENGTH else text[:PREVIEW_LENGTH - 3] + "..."
+
 class User(Base):
     __tablename__ = 'users'
     
@@ -34,17 +43,193 @@ class Post(Base):
     
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
-    original_text = Column(Text)
-    edited_text = Column(Text)
+    # Bodies live in text_blobs and are loaded only when original_text/edited_text is read
+    original_hash = Column(String(64), ForeignKey('text_blobs.hash'))
+    edited_hash = Column(String(64), ForeignKey('text_blobs.hash'))
+    preview = Column(String(PREVIEW_LENGTH))
     template_used = Column(String(255))
     custom_prompt = Column(Text)
-    media_files = Column(JSON)  # Store file_ids and types
     scheduled_time = Column(DateTime, nullable=False)
     published_time = Column(DateTime)
-    status = Column(String(50), default='draft')  # draft, scheduled, published, error
+    status = Column(String(50), default='draft')  # draft, scheduled, awaiting_approval, published, error, skipped
     target_channel = Column(String(255))
+    recurrence_id = Column(Integer, ForeignKey('recurrences.id'))
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     # Relationship
-    user = relationship("User", back_populates="posts") 
\ No newline at end of file
+    user = relationship("User", back_populates="posts")
+    recurrence = relationship("Recurrence", back_populates="posts")
+    targets = relationship("PostTarget", back_populates="post", cascade="all, delete-orphan")
+    media_items = relationship("PostMedia", order_by="PostMedia.position", cascade="all, delete-orphan")
+    original_blob = relationship("TextBlob", foreign_keys=[original_hash])
+    edited_blob = relationship("TextBlob", foreign_keys=[edited_hash])
+    
+    @property
+    def original_text(self):
+        return self.original_blob.text if self.original_blob else None
+    
+    @property
+    def edited_text(self):
+        return self.edited_blob.text if self.edited_blob else None
+    
+    # Scheduler window refill: status = 'scheduled' AND scheduled_time <= horizon
+    # AUTOINCREMENT: ids of archived (deleted) posts must never be handed out again
+    __table_args__ = (
+        Index('ix_posts_status_scheduled_time', 'status', 'scheduled_time'),
+        {'sqlite_autoincrement': True},
+    )
+
+class TextBlob(Base):
+    """Content-addressed post text, shared by original/edited versions and reposts"""
+    __tablename__ = 'text_blobs'
+    
+    hash = Column(String(64), primary_key=True)  # sha256 of the UTF-8 text
+    codec = Column(String(16), nullable=False, default='raw')  # raw, zlib, zstd
+    body = Column(LargeBinary, nullable=False)
+    size = Column(Integer)  # uncompressed bytes
+    created_at = Column(DateTime, default=datetime.utcnow)
+    
+    @property
+    def text(self) -> str:
+        if self.codec == 'zlib':
+            data = zlib.decompress(self.body)
+        elif self.codec == 'zstd':
+            import zstandard
+            data = zstandard.ZstdDecompressor().decompress(self.body)
+        else:
+            data = self.body
+        return data.decode('utf-8')
+
+class Media(Base):
+    """Telegram file registry, one row per file_unique_id with cached metadata"""
+    __tablename__ = 'media'
+    
+    id = Column(Integer, primary_key=True)
+    file_unique_id = Column(String(255), unique=True, nullable=False)
+    file_id = Column(String(255), nullable=False)  # latest file_id seen for this file
+    type = Column(String(20), nullable=False)  # photo, video
+    file_size = Column(Integer)
+    width = Column(Integer)
+    height = Column(Integer)
+    duration = Column(Integer)
+    mime_type = Column(String(100))
+    is_valid = Column(Boolean, default=True)
+    last_error = Column(Text)
+    validated_at = Column(DateTime)  # last successful or failed getFile check
+    created_at = Column(DateTime, default=datetime.utcnow)
+    
+    def to_dict(self) -> dict:
+        return {'type': self.type, 'file_id': self.file_id, 'file_unique_id': self.file_unique_id}
+
+class PostMedia(Base):
+    __tablename__ = 'post_media'
+    
+    id = Column(Integer, primary_key=True)
+    post_id = Column(Integer, ForeignKey('posts.id'), nullable=False, index=True)
+    media_id = Column(Integer, ForeignKey('media.id'), nullable=False)
+    position = Column(Integer, default=0)
+    
+    # Relationship
+    media = relationship("Media")
+
+class PostTarget(Base):
+    __tablename__ = 'post_targets'
+    
+    id = Column(Integer, primary_key=True)
+    post_id = Column(Integer, ForeignKey('posts.id'), nullable=False, index=True)
+    chat_id = Column(String(255), nullable=False, index=True)
+    status = Column(String(50), default='pending')  # pending, published, error
+    message_id = Column(Integer)
+    attempts = Column(Integer, default=0)
+    last_error = Column(Text)
+    next_attempt_at = Column(DateTime)  # UTC, set while a failed target waits for retry
+    published_time = Column(DateTime)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    
+    # Relationship
+    post = relationship("Post", back_populates="targets")
+
+class Recurrence(Base):
+    __tablename__ = 'recurrences'
+    
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
+    rule = Column(String(512), nullable=False)  # RRULE or 5-field cron expression
+    timezone = Column(String(64), default='UTC')
+    dtstart = Column(DateTime, nullable=False)  # UTC anchor for the rule
+    next_run = Column(DateTime)  # UTC time of the only materialized occurrence
+    last_run = Column(DateTime)
+    is_active = Column(Boolean, default=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    
+    # Relationship
+    # The post with status 'template' holds the content, each occurrence is a regular 'scheduled' post
+    posts = relationship("Post", back_populates="recurrence") 
+
+class PostArchive(Base):
+    """Published and failed posts moved out of the hot posts table by ArchiveService"""
+    __tablename__ = 'posts_archive'
+    
+    id = Column(Integer, primary_key=True)  # id of the original post, posts ids are never reused
+    user_id = Column(Integer, nullable=False, index=True)
+    original_hash = Column(String(64))  # text_blobs.hash
+    edited_hash = Column(String(64))
+    preview = Column(String(PREVIEW_LENGTH))
+    template_used = Column(String(255))
+    custom_prompt = Column(Text)
+    media_files = Column(JSON)
+    scheduled_time = Column(DateTime, nullable=False)
+    published_time = Column(DateTime)
+    status = Column(String(50))
+    target_channel = Column(String(255))
+    recurrence_id = Column(Integer)
+    targets = Column(JSON)  # [{chat_id, status, message_id, attempts, published_time}]
+    created_at = Column(DateTime)
+    archived_at = Column(DateTime, default=datetime.utcnow)
+
+class PostDailyStats(Base):
+    """Per-day post counts by final status, kept after the rows themselves are archived"""
+    __tablename__ = 'post_daily_stats'
+    
+    id = Column(Integer, primary_key=True)
+    day = Column(Date, nullable=False)  # UTC date of scheduled_time
+    status = Column(String(50), nullable=False)
+    posts = Column(Integer, default=0)
+    targets_published = Column(Integer, default=0)
+    targets_failed = Column(Integer, default=0)
+    
+    __table_args__ = (UniqueConstraint('day', 'status', name='uq_post_daily_stats_day_status'),)
+
+class AIUsage(Base):
+    """Token usage of one Deepseek call, linked to the post once the draft is confirmed"""
+    __tablename__ = 'ai_usage'
+    
+    id = Column(Integer, primary_key=True)
+    telegram_id = Column(Integer, index=True)
+    post_id = Column(Integer, index=True)  # posts.id or posts_archive.id, no FK so archiving can move posts
+    template = Column(String(255))  # template name, 'custom' for user prompts
+    speculative = Column(Boolean, default=False)
+    prompt_tokens = Column(Integer, default=0)
+    cached_tokens = Column(Integer, default=0)  # prompt tokens served from the provider's context cache
+    completion_tokens = Column(Integer, default=0)
+    latency_ms = Column(Integer)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+
+class PublishJournalEntry(Base):
+    """
+    Append-only log of Telegram calls made while publishing, one 'intent' row before each call
+    and a 'sent' or 'failed' row after it, so a restart skips the calls already confirmed
+    """
+    __tablename__ = 'publish_journal'
+    
+    id = Column(Integer, primary_key=True)
+    post_id = Column(Integer, nullable=False, index=True)  # no FK, rows are deleted when the post is archived
+    target_id = Column(Integer, nullable=False, index=True)
+    step = Column(Integer, nullable=False)  # position of the call in the target's request list, informational
+    step_key = Column(String(80))  # identity of the call, see services.publish_journal.step_keys
+    method = Column(String(50))
+    state = Column(String(20), nullable=False)  # intent, sent, failed
+    message_id = Column(Integer)
+    error = Column(Text)
+    created_at = Column(DateTime, default=datetime.utcnow)
\ No newline at end of file
@@ -0,0 +1,118 @@
+import logging
+from datetime import datetime, timedelta
+from aiogram import Router
+from aiogram.types import Message
+from aiogram.filters import Command, CommandObject
+
+from config import Config
+from database.database import get_db
+from services.ai_usage_service import AIUsageService
+from services.profiler import UpdateProfiler
+from services.renderer import TEXT_LIMIT, escape, tg_len
+from services.slot_service import SlotAllocator
+
+logger = logging.getLogger(__name__)
+router = Router()
+
+# Initialize handlers
+admin_handlers = None
+
+def is_admin(user_id: int) -> bool:
+    return bool(Config.ADMIN_USER_ID) and user_id == Config.ADMIN_USER_ID
+
+def init_admin_handlers(profiler: UpdateProfiler):
+    global admin_handlers
+    admin_handlers = AdminHandlers(profiler)
+    # Регистрация хендлеров вручную, роутер подключается раньше пользовательского
+    router.message(Command("profile"))(admin_handlers.profile_command)
+    router.message(Command("load"))(admin_handlers.load_command)
+    router.message(Command("ai_usage"))(admin_handlers.ai_usage_command)
+    return admin_handlers
+
+class AdminHandlers:
+    def __init__(self, profiler: UpdateProfiler):
+        self.profiler = profiler
+        self.slot_allocator = SlotAllocator()
+
+    async def profile_command(self, message: Message, command: CommandObject):
+        """Handle /profile N command: profile the next N updates"""
+        if not message.from_user or not is_admin(message.from_user.id):
+            await message.answer("⛔ Команда доступна только администратору.")
+            return
+        args = (command.args or '').strip()
+        updates = int(args) if args.isdigit() else 20
+        updates = max(1, min(updates, 1000))
+        if not self.profiler.arm(updates, message.from_user.id):
+            await message.answer("⏳ Профилирование уже идёт.")
+            return
+        logger.info(f"Profiling of {updates} updates requested by {message.from_user.id}")
+        await message.answer(f"📊 Профилирую следующие {updates} обновлений ({self.profiler.backend}).")
+
+    async def load_command(self, message: Message, command: CommandObject):
+        """Handle /load [channel] [hours] command: scheduled posts per 15 minutes"""
+        if not message.from_user or not is_admin(message.from_user.id):
+            await message.answer("⛔ Команда доступна только администратору.")
+            return
+        args = (command.args or '').split()
+        hours = int(args.pop()) if args and args[-1].isdigit() else 24
+        hours = max(1, min(hours, 168))
+        chat_id = args[0] if args else (Config.TARGET_CHANNEL_IDS[0] if Config.TARGET_CHANNEL_IDS else None)
+        if not chat_id:
+            await message.answer("Укажите канал: /load @channel [часы]")
+            return
+        slot_seconds = 900
+        now = datetime.utcnow()
+        start = now - timedelta(seconds=now.minute % 15 * 60 + now.second, microseconds=now.microsecond)
+        db_gen = get_db()
+        db = next(db_gen)
+        try:
+            load = self.slot_allocator.channel_load(db, chat_id, start, now + timedelta(hours=hours), slot_seconds)
+        finally:
+            db_gen.close()
+        busy = [(slot, count) for slot, count in load if count]
+        if not busy:
+            await message.answer(f"📭 В {escape(chat_id)} нет запланированных постов на {hours} ч.")
+            return
+        peak = max(count for _, count in busy)
+        text = f"📊 Нагрузка на {escape(chat_id)} по 15 минут (UTC), всего {sum(c for _, c in busy)}, пик {peak}:"
+        for slot, count in busy:
+            bar = '█' * max(1, round(count / peak * 20))
+            line = f"\n{slot.strftime('%d.%m %H:%M')} {bar} {count}"
+            # Long reports go out in several messages
+            if tg_len(text) + tg_len(line) > TEXT_LIMIT:
+                await message.answer(text)
+                text = line.lstrip('\n')
+            else:
+                text += line
+        await message.answer(text)
+
+    async def ai_usage_command(self, message: Message, command: CommandObject):
+        """Handle /ai_usage [days] command: Deepseek tokens, cache hits and cost per template"""
+        if not message.from_user or not is_admin(message.from_user.id):
+            await message.answer("⛔ Команда доступна только администратору.")
+            return
+        args = (command.args or '').strip()
+        days = max(1, min(int(args), 365)) if args.isdigit() else 7
+        db_gen = get_db()
+        db = next(db_gen)
+        try:
+            report = AIUsageService.report(db, days)
+        finally:
+            db_gen.close()
+        if not report:
+            await message.answer(f"🤖 За {days} дн. запросов к Deepseek не было.")
+            return
+        lines = [f"🤖 Deepseek за {days} дн.:"]
+        for row in report:
+            lines.append(
+                f"\n<b>{escape(row['template'])}</b>: {row['calls']} запр., в постах {row['used_in_posts']}\n"
+                f"токены: {row['prompt_tokens']} вход ({row['cache_hit_ratio']:.0%} из кэша), {row['completion_tokens']} выход\n"
+                f"стоимость: {row['cost']:.4f}"
+            )
+        total_prompt = sum(row['prompt_tokens'] for row in report)
+        total_cached = sum(row['cached_tokens'] for row in report)
+        lines.append(
+            f"\nИтого: {sum(row['cost'] for row in report):.4f}, "
+            f"попадания в кэш {total_cached / total_prompt if total_prompt else 0:.0%}"
+        )
+        await message.answer('\n'.join(lines))
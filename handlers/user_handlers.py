@@ -1,4 +1,5 @@
 import logging
+from typing import List
 from datetime import datetime
 from aiogram import Router, F
 from aiogram.types import Message, CallbackQuery
@@ -7,10 +8,16 @@ from aiogram.fsm.state import State, StatesGroup
 from aiogram.filters import Command
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 
-from database.database import get_db
-from database.models import User, Post, Template
+from database.database import get_db, store_text
+from database.models import User, Post, PostTarget, Template, make_preview
+from services.ai_usage_service import AIUsageService
 from services.deepseek_service import DeepseekService
 from services.scheduler_service import SchedulerService
+from services.recurrence_service import RecurrenceService
+from services.media_service import MediaGroupAggregator, MediaService, media_from_message
+from services.renderer import TEXT_LIMIT, collapsed, escape, tg_len
+from services.slot_service import SlotAllocator
+from services.speculative_editor import SpeculativeEditor
 from config import Config
 
 logger = logging.getLogger(__name__)
@@ -47,12 +54,18 @@ def init_user_handlers(scheduler_service: SchedulerService):
     router.callback_query(F.data == "re_edit")(user_handlers.handle_re_edit)
     router.callback_query(F.data == "confirm_publish")(user_handlers.handle_publish_confirmation)
     router.callback_query(F.data == "cancel")(user_handlers.handle_cancel)
+    router.callback_query(F.data.startswith("catchup_"))(user_handlers.handle_catchup_answer)
     return user_handlers
 
 class UserHandlers:
     def __init__(self, scheduler_service: SchedulerService):
         self.scheduler_service = scheduler_service
         self.deepseek_service = DeepseekService()
+        self.recurrence_service = RecurrenceService()
+        self.media_service = MediaService()
+        self.media_groups = MediaGroupAggregator(Config.MEDIA_GROUP_DELAY)
+        self.slot_allocator = SlotAllocator() if Config.SLOT_ALLOCATION_ENABLED else None
+        self.speculative_editor = SpeculativeEditor(self.deepseek_service) if Config.SPECULATIVE_EDITS_ENABLED else None
         
     # Удалены декораторы @router.message и @router.callback_query
     async def start_command(self, message: Message):
@@ -75,7 +88,9 @@ class UserHandlers:
                     )
                     db.add(user)
                     db.commit()
-                welcome_text = """
+            finally:
+                db_gen.close()
+            welcome_text = """
 🤖 Добро пожаловать в Scheduled Content Editor!
 
 Этот бот поможет вам:
@@ -91,10 +106,8 @@ class UserHandlers:
 /help - Показать справку
 /my_posts - Мои запланированные посты
 /cancel - Отменить текущую операцию
-                """
-                await message.answer(welcome_text)
-            finally:
-                db_gen.close()
+            """
+            await message.answer(welcome_text)
         except Exception as e:
             logger.error(f"Error in start command: {str(e)}")
             await message.answer("Произошла ошибка. Попробуйте позже.")
@@ -115,6 +128,10 @@ class UserHandlers:
 🕐 Формат времени: ДД.ММ.ГГГГ ЧЧ:ММ
 Пример: 15.07.2025 14:30
 
+🔁 Повторяющийся пост: cron или RRULE
+Пример: 0 9 * * * (каждый день в 09:00)
+Пример: FREQ=WEEKLY;BYDAY=MO;BYHOUR=10;BYMINUTE=0
+
 📋 Команды:
 /start - Начать работу
 /help - Эта справка
@@ -125,6 +142,7 @@ class UserHandlers:
         
     async def cancel_command(self, message: Message, state: FSMContext):
         """Handle /cancel command"""
+        self._cancel_speculation(message.from_user.id)
         await state.clear()
         await message.answer("❌ Операция отменена. Отправьте новый контент для создания поста.")
         
@@ -137,22 +155,27 @@ class UserHandlers:
             db_gen = get_db()
             db = next(db_gen)
             try:
-                user = db.query(User).filter(User.telegram_id == message.from_user.id).first()
-                if not user:
-                    await message.answer("Пользователь не найден. Используйте /start для регистрации.")
-                    return
-                scheduled_posts = self.scheduler_service.get_scheduled_posts(user.id)
-                if not scheduled_posts:
-                    await message.answer("У вас нет запланированных постов.")
-                    return
-                posts_text = "📋 Ваши запланированные посты:\n\n"
-                for i, post in enumerate(scheduled_posts, 1):
-                    text_preview = (post.edited_text or post.original_text)[:50] + "..."
-                    scheduled_time = post.scheduled_time.strftime("%d.%m.%Y %H:%M")
-                    posts_text += f"{i}. {text_preview}\n⏰ {scheduled_time}\n\n"
-                await message.answer(posts_text)
+                user = db.query(User.id).filter(User.telegram_id == message.from_user.id).first()
             finally:
                 db_gen.close()
+            if not user:
+                await message.answer("Пользователь не найден. Используйте /start для регистрации.")
+                return
+            scheduled_posts = self.scheduler_service.get_scheduled_posts(user.id)
+            if not scheduled_posts:
+                await message.answer("У вас нет запланированных постов.")
+                return
+            posts_text = "📋 Ваши запланированные посты:\n\n"
+            for i, post in enumerate(scheduled_posts, 1):
+                text_preview = escape(post.preview or "")
+                scheduled_time = post.scheduled_time.strftime("%d.%m.%Y %H:%M")
+                entry = f"{i}. {text_preview}\n⏰ {scheduled_time}\n\n"
+                # Long lists go out in several messages
+                if tg_len(posts_text) + tg_len(entry) > TEXT_LIMIT:
+                    await message.answer(posts_text)
+                    posts_text = ""
+                posts_text += entry
+            await message.answer(posts_text)
         except Exception as e:
             logger.error(f"Error in my_posts command: {str(e)}")
             await message.answer("Произошла ошибка при получении списка постов.")
@@ -194,35 +217,67 @@ class UserHandlers:
             
     async def _handle_initial_content(self, message: Message, state: FSMContext):
         """Handle initial content from user"""
+        if message.media_group_id:
+            # Album: wait for the remaining messages and build one draft from all of them
+            self.media_groups.add(message, lambda messages: self._handle_media_group(messages, state))
+            return
         try:
             # Extract text and media
             text = message.text or message.caption or ""
-            media_files = []
-            
-            if message.photo:
-                media_files.append({
-                    'type': 'photo',
-                    'file_id': message.photo[-1].file_id
-                })
-            elif message.video:
-                media_files.append({
-                    'type': 'video',
-                    'file_id': message.video.file_id
-                })
+            media_files = media_from_message(message)
                 
             # Store in state
             await state.update_data(
                 original_text=text,
-                media_files=media_files
+                media_files=media_files,
+                draft_started_at=datetime.utcnow()
             )
             
+            # Start the likely edit while the user looks at the keyboard
+            self._start_speculation(message.from_user.id, text)
+            
             # Ask for edit method
             await self._ask_for_edit_method(message, state)
             
         except Exception as e:
-            logger.error(f"Error handling initial content: {str(e)}")
+            logger.error(f"Error handling initial content: {str(e)}", extra={'user_id': message.from_user.id})
             await message.answer("Произошла ошибка при обработке контента. Попробуйте еще раз.")
             
+    async def _handle_media_group(self, messages: List[Message], state: FSMContext):
+        """Handle all messages of an album as one post"""
+        try:
+            # Telegram puts the album caption on one of the messages, usually the first
+            text = next((message.caption for message in messages if message.caption), "")
+            media_files = [item for message in messages for item in media_from_message(message)]
+            
+            await state.update_data(
+                original_text=text,
+                media_files=media_files,
+                draft_started_at=datetime.utcnow()
+            )
+            self._start_speculation(messages[0].from_user.id, text)
+            await self._ask_for_edit_method(messages[0], state)
+        except Exception as e:
+            logger.error(f"Error handling media group: {str(e)}", extra={'user_id': messages[0].from_user.id})
+            await messages[0].answer("Произошла ошибка при обработке альбома. Попробуйте еще раз.")
+            
+    def _start_speculation(self, telegram_id: int, text: str):
+        """Speculatively edit new content with the user's most likely template"""
+        if not self.speculative_editor or not text:
+            return
+        db_gen = get_db()
+        db = next(db_gen)
+        try:
+            template = self.speculative_editor.pick_template(db, telegram_id)
+        finally:
+            db_gen.close()
+        if template:
+            self.speculative_editor.speculate(telegram_id, text, template[1], template[0])
+            
+    def _cancel_speculation(self, telegram_id: int):
+        if self.speculative_editor:
+            self.speculative_editor.cancel(telegram_id)
+            
     async def _ask_for_edit_method(self, message: Message, state: FSMContext):
         """Ask user to choose edit method"""
         builder = InlineKeyboardBuilder()
@@ -242,26 +297,27 @@ class UserHandlers:
             db_gen = get_db()
             db = next(db_gen)
             try:
-                templates = db.query(Template).filter(Template.is_default == True).order_by(Template.id).limit(3).all()
-                builder = InlineKeyboardBuilder()
-                for template in templates:
-                    builder.button(text=template.name, callback_data=f"template_{template.id}")
-                builder.button(text="❌ Отмена", callback_data="cancel")
-                if callback.message and hasattr(callback.message, "edit_text"):
-                    await callback.message.edit_text(
-                        "Выберите шаблон для редактирования:",
-                        reply_markup=builder.as_markup()
-                    )
-                elif callback.message and hasattr(callback.message, "answer"):
-                    await callback.message.answer(
-                        "Выберите шаблон для редактирования:",
-                        reply_markup=builder.as_markup()
-                    )
-                else:
-                    logger.error("callback.message is None or has no edit_text/answer method")
-                await state.set_state(PostCreationStates.waiting_for_template_choice)
+                templates = db.query(Template.id, Template.name).filter(Template.is_default == True).order_by(Template.id).limit(3).all()
             finally:
+                # Release the connection before any Telegram round-trip
                 db_gen.close()
+            builder = InlineKeyboardBuilder()
+            for template in templates:
+                builder.button(text=template.name, callback_data=f"template_{template.id}")
+            builder.button(text="❌ Отмена", callback_data="cancel")
+            if callback.message and hasattr(callback.message, "edit_text"):
+                await callback.message.edit_text(
+                    "Выберите шаблон для редактирования:",
+                    reply_markup=builder.as_markup()
+                )
+            elif callback.message and hasattr(callback.message, "answer"):
+                await callback.message.answer(
+                    "Выберите шаблон для редактирования:",
+                    reply_markup=builder.as_markup()
+                )
+            else:
+                logger.error("callback.message is None or has no edit_text/answer method")
+            await state.set_state(PostCreationStates.waiting_for_template_choice)
         except Exception as e:
             logger.error(f"Error in template choice: {str(e)}")
             if callback.message and hasattr(callback.message, "answer"):
@@ -283,45 +339,50 @@ class UserHandlers:
             db_gen = get_db()
             db = next(db_gen)
             try:
-                template = db.query(Template).filter(Template.id == template_id).first()
-                
-                if not template:
-                    if callback.message and hasattr(callback.message, "answer"):
-                        await callback.message.answer("❌ Шаблон не найден.")
-                    return
-                
-                # Get original text
-                data = await state.get_data()
-                original_text = data.get('original_text', '')
-                
-                if not original_text:
-                    if callback.message and hasattr(callback.message, "answer"):
-                        await callback.message.answer("Текст для редактирования не найден.")
-                    return
-                
-                # Edit text using Deepseek
-                await callback.message.answer("🔄 Редактирую текст...")
-                edited_text = await self.deepseek_service.edit_text(original_text, template.prompt)
-                
-                if edited_text:
-                    await state.update_data(
-                        edited_text=edited_text,
-                        template_used=template.name,
-                        custom_prompt=None
-                    )
-                    await self._show_edit_preview(callback.message, original_text, edited_text, state)
-                else:
-                    if callback.message and hasattr(callback.message, "answer"):
-                        await callback.message.answer("❌ Ошибка при редактировании текста. Попробуйте другой шаблон или свой промпт.")
+                template = db.query(Template.name, Template.prompt).filter(Template.id == template_id).first()
             finally:
+                # Release the connection before the long Deepseek call
                 db_gen.close()
+                
+            if not template:
+                if callback.message and hasattr(callback.message, "answer"):
+                    await callback.message.answer("❌ Шаблон не найден.")
+                return
+            
+            # Get original text
+            data = await state.get_data()
+            original_text = data.get('original_text', '')
+            
+            if not original_text:
+                if callback.message and hasattr(callback.message, "answer"):
+                    await callback.message.answer("Текст для редактирования не найден.")
+                return
+            
+            # Edit text using Deepseek
+            await callback.message.answer("🔄 Редактирую текст...")
+            if self.speculative_editor:
+                edited_text = await self.speculative_editor.edit(callback.from_user.id, original_text, template.prompt, template.name)
+            else:
+                edited_text = await self.deepseek_service.edit_text(original_text, template.prompt, callback.from_user.id, template.name)
+            
+            if edited_text:
+                await state.update_data(
+                    edited_text=edited_text,
+                    template_used=template.name,
+                    custom_prompt=None
+                )
+                await self._show_edit_preview(callback.message, original_text, edited_text, state)
+            else:
+                if callback.message and hasattr(callback.message, "answer"):
+                    await callback.message.answer("❌ Ошибка при редактировании текста. Попробуйте другой шаблон или свой промпт.")
         except Exception as e:
-            logger.error(f"Error in template selection: {str(e)}")
+            logger.error(f"Error in template selection: {str(e)}", extra={'user_id': callback.from_user.id})
             if callback.message and hasattr(callback.message, "answer"):
                 await callback.message.answer("Произошла ошибка при редактировании.")
             
     async def handle_custom_prompt(self, callback: CallbackQuery, state: FSMContext):
         """Handle custom prompt request"""
+        self._cancel_speculation(callback.from_user.id)
         await callback.message.edit_text(
             "✏️ Введите ваш промпт для редактирования текста:\n\n"
             "Пример: Перепиши этот текст в формальном стиле"
@@ -341,7 +402,7 @@ class UserHandlers:
                 
             # Edit text using Deepseek
             await message.answer("🔄 Редактирую текст...")
-            edited_text = await self.deepseek_service.edit_text(original_text, custom_prompt)
+            edited_text = await self.deepseek_service.edit_text(original_text, custom_prompt, message.from_user.id)
             
             if edited_text:
                 await state.update_data(
@@ -354,11 +415,12 @@ class UserHandlers:
                 await message.answer("❌ Ошибка при редактировании текста. Попробуйте другой промпт.")
                 
         except Exception as e:
-            logger.error(f"Error in custom prompt: {str(e)}")
+            logger.error(f"Error in custom prompt: {str(e)}", extra={'user_id': message.from_user.id})
             await message.answer("Произошла ошибка при редактировании.")
             
     async def handle_skip_edit(self, callback: CallbackQuery, state: FSMContext):
         """Handle skip edit option"""
+        self._cancel_speculation(callback.from_user.id)
         data = await state.get_data()
         original_text = data.get('original_text', '')
         
@@ -376,10 +438,10 @@ class UserHandlers:
 📝 Предварительный просмотр:
 
 📄 Исходный текст:
-{original_text}
+{collapsed(original_text)}
 
 ✏️ Отредактированный текст:
-{edited_text}
+{collapsed(edited_text)}
 
 Подтвердите редактирование:
         """
@@ -396,7 +458,10 @@ class UserHandlers:
         """Handle edit confirmation"""
         await callback.message.edit_text(
             "⏰ Введите время публикации в формате ЧЧ:ММ (UTC)\n\n"
-            "Пример: 14:30"
+            "Пример: 14:30\n\n"
+            f"🔁 Для повторяющегося поста укажите cron или RRULE ({Config.TIMEZONE}):\n"
+            "Пример: 0 9 * * *\n"
+            "Пример: FREQ=WEEKLY;BYDAY=MO;BYHOUR=10;BYMINUTE=0"
         )
         await state.set_state(PostCreationStates.waiting_for_schedule_time)
         
@@ -409,6 +474,9 @@ class UserHandlers:
         from datetime import datetime, time, timedelta
         try:
             time_str = message.text.strip()
+            if self.recurrence_service.is_rule(time_str):
+                await self._handle_recurrence_rule(message, state, time_str)
+                return
             # Parse time only
             try:
                 user_time = datetime.strptime(time_str, "%H:%M").time()
@@ -422,15 +490,49 @@ class UserHandlers:
             scheduled_datetime = datetime.combine(today, user_time)
             # Если время уже прошло — публикуем сразу
             if scheduled_datetime <= now_utc:
-                await state.update_data(scheduled_time=now_utc)
+                scheduled_datetime = now_utc
                 await message.answer("⏰ Выбранное время уже прошло, пост будет опубликован сразу после подтверждения.")
-            else:
-                await state.update_data(scheduled_time=scheduled_datetime)
+            adjusted = self._allocate_slot(scheduled_datetime)
+            if adjusted != scheduled_datetime:
+                await message.answer(
+                    f"⏰ В это время в канале уже есть публикации, пост сдвинут на {adjusted.strftime('%H:%M:%S')} (UTC)."
+                )
+            await state.update_data(scheduled_time=adjusted, requested_time=scheduled_datetime, recurrence_rule=None)
             await self._show_final_preview(message, state)
         except Exception as e:
             logger.error(f"Error handling schedule time: {str(e)}")
             await message.answer("Произошла ошибка при обработке времени.")
             
+    def _allocate_slot(self, requested: datetime) -> datetime:
+        """Spread posts to the target channels when slot allocation is enabled"""
+        if not self.slot_allocator:
+            return requested
+        db_gen = get_db()
+        db = next(db_gen)
+        try:
+            return self.slot_allocator.allocate(db, Config.TARGET_CHANNEL_IDS, requested)
+        finally:
+            db_gen.close()
+            
+    async def _handle_recurrence_rule(self, message: Message, state: FSMContext, rule: str):
+        """Handle cron/RRULE input for a recurring post"""
+        try:
+            now_utc = datetime.utcnow()
+            first_time = self.recurrence_service.next_occurrence(rule, Config.TIMEZONE, now_utc, now_utc)
+        except Exception as e:
+            logger.info(f"Invalid recurrence rule '{rule}': {str(e)}")
+            await message.answer(
+                "❌ Не удалось разобрать правило повторения. Используйте cron (например, 0 9 * * *) "
+                "или RRULE (например, FREQ=DAILY;BYHOUR=9;BYMINUTE=0)"
+            )
+            return
+        if first_time is None:
+            await message.answer("❌ Правило повторения не даёт ни одной даты в будущем.")
+            return
+        # The same anchor at confirmation, so the scheduled date is the one shown in the preview
+        await state.update_data(scheduled_time=first_time, recurrence_rule=rule, recurrence_dtstart=now_utc)
+        await self._show_final_preview(message, state)
+            
     async def _show_final_preview(self, message: Message, state: FSMContext):
         """Show final post preview"""
         try:
@@ -439,14 +541,16 @@ class UserHandlers:
             media_count = len(data.get('media_files', []))
             scheduled_time = data.get('scheduled_time')
             preview_time = scheduled_time.strftime("%d.%m.%Y %H:%M") if scheduled_time else "не указано"
+            recurrence_rule = data.get('recurrence_rule')
+            recurrence_line = f"\n🔁 Повтор ({Config.TIMEZONE}): {escape(recurrence_rule)}" if recurrence_rule else ""
             preview_text = f"""
 📋 Финальный пост:
 
 📝 Текст:
-{text_to_publish}
+{collapsed(text_to_publish, TEXT_LIMIT - 500)}
 
 📎 Медиа: {media_count} файл(ов)
-⏰ Время публикации (UTC): {preview_time}
+⏰ Время публикации (UTC): {preview_time}{recurrence_line}
 
 Подтвердите публикацию:
             """
@@ -476,27 +580,56 @@ class UserHandlers:
                     await callback.message.answer("Пользователь не найден. Используйте /start для регистрации.")
                     return
                 
-                # Create post
+                # Another post may have taken the previewed slot meanwhile, allocate from the requested time again
+                scheduled_time = data.get('scheduled_time')
+                if self.slot_allocator and data.get('requested_time') and not data.get('recurrence_rule'):
+                    scheduled_time = self.slot_allocator.allocate(db, Config.TARGET_CHANNEL_IDS, data['requested_time'])
+                
+                # Create post, an edit identical to the original is not stored twice
+                original_text = data.get('original_text', '')
+                edited_text = data.get('edited_text')
+                if edited_text == original_text:
+                    edited_text = None
                 post = Post(
                     user_id=user.id,
-                    original_text=data.get('original_text', ''),
-                    edited_text=data.get('edited_text'),
+                    original_hash=store_text(db, original_text),
+                    edited_hash=store_text(db, edited_text),
+                    preview=make_preview(edited_text or original_text),
                     template_used=data.get('template_used'),
                     custom_prompt=data.get('custom_prompt'),
-                    media_files=data.get('media_files', []),
-                    scheduled_time=data.get('scheduled_time'),
+                    scheduled_time=scheduled_time,
                     target_channel=Config.TARGET_CHANNEL_ID,
+                    targets=[PostTarget(chat_id=chat_id) for chat_id in Config.TARGET_CHANNEL_IDS],
                     status='scheduled'
                 )
                 
+                self.media_service.attach(db, post, data.get('media_files', []))
                 db.add(post)
-                db.commit()
+                
+                # AI calls made while drafting are accounted to this post
+                if data.get('draft_started_at'):
+                    db.flush()
+                    AIUsageService.attach_to_post(db, callback.from_user.id, post.id, data['draft_started_at'])
+                
+                recurrence_rule = data.get('recurrence_rule')
+                if recurrence_rule:
+                    # The post becomes the recurrence template, only the next occurrence is scheduled
+                    db.flush()
+                    post = self.recurrence_service.create_recurrence(
+                        db, post, recurrence_rule, dtstart=data.get('recurrence_dtstart')
+                    )
+                    if not post:
+                        await callback.message.answer("❌ Правило повторения не даёт ни одной даты в будущем.")
+                        return
+                else:
+                    db.commit()
                 
                 # Schedule post
                 self.scheduler_service.schedule_post(post)
                 
+                recurrence_note = f"\n🔁 Повтор: {escape(recurrence_rule)}" if recurrence_rule else ""
                 await callback.message.edit_text(
-                    f"✅ Пост запланирован на {data.get('scheduled_time').strftime('%d.%m.%Y %H:%M')}!\n\n"
+                    f"✅ Пост запланирован на {post.scheduled_time.strftime('%d.%m.%Y %H:%M')}!{recurrence_note}\n\n"
                     f"Вы получите уведомление после публикации."
                 )
                 
@@ -504,11 +637,34 @@ class UserHandlers:
             finally:
                 db_gen.close()
         except Exception as e:
-            logger.error(f"Error confirming publish: {str(e)}")
+            logger.error(f"Error confirming publish: {str(e)}", extra={'user_id': callback.from_user.id})
             if callback.message and hasattr(callback.message, "answer"):
                 await callback.message.answer("Произошла ошибка при планировании поста.")
             
     async def handle_cancel(self, callback: CallbackQuery, state: FSMContext):
         """Handle cancel action"""
+        self._cancel_speculation(callback.from_user.id)
         await state.clear()
-        await callback.message.edit_text("❌ Операция отменена. Отправьте новый контент для создания поста.") 
\ No newline at end of file
+        await callback.message.edit_text("❌ Операция отменена. Отправьте новый контент для создания поста.") 
+
+    async def handle_catchup_answer(self, callback: CallbackQuery):
+        """Handle the author's answer about a post overdue after downtime"""
+        parts = callback.data.split("_")
+        if len(parts) != 3 or not parts[2].isdigit():
+            await callback.answer("Некорректные данные.")
+            return
+        publish = parts[1] == "publish"
+        try:
+            post_id = self.scheduler_service.catchup_service.resolve(int(parts[2]), callback.from_user.id, publish)
+        except Exception as e:
+            logger.error(f"Error resolving overdue post: {str(e)}")
+            await callback.answer("Произошла ошибка. Попробуйте позже.")
+            return
+        await callback.answer()
+        if post_id:
+            self.scheduler_service.publish_now(post_id)
+            await callback.message.edit_text("✅ Пост будет опубликован в ближайшее время.")
+        elif publish:
+            await callback.message.edit_text("Пост уже обработан.")
+        else:
+            await callback.message.edit_text("⏭ Пост пропущен.")
@@ -0,0 +1,89 @@
+import copy
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+from datetime import datetime, timezone
+from typing import List, Optional, Tuple
+
+from config import Config
+
+# Extra attributes copied into JSON records, e.g. logger.info("...", extra={'post_id': post.id})
+STRUCTURED_FIELDS = ('post_id', 'user_id', 'target', 'latency_ms', 'update_id', 'template')
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line with the structured fields that are present on the record"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for field in STRUCTURED_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class RecordQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that leaves formatting to the listener's handlers
+
+    The stock prepare() renders the traceback into the message and clears exc_info, so JsonFormatter
+    never saw an exception. The queue is in-process, the record only needs its arguments merged.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+def queue_handlers(handlers: List[logging.Handler]) -> Tuple[logging.Handler, logging.handlers.QueueListener]:
+    """Wrap handlers behind a QueueHandler, the returned listener writes on a background thread"""
+    log_queue = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    return RecordQueueHandler(log_queue), listener
+
+def _file_handler() -> logging.Handler:
+    if Config.LOG_ROTATE_WHEN:
+        return logging.handlers.TimedRotatingFileHandler(
+            Config.LOG_FILE, when=Config.LOG_ROTATE_WHEN, backupCount=Config.LOG_BACKUP_COUNT, encoding='utf-8'
+        )
+    return logging.handlers.RotatingFileHandler(
+        Config.LOG_FILE, maxBytes=Config.LOG_MAX_BYTES, backupCount=Config.LOG_BACKUP_COUNT, encoding='utf-8'
+    )
+
+def setup_logging() -> Optional[logging.handlers.QueueListener]:
+    """
+    Configure the root logger from Config
+
+    Returns:
+        The queue listener to stop on shutdown, None when LOG_ASYNC is off
+    """
+    formatter = JsonFormatter() if Config.LOG_FORMAT == 'json' else logging.Formatter(TEXT_FORMAT)
+    handlers = [_file_handler(), logging.StreamHandler(sys.stdout)]
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    root = logging.getLogger()
+    root.setLevel(getattr(logging, Config.LOG_LEVEL))
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+
+    if not Config.LOG_ASYNC:
+        for handler in handlers:
+            root.addHandler(handler)
+        return None
+
+    queue_handler, listener = queue_handlers(handlers)
+    root.addHandler(queue_handler)
+    return listener
@@ -2,32 +2,66 @@ import asyncio
 import logging
 import sys
 from aiogram import Bot, Dispatcher
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.enums import ParseMode
 
 from config import Config
+from logging_config import setup_logging
 from database.database import init_db, create_default_templates, get_db
 from services.scheduler_service import SchedulerService
-from handlers.user_handlers import router as user_router, init_user_handlers
+from services.publisher_pool import PublisherPool
+from services.archive_service import ArchiveService
+from services.media_service import MediaService
+from services.metrics import MetricsServer, TelegramMetricsMiddleware
+from services.tracing import tracer, UpdateTracingMiddleware, HandlerTracingMiddleware, TelegramTracingMiddleware
+from services.profiler import update_profiler, ProfilingMiddleware
+from services.throttling import ThrottlingMiddleware
+from handlers.user_handlers import router as user_router, init_user_handlers, PostCreationStates
+from handlers.admin_handlers import router as admin_router, init_admin_handlers
 
 # Configure logging
-logging.basicConfig(
-    level=getattr(logging, Config.LOG_LEVEL),
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('bot.log'),
-        logging.StreamHandler(sys.stdout)
-    ]
-)
+log_listener = setup_logging()
 
 logger = logging.getLogger(__name__)
 
 class ScheduledContentEditorBot:
     def __init__(self):
-        self.bot = Bot(token=Config.BOT_TOKEN, parse_mode=ParseMode.HTML)
+        self.bot = self._make_bot(Config.BOT_TOKEN)
         self.dp = Dispatcher(storage=MemoryStorage())
-        self.scheduler_service = SchedulerService(self.bot)
+        # Publishing bursts go through separate tokens so they do not eat into the interactive bot's limits
+        self.publisher_pool = PublisherPool(self.bot, [self._make_bot(token) for token in Config.PUBLISHER_BOT_TOKENS])
+        self.scheduler_service = SchedulerService(self.bot, self.publisher_pool)
+        self.archive_service = ArchiveService() if Config.ARCHIVE_ENABLED else None
+        self.media_service = MediaService(self.bot) if Config.MEDIA_VALIDATION_ENABLED else None
+        self.metrics_server = None
+        self.background_tasks = []
+        bots = [self.bot] + [publisher.bot for publisher in self.publisher_pool.publishers]
+        if Config.METRICS_ENABLED:
+            for bot in bots:
+                bot.session.middleware(TelegramMetricsMiddleware())
+            self.metrics_server = MetricsServer(Config.METRICS_HOST, Config.METRICS_PORT, self.dp.storage)
         self.user_handlers = init_user_handlers(self.scheduler_service)
+        self.admin_handlers = init_admin_handlers(update_profiler)
+        self.dp.update.outer_middleware(ProfilingMiddleware(update_profiler))
+        if Config.THROTTLE_ENABLED:
+            # Text in these states starts a new draft
+            self.dp.update.outer_middleware(ThrottlingMiddleware(coalesce_states=(
+                None, PostCreationStates.waiting_for_content.state, PostCreationStates.waiting_for_edit_method.state
+            )))
+        if Config.TRACING_ENABLED:
+            tracer.configure(Config.TRACING_EXPORTER, Config.TRACING_FILE)
+            for bot in bots:
+                bot.session.middleware(TelegramTracingMiddleware())
+            self.dp.update.outer_middleware(UpdateTracingMiddleware())
+            user_router.message.middleware(HandlerTracingMiddleware())
+            user_router.callback_query.middleware(HandlerTracingMiddleware())
+        
+    @staticmethod
+    def _make_bot(token: str) -> Bot:
+        session = AiohttpSession(api=TelegramAPIServer.from_base(Config.TELEGRAM_API_URL)) if Config.TELEGRAM_API_URL else None
+        return Bot(token=token, parse_mode=ParseMode.HTML, session=session)
         
     async def start(self):
         """Start the bot"""
@@ -37,21 +71,33 @@ class ScheduledContentEditorBot:
             init_db()
             
             # Create default templates
-            db = next(get_db())
-            create_default_templates(db)
+            db_gen = get_db()
+            try:
+                create_default_templates(next(db_gen))
+            finally:
+                db_gen.close()
             
-            # Test Deepseek API connection
-            from services.deepseek_service import DeepseekService
-            deepseek_service = DeepseekService()
-            if await deepseek_service.test_connection():
-                logger.info("Deepseek API connection successful")
-            else:
-                logger.warning("Deepseek API connection failed. Check your API key.")
+            # Check Deepseek API in the background, a slow API must not delay polling
+            if Config.DEEPSEEK_STARTUP_PROBE:
+                self.background_tasks.append(asyncio.create_task(self._probe_deepseek()))
+                
+            # Start metrics endpoint
+            if self.metrics_server:
+                await self.metrics_server.start()
                 
-            # Start scheduler service
+            # Start scheduler service (warms up in the background)
             await self.scheduler_service.start()
             
-            # Register routers
+            # Move old finished posts out of the posts table
+            if self.archive_service:
+                await self.archive_service.start()
+                
+            # Catch expired media before publish time
+            if self.media_service:
+                await self.media_service.start()
+            
+            # Register routers (admin commands go first, the user router catches all text)
+            self.dp.include_router(admin_router)
             self.dp.include_router(user_router)
             
             # Start polling
@@ -62,10 +108,27 @@ class ScheduledContentEditorBot:
             logger.error(f"Error starting bot: {str(e)}")
             raise
             
+    async def _probe_deepseek(self):
+        """Log Deepseek API availability"""
+        from services.deepseek_service import DeepseekService
+        if await DeepseekService().probe():
+            logger.info("Deepseek API connection successful")
+        else:
+            logger.warning("Deepseek API connection failed. Check your API key.")
+            
     async def stop(self):
         """Stop the bot"""
         try:
+            for task in self.background_tasks:
+                task.cancel()
             await self.scheduler_service.stop()
+            if self.archive_service:
+                await self.archive_service.stop()
+            if self.media_service:
+                await self.media_service.stop()
+            if self.metrics_server:
+                await self.metrics_server.stop()
+            await self.publisher_pool.close()
             await self.bot.session.close()
             logger.info("Bot stopped")
         except Exception as e:
@@ -83,6 +146,9 @@ async def main():
         logger.error(f"Unexpected error: {str(e)}")
     finally:
         await bot.stop()
+        tracer.shutdown()
+        if log_listener:
+            log_listener.stop()
 
 if __name__ == "__main__":
     # Check required configuration
@@ -0,0 +1,94 @@
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from config import Config
+from database.database import get_db
+from database.models import AIUsage
+
+logger = logging.getLogger(__name__)
+
+def parse_usage(usage: dict) -> Tuple[int, int, int]:
+    """
+    (prompt, cached, completion) tokens from a chat completions usage object
+
+    Deepseek reports prompt_cache_hit_tokens, OpenAI-compatible APIs prompt_tokens_details.cached_tokens
+    """
+    prompt_tokens = usage.get('prompt_tokens') or 0
+    cached_tokens = usage.get('prompt_cache_hit_tokens')
+    if cached_tokens is None:
+        cached_tokens = (usage.get('prompt_tokens_details') or {}).get('cached_tokens') or 0
+    return prompt_tokens, cached_tokens, usage.get('completion_tokens') or 0
+
+def cost(prompt_tokens: int, cached_tokens: int, completion_tokens: int) -> float:
+    """Price of a call in DEEPSEEK_PRICE_* units (per million tokens)"""
+    return (
+        cached_tokens * Config.DEEPSEEK_PRICE_CACHE_HIT
+        + (prompt_tokens - cached_tokens) * Config.DEEPSEEK_PRICE_CACHE_MISS
+        + completion_tokens * Config.DEEPSEEK_PRICE_OUTPUT
+    ) / 1_000_000
+
+class AIUsageService:
+    """Persists per-call token usage and reports cache hit ratio and cost per template"""
+
+    @staticmethod
+    def record(telegram_id: Optional[int], template: Optional[str], speculative: bool,
+               tokens: Tuple[int, int, int], latency_ms: int):
+        db_gen = get_db()
+        db = next(db_gen)
+        try:
+            prompt_tokens, cached_tokens, completion_tokens = tokens
+            db.add(AIUsage(
+                telegram_id=telegram_id,
+                template=template,
+                speculative=speculative,
+                prompt_tokens=prompt_tokens,
+                cached_tokens=cached_tokens,
+                completion_tokens=completion_tokens,
+                latency_ms=latency_ms
+            ))
+            db.commit()
+        except Exception as e:
+            logger.error(f"Error recording AI usage: {str(e)}")
+        finally:
+            db_gen.close()
+
+    @staticmethod
+    def attach_to_post(db: Session, telegram_id: int, post_id: int, since: datetime):
+        """Link the user's calls made while drafting the post"""
+        db.query(AIUsage).filter(
+            AIUsage.telegram_id == telegram_id,
+            AIUsage.post_id.is_(None),
+            AIUsage.created_at >= since
+        ).update({AIUsage.post_id: post_id}, synchronize_session=False)
+
+    @staticmethod
+    def report(db: Session, days: int) -> List[Dict]:
+        """Calls, tokens, cache hit ratio and cost per template over the last days"""
+        rows = db.query(
+            AIUsage.template,
+            func.count(AIUsage.id),
+            func.sum(AIUsage.prompt_tokens),
+            func.sum(AIUsage.cached_tokens),
+            func.sum(AIUsage.completion_tokens),
+            func.count(AIUsage.post_id)
+        ).filter(
+            AIUsage.created_at >= datetime.utcnow() - timedelta(days=days)
+        ).group_by(AIUsage.template).all()
+        report = []
+        for template, calls, prompt_tokens, cached_tokens, completion_tokens, used in rows:
+            prompt_tokens, cached_tokens, completion_tokens = prompt_tokens or 0, cached_tokens or 0, completion_tokens or 0
+            report.append({
+                'template': template or 'custom',
+                'calls': calls,
+                'used_in_posts': used,
+                'prompt_tokens': prompt_tokens,
+                'cached_tokens': cached_tokens,
+                'completion_tokens': completion_tokens,
+                'cache_hit_ratio': cached_tokens / prompt_tokens if prompt_tokens else 0.0,
+                'cost': cost(prompt_tokens, cached_tokens, completion_tokens)
+            })
+        return sorted(report, key=lambda row: row['cost'], reverse=True)
@@ -0,0 +1,181 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Tuple
+
+from sqlalchemy.orm import Session, selectinload
+
+from config import Config
+from database.database import engine, get_db
+from database.models import Post, PostMedia, PostTarget, PostArchive, PostDailyStats, PublishJournalEntry
+
+logger = logging.getLogger(__name__)
+
+ARCHIVED_STATUSES = ('published', 'error', 'skipped')
+
+class ArchiveService:
+    """Moves finished posts older than ARCHIVE_AFTER_DAYS into posts_archive and keeps daily stats"""
+
+    def __init__(self):
+        self.running = False
+        self.task = None
+        self.last_maintenance = None
+
+    async def start(self):
+        """Start the background archiver"""
+        self.running = True
+        self.task = asyncio.create_task(self._main_loop())
+        logger.info("Archive service started")
+
+    async def stop(self):
+        """Stop the background archiver"""
+        self.running = False
+        if self.task:
+            self.task.cancel()
+        logger.info("Archive service stopped")
+
+    async def _main_loop(self):
+        while self.running:
+            try:
+                # Archiving and maintenance are blocking DB work, keep them off the event loop
+                archived = await asyncio.to_thread(self.archive_old_posts)
+                if archived:
+                    logger.info(f"Archived {archived} posts older than {Config.ARCHIVE_AFTER_DAYS} days")
+                if self._maintenance_due():
+                    await asyncio.to_thread(self.run_maintenance)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error in archive loop: {str(e)}")
+            await asyncio.sleep(Config.ARCHIVE_INTERVAL)
+
+    def _maintenance_due(self) -> bool:
+        if Config.DB_MAINTENANCE_INTERVAL <= 0:
+            return False
+        if Config.DB_MAINTENANCE_HOUR >= 0 and datetime.utcnow().hour != Config.DB_MAINTENANCE_HOUR:
+            return False
+        return self.last_maintenance is None or time.monotonic() - self.last_maintenance >= Config.DB_MAINTENANCE_INTERVAL
+
+    def archive_old_posts(self) -> int:
+        """Archive finished posts in batches until none are left, returns the number of archived posts"""
+        cutoff = datetime.utcnow() - timedelta(days=Config.ARCHIVE_AFTER_DAYS)
+        total = 0
+        while True:
+            db_gen = get_db()
+            try:
+                moved = self.archive_batch(next(db_gen), cutoff, Config.ARCHIVE_BATCH_SIZE)
+            finally:
+                db_gen.close()
+            total += moved
+            if moved < Config.ARCHIVE_BATCH_SIZE:
+                break
+        return total
+
+    def archive_batch(self, db: Session, cutoff: datetime, batch_size: int) -> int:
+        """
+        Move one batch of finished posts scheduled before cutoff, in a single transaction
+
+        Returns:
+            Number of posts moved
+        """
+        posts = db.query(Post).options(
+            selectinload(Post.media_items).selectinload(PostMedia.media)
+        ).filter(
+            Post.status.in_(ARCHIVED_STATUSES),
+            Post.scheduled_time < cutoff
+        ).order_by(Post.scheduled_time).limit(batch_size).all()
+        if not posts:
+            return 0
+
+        post_ids = [post.id for post in posts]
+        targets_by_post: Dict[int, List[PostTarget]] = {}
+        for target in db.query(PostTarget).filter(PostTarget.post_id.in_(post_ids)):
+            targets_by_post.setdefault(target.post_id, []).append(target)
+
+        archive_rows = []
+        stats: Dict[Tuple, List[int]] = {}
+        now = datetime.utcnow()
+        for post in posts:
+            targets = targets_by_post.get(post.id, [])
+            archive_rows.append({
+                'id': post.id,
+                'user_id': post.user_id,
+                'original_hash': post.original_hash,
+                'edited_hash': post.edited_hash,
+                'preview': post.preview,
+                'template_used': post.template_used,
+                'custom_prompt': post.custom_prompt,
+                'media_files': [item.media.to_dict() for item in post.media_items],
+                'scheduled_time': post.scheduled_time,
+                'published_time': post.published_time,
+                'status': post.status,
+                'target_channel': post.target_channel,
+                'recurrence_id': post.recurrence_id,
+                'targets': [
+                    {
+                        'chat_id': target.chat_id,
+                        'status': target.status,
+                        'message_id': target.message_id,
+                        'attempts': target.attempts,
+                        'published_time': target.published_time.isoformat() if target.published_time else None
+                    }
+                    for target in targets
+                ],
+                'created_at': post.created_at,
+                'archived_at': now
+            })
+            counts = stats.setdefault((post.scheduled_time.date(), post.status), [0, 0, 0])
+            counts[0] += 1
+            counts[1] += sum(1 for target in targets if target.status == 'published')
+            counts[2] += sum(1 for target in targets if target.status != 'published')
+
+        db.execute(PostArchive.__table__.insert(), archive_rows)
+        self._add_stats(db, stats)
+        db.query(PublishJournalEntry).filter(PublishJournalEntry.post_id.in_(post_ids)).delete(synchronize_session=False)
+        db.query(PostTarget).filter(PostTarget.post_id.in_(post_ids)).delete(synchronize_session=False)
+        db.query(PostMedia).filter(PostMedia.post_id.in_(post_ids)).delete(synchronize_session=False)
+        db.query(Post).filter(Post.id.in_(post_ids)).delete(synchronize_session=False)
+        db.commit()
+        return len(post_ids)
+
+    @staticmethod
+    def _add_stats(db: Session, stats: Dict[Tuple, List[int]]):
+        for (day, status), (posts, published, failed) in stats.items():
+            row = db.query(PostDailyStats).filter(
+                PostDailyStats.day == day,
+                PostDailyStats.status == status
+            ).first()
+            if not row:
+                row = PostDailyStats(day=day, status=status, posts=0, targets_published=0, targets_failed=0)
+                db.add(row)
+            row.posts += posts
+            row.targets_published += published
+            row.targets_failed += failed
+        db.flush()
+
+    def run_maintenance(self):
+        """Reclaim space and refresh planner statistics after archiving"""
+        start = time.perf_counter()
+        dialect = engine.dialect.name
+        vacuum = Config.DB_VACUUM_ENABLED
+        if dialect == 'sqlite':
+            statements = (['VACUUM'] if vacuum else []) + ['ANALYZE']
+        elif dialect == 'postgresql':
+            analyze = 'VACUUM ANALYZE' if vacuum else 'ANALYZE'
+            statements = [f'{analyze} posts', f'{analyze} post_targets', 'ANALYZE posts_archive']
+        elif dialect == 'mysql':
+            statements = ['ANALYZE TABLE posts, post_targets, posts_archive']
+        else:
+            logger.info(f"No maintenance statements for {dialect}, skipping")
+            return
+        try:
+            # VACUUM cannot run inside a transaction
+            with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+                for statement in statements:
+                    conn.exec_driver_sql(statement)
+            logger.info(f"Database maintenance finished in {time.perf_counter() - start:.1f}s")
+        except Exception as e:
+            logger.error(f"Error running database maintenance: {str(e)}")
+        finally:
+            self.last_maintenance = time.monotonic()
@@ -0,0 +1,176 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from aiogram.utils.keyboard import InlineKeyboardBuilder
+from sqlalchemy.orm import Session
+
+from config import Config
+from database.database import get_db
+from database.models import Post
+from services.metrics import CATCHUP_BACKLOG, CATCHUP_POSTS
+from services.renderer import escape
+from services.recurrence_service import RecurrenceService
+
+logger = logging.getLogger(__name__)
+
+POLICIES = ('rate', 'spread', 'skip', 'ask')
+
+class CatchUpService:
+    """
+    Decides what happens to posts that became overdue while the bot was down
+
+    Policies (CATCHUP_POLICY):
+        rate   - publish in due order, one post every 60 / CATCHUP_RATE seconds
+        spread - publish in due order, evenly spread over CATCHUP_SPREAD_WINDOW seconds
+        skip   - do not publish overdue posts, tell the authors
+        ask    - ask each author whether to publish now or skip
+    Posts overdue for more than CATCHUP_MAX_AGE seconds are skipped under every policy.
+    """
+
+    def __init__(self, bot, recurrence_service: RecurrenceService, policy: str = None):
+        self.bot = bot
+        self.recurrence_service = recurrence_service
+        self.policy = policy or Config.CATCHUP_POLICY
+        if self.policy not in POLICIES:
+            logger.warning(f"Unknown CATCHUP_POLICY '{self.policy}', using 'rate'")
+            self.policy = 'rate'
+
+    async def run(self) -> Dict[str, int]:
+        """Process the overdue backlog in pages ordered by scheduled_time, returns counts per action"""
+        now = datetime.utcnow()
+        overdue_before = now - timedelta(seconds=Config.CATCHUP_GRACE)
+        too_old_before = now - timedelta(seconds=Config.CATCHUP_MAX_AGE) if Config.CATCHUP_MAX_AGE > 0 else None
+
+        db_gen = get_db()
+        db = next(db_gen)
+        try:
+            total = db.query(Post.id).filter(
+                Post.status == 'scheduled',
+                Post.scheduled_time < overdue_before
+            ).count()
+        finally:
+            db_gen.close()
+        if not total:
+            return {}
+
+        logger.info(f"Catching up {total} overdue posts with policy '{self.policy}'")
+        CATCHUP_BACKLOG.set(total)
+        interval = self._interval(total)
+        summary = {'rescheduled': 0, 'skipped': 0, 'asked': 0}
+        position = 0
+        last_key: Optional[Tuple[datetime, int]] = None
+        while True:
+            notifications = []
+            db_gen = get_db()
+            db = next(db_gen)
+            try:
+                page = self._next_page(db, overdue_before, last_key)
+                if not page:
+                    break
+                last_key = (page[-1].scheduled_time, page[-1].id)
+                for post in page:
+                    if self.policy == 'skip' or (too_old_before and post.scheduled_time < too_old_before):
+                        action = 'skipped'
+                        self._skip(db, post, now)
+                    elif self.policy == 'ask':
+                        action = 'asked'
+                        post.status = 'awaiting_approval'
+                    else:
+                        action = 'rescheduled'
+                        post.scheduled_time = now + interval * position
+                        position += 1
+                    summary[action] += 1
+                    CATCHUP_POSTS.labels(action).inc()
+                    if action != 'rescheduled':
+                        notifications.append((action, post.id, post.user.telegram_id, post.preview))
+                db.commit()
+            finally:
+                db_gen.close()
+
+            done = sum(summary.values())
+            CATCHUP_BACKLOG.set(total - done)
+            logger.info(f"Catch-up progress: {done}/{total}")
+            for action, post_id, telegram_id, preview in notifications:
+                await self._notify(action, post_id, telegram_id, preview)
+            # Let polling and other tasks run between pages
+            await asyncio.sleep(0)
+
+        CATCHUP_BACKLOG.set(0)
+        logger.info(
+            f"Catch-up finished: {summary['rescheduled']} rescheduled, "
+            f"{summary['skipped']} skipped, {summary['asked']} waiting for authors"
+        )
+        return summary
+
+    def _interval(self, total: int) -> timedelta:
+        if self.policy == 'spread':
+            return timedelta(seconds=Config.CATCHUP_SPREAD_WINDOW / total)
+        return timedelta(seconds=60 / Config.CATCHUP_RATE if Config.CATCHUP_RATE > 0 else 0)
+
+    @staticmethod
+    def _next_page(db: Session, overdue_before: datetime, last_key: Optional[Tuple[datetime, int]]) -> List[Post]:
+        """Next page of overdue posts after last_key, a keyset scan on (scheduled_time, id)"""
+        query = db.query(Post).filter(
+            Post.status == 'scheduled',
+            Post.scheduled_time < overdue_before
+        )
+        if last_key:
+            query = query.filter(
+                (Post.scheduled_time > last_key[0]) |
+                ((Post.scheduled_time == last_key[0]) & (Post.id > last_key[1]))
+            )
+        return query.order_by(Post.scheduled_time, Post.id).limit(Config.CATCHUP_PAGE_SIZE).all()
+
+    def _skip(self, db: Session, post: Post, now: datetime):
+        post.status = 'skipped'
+        if post.recurrence_id:
+            # A skipped occurrence must not stop the recurrence
+            db.flush()
+            post.recurrence.last_run = post.scheduled_time
+            self.recurrence_service.materialize_next(db, post.recurrence, now)
+
+    async def _notify(self, action: str, post_id: int, telegram_id: int, preview: Optional[str]):
+        text_preview = escape(preview or "")
+        try:
+            if action == 'skipped':
+                await self.bot.send_message(
+                    telegram_id,
+                    f"⏭ Пост «{text_preview}» не был опубликован вовремя из-за простоя бота и пропущен."
+                )
+            else:
+                builder = InlineKeyboardBuilder()
+                builder.button(text="✅ Опубликовать сейчас", callback_data=f"catchup_publish_{post_id}")
+                builder.button(text="⏭ Пропустить", callback_data=f"catchup_skip_{post_id}")
+                await self.bot.send_message(
+                    telegram_id,
+                    f"⏰ Пост «{text_preview}» не был опубликован вовремя из-за простоя бота. Опубликовать сейчас?",
+                    reply_markup=builder.as_markup()
+                )
+        except Exception as e:
+            logger.error(f"Error notifying author about overdue post: {str(e)}", extra={'post_id': post_id})
+
+    def resolve(self, post_id: int, telegram_id: int, publish: bool) -> Optional[int]:
+        """
+        Apply the author's answer to an 'ask' prompt
+
+        Returns:
+            The id of the post to publish now, None when it was skipped or already handled
+        """
+        db_gen = get_db()
+        db = next(db_gen)
+        try:
+            post = db.query(Post).filter(Post.id == post_id, Post.status == 'awaiting_approval').first()
+            if not post or post.user.telegram_id != telegram_id:
+                return None
+            now = datetime.utcnow()
+            if publish:
+                post.status = 'scheduled'
+                post.scheduled_time = now
+            else:
+                self._skip(db, post, now)
+            db.commit()
+            return post_id if publish else None
+        finally:
+            db_gen.close()
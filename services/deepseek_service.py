@@ -1,23 +1,53 @@
 import aiohttp
+import asyncio
 import json
 import logging
+import time
 from config import Config
+from services.ai_usage_service import AIUsageService, parse_usage
+from services.metrics import DEEPSEEK_LATENCY, record_deepseek_usage
+from services.tracing import traced
 from typing import Optional
 
 logger = logging.getLogger(__name__)
 
+SYSTEM_PROMPT = "Ты - помощник для редактирования текста. Ты получаешь текст и инструкцию по его изменению. Твоя задача - отредактировать текст согласно инструкции, сохранив основную мысль и смысл."
+
+def build_messages(original_text: str, prompt: str) -> list:
+    """
+    Chat messages for an edit request
+    
+    The system prompt and the template form a byte-identical prefix for every call with the same
+    template, so the provider's context cache can serve it; only the text to edit varies.
+    """
+    return [
+        {
+            "role": "system",
+            "content": f"{SYSTEM_PROMPT}\n\nИнструкция:\n{prompt.strip()}"
+        },
+        {
+            "role": "user",
+            "content": f"Текст для редактирования:\n{original_text}"
+        }
+    ]
+
 class DeepseekService:
     def __init__(self):
         self.api_key = Config.DEEPSEEK_API_KEY
         self.api_url = Config.DEEPSEEK_API_URL
         
-    async def edit_text(self, original_text: str, prompt: str) -> Optional[str]:
+    @traced('DeepseekService.edit_text')
+    async def edit_text(self, original_text: str, prompt: str, telegram_id: Optional[int] = None,
+                        template: Optional[str] = None, speculative: bool = False) -> Optional[str]:
         """
         Edit text using Deepseek API
         
         Args:
             original_text: Original text to edit
             prompt: Prompt for editing (template or custom)
+            telegram_id: User the call is made for, for usage accounting
+            template: Template name, None for a custom prompt
+            speculative: Call started before the user picked the template
             
         Returns:
             Edited text or None if error
@@ -26,6 +56,8 @@ class DeepseekService:
             logger.error("Deepseek API key not configured")
             return None
             
+        start = time.perf_counter()
+        outcome = 'error'
         try:
             headers = {
                 "Authorization": f"Bearer {self.api_key}",
@@ -34,16 +66,7 @@ class DeepseekService:
             
             data = {
                 "model": "deepseek-chat",
-                "messages": [
-                    {
-                        "role": "system",
-                        "content": "Ты - помощник для редактирования текста. Ты получаешь текст и инструкцию по его изменению. Твоя задача - отредактировать текст согласно инструкции, сохранив основную мысль и смысл."
-                    },
-                    {
-                        "role": "user",
-                        "content": f"{prompt}\n\nТекст для редактирования:\n{original_text}"
-                    }
-                ],
+                "messages": build_messages(original_text, prompt),
                 "max_tokens": 2000,
                 "temperature": 0.7
             }
@@ -53,7 +76,17 @@ class DeepseekService:
                     if response.status == 200:
                         result = await response.json()
                         edited_text = result['choices'][0]['message']['content'].strip()
-                        logger.info(f"Text edited successfully. Original length: {len(original_text)}, Edited length: {len(edited_text)}")
+                        outcome = 'success'
+                        latency_ms = round((time.perf_counter() - start) * 1000)
+                        tokens = parse_usage(result.get('usage') or {})
+                        record_deepseek_usage(*tokens)
+                        # A blocking commit, keep it off the event loop
+                        await asyncio.to_thread(AIUsageService.record, telegram_id, template, speculative, tokens, latency_ms)
+                        logger.info(
+                            f"Text edited successfully. Original length: {len(original_text)}, Edited length: {len(edited_text)}, "
+                            f"prompt tokens: {tokens[0]} ({tokens[1]} cached)",
+                            extra={'latency_ms': latency_ms, 'user_id': telegram_id, 'template': template}
+                        )
                         return edited_text
                     else:
                         error_text = await response.text()
@@ -63,33 +96,21 @@ class DeepseekService:
         except Exception as e:
             logger.error(f"Error calling Deepseek API: {str(e)}")
             return None
+        finally:
+            DEEPSEEK_LATENCY.labels(outcome).observe(time.perf_counter() - start)
     
-    async def test_connection(self) -> bool:
-        """Test connection to Deepseek API"""
+    async def probe(self, timeout: float = 10) -> bool:
+        """Check that the API is reachable and the key is accepted without spending tokens"""
         if not self.api_key:
             return False
             
+        # https://api.deepseek.com/v1/chat/completions -> https://api.deepseek.com/v1/models
+        models_url = self.api_url.rsplit('/chat/completions', 1)[0] + '/models'
         try:
-            headers = {
-                "Authorization": f"Bearer {self.api_key}",
-                "Content-Type": "application/json"
-            }
-            
-            data = {
-                "model": "deepseek-chat",
-                "messages": [
-                    {
-                        "role": "user",
-                        "content": "Привет! Это тестовое сообщение."
-                    }
-                ],
-                "max_tokens": 10
-            }
-            
-            async with aiohttp.ClientSession() as session:
-                async with session.post(self.api_url, headers=headers, json=data) as response:
+            headers = {"Authorization": f"Bearer {self.api_key}"}
+            async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=timeout)) as session:
+                async with session.get(models_url, headers=headers) as response:
                     return response.status == 200
-                    
         except Exception as e:
-            logger.error(f"Error testing Deepseek API connection: {str(e)}")
-            return False 
\ No newline at end of file
+            logger.error(f"Error probing Deepseek API: {str(e)}")
+            return False
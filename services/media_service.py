@@ -0,0 +1,245 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, List, Tuple
+
+from sqlalchemy.orm import Session
+
+from config import Config
+from database.database import get_db
+from database.models import Media, Post, PostMedia
+
+logger = logging.getLogger(__name__)
+
+# Telegram albums hold 2-10 photos/videos, any mix of the two
+ALBUM_MAX_ITEMS = 10
+ALBUM_TYPES = ('photo', 'video')
+# getFile refuses larger files ("file is too big") although their file_id can still be sent
+GETFILE_MAX_SIZE = 20 * 1024 * 1024
+
+def media_from_message(message) -> List[Dict]:
+    """Extract media dicts with the metadata Telegram already sent along with the message"""
+    if message.photo:
+        photo = message.photo[-1]
+        return [{
+            'type': 'photo',
+            'file_id': photo.file_id,
+            'file_unique_id': photo.file_unique_id,
+            'file_size': photo.file_size,
+            'width': photo.width,
+            'height': photo.height
+        }]
+    if message.video:
+        video = message.video
+        return [{
+            'type': 'video',
+            'file_id': video.file_id,
+            'file_unique_id': video.file_unique_id,
+            'file_size': video.file_size,
+            'width': video.width,
+            'height': video.height,
+            'duration': video.duration,
+            'mime_type': video.mime_type
+        }]
+    return []
+
+def build_albums(media: List[Media]) -> List[List[Media]]:
+    """
+    Split media into send groups from cached metadata only
+
+    Returns:
+        Groups of up to ALBUM_MAX_ITEMS photos/videos, a group of one is sent as a single photo/video
+    """
+    groups = []
+    current = []
+    for item in media:
+        if item.type not in ALBUM_TYPES:
+            if current:
+                groups.append(current)
+                current = []
+            groups.append([item])
+            continue
+        current.append(item)
+        if len(current) == ALBUM_MAX_ITEMS:
+            groups.append(current)
+            current = []
+    if current:
+        groups.append(current)
+    return groups
+
+class MediaGroupAggregator:
+    """
+    Collects the messages of one album (same media_group_id) and hands them over together
+
+    Telegram delivers an album as separate messages a few milliseconds apart, the group is
+    flushed once no new message arrived for `delay` seconds or it reached ALBUM_MAX_ITEMS.
+    """
+
+    def __init__(self, delay: float):
+        self.delay = delay
+        self.groups: Dict[Tuple[int, str], List] = {}
+        self.timers: Dict[Tuple[int, str], asyncio.Task] = {}
+
+    def add(self, message, on_complete: Callable[[List], Awaitable[None]]):
+        """Buffer an album message, on_complete receives all messages of the group ordered by message_id"""
+        key = (message.chat.id, message.media_group_id)
+        self.groups.setdefault(key, []).append(message)
+        timer = self.timers.pop(key, None)
+        if timer:
+            timer.cancel()
+        delay = 0 if len(self.groups[key]) >= ALBUM_MAX_ITEMS else self.delay
+        self.timers[key] = asyncio.create_task(self._flush_later(key, delay, on_complete))
+
+    async def _flush_later(self, key: Tuple[int, str], delay: float, on_complete: Callable[[List], Awaitable[None]]):
+        await asyncio.sleep(delay)
+        self.timers.pop(key, None)
+        messages = sorted(self.groups.pop(key, []), key=lambda message: message.message_id)
+        if not messages:
+            return
+        try:
+            await on_complete(messages)
+        except Exception as e:
+            logger.error(f"Error handling media group {key[1]}: {str(e)}")
+
+class MediaService:
+    """Media registry and the background getFile check of media in upcoming posts"""
+
+    def __init__(self, bot=None):
+        self.bot = bot
+        self.running = False
+        self.task = None
+        self.warned_posts = set()
+
+    def register(self, db: Session, items: List[Dict]) -> List[Media]:
+        """Get or create Media rows by file_unique_id, refreshing file_id and metadata"""
+        media = []
+        for item in items:
+            row = None
+            if item.get('file_unique_id'):
+                row = db.query(Media).filter(Media.file_unique_id == item['file_unique_id']).first()
+            if not row:
+                row = Media(file_unique_id=item.get('file_unique_id') or item['file_id'], type=item['type'])
+                db.add(row)
+            row.file_id = item['file_id']
+            for field in ('file_size', 'width', 'height', 'duration', 'mime_type'):
+                if item.get(field) is not None:
+                    setattr(row, field, item[field])
+            # A fresh file_id from the user is valid by definition
+            row.is_valid = True
+            row.last_error = None
+            media.append(row)
+        db.flush()
+        return media
+
+    def attach(self, db: Session, post: Post, items: List[Dict]):
+        """Register items and link them to the post in order"""
+        for position, media in enumerate(self.register(db, items)):
+            post.media_items.append(PostMedia(media=media, position=position))
+
+    async def start(self):
+        """Start the background validation pass"""
+        self.running = True
+        self.task = asyncio.create_task(self._main_loop())
+        logger.info("Media validation started")
+
+    async def stop(self):
+        """Stop the background validation pass"""
+        self.running = False
+        if self.task:
+            self.task.cancel()
+        logger.info("Media validation stopped")
+
+    async def _main_loop(self):
+        while self.running:
+            try:
+                await self.validate_upcoming()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error validating media: {str(e)}")
+            await asyncio.sleep(Config.MEDIA_VALIDATION_INTERVAL)
+
+    async def validate_upcoming(self):
+        """Check media of posts due within MEDIA_VALIDATION_LEAD and warn owners about broken files"""
+        now = datetime.utcnow()
+        stale_before = now - timedelta(seconds=Config.MEDIA_VALIDATION_TTL)
+        db_gen = get_db()
+        db = next(db_gen)
+        try:
+            rows = db.query(Post.id, Post.scheduled_time, Media).join(
+                PostMedia, PostMedia.post_id == Post.id
+            ).join(Media, Media.id == PostMedia.media_id).filter(
+                Post.status == 'scheduled',
+                Post.scheduled_time <= now + timedelta(seconds=Config.MEDIA_VALIDATION_LEAD)
+            ).all()
+            posts_by_media = {}
+            for post_id, scheduled_time, media in rows:
+                posts_by_media.setdefault(media.id, (media, []))[1].append((post_id, scheduled_time))
+        finally:
+            db_gen.close()
+
+        for media, posts in posts_by_media.values():
+            if media.validated_at is None or media.validated_at < stale_before:
+                await self.validate(media)
+            if media.is_valid is False:
+                for post_id, scheduled_time in posts:
+                    await self._warn_owner(post_id, scheduled_time, media)
+
+    async def validate(self, media: Media) -> bool:
+        """Check a file_id with getFile and store the outcome, files getFile cannot serve count as valid"""
+        from aiogram.exceptions import TelegramBadRequest
+
+        if media.file_size and media.file_size > GETFILE_MAX_SIZE:
+            return bool(media.is_valid)
+        error = None
+        file_size = None
+        try:
+            telegram_file = await self.bot.get_file(media.file_id)
+            file_size = telegram_file.file_size
+        except TelegramBadRequest as e:
+            # The file_id resolved, only the download is refused
+            if 'file is too big' not in str(e).lower():
+                error = str(e)
+        except Exception as e:
+            # Network problems say nothing about the file, try again on the next pass
+            logger.warning(f"Could not validate media {media.id}: {str(e)}")
+            return bool(media.is_valid)
+
+        db_gen = get_db()
+        db = next(db_gen)
+        try:
+            row = db.get(Media, media.id)
+            row.is_valid = error is None
+            row.last_error = error
+            row.validated_at = datetime.utcnow()
+            if file_size:
+                row.file_size = file_size
+            db.commit()
+            media.is_valid, media.last_error, media.validated_at = row.is_valid, row.last_error, row.validated_at
+        finally:
+            db_gen.close()
+        if error:
+            logger.warning(f"Media {media.id} ({media.type}) is no longer available: {error}")
+        return error is None
+
+    async def _warn_owner(self, post_id: int, scheduled_time: datetime, media: Media):
+        if post_id in self.warned_posts:
+            return
+        self.warned_posts.add(post_id)
+        db_gen = get_db()
+        db = next(db_gen)
+        try:
+            post = db.get(Post, post_id)
+            telegram_id = post.user.telegram_id if post else None
+        finally:
+            db_gen.close()
+        if not telegram_id:
+            return
+        try:
+            await self.bot.send_message(
+                telegram_id,
+                f"⚠️ Медиафайл ({media.type}) в посте на {scheduled_time.strftime('%d.%m.%Y %H:%M')} (UTC) "
+                f"недоступен в Telegram и не будет опубликован. Создайте пост заново с новым файлом."
+            )
+        except Exception as e:
+            logger.error(f"Error warning user about broken media: {str(e)}", extra={'post_id': post_id})
@@ -0,0 +1,168 @@
+import logging
+import time
+from collections import Counter as StateCounter
+
+from aiohttp import web
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+# Scheduler / publisher
+SCHEDULED_BACKLOG = Gauge('bot_scheduled_posts', 'Posts with status scheduled')
+SCHEDULER_WINDOW_SIZE = Gauge('bot_scheduler_window_posts', 'Posts held in the scheduler in-memory window')
+CATCHUP_BACKLOG = Gauge('bot_catchup_backlog_posts', 'Overdue posts left to process after downtime')
+CATCHUP_POSTS = Counter(
+    'bot_catchup_posts_total', 'Overdue posts handled by the catch-up policy',
+    ['action']  # rescheduled, skipped, asked
+)
+PUBLISH_LAG = Histogram(
+    'bot_publish_lag_seconds', 'Actual publish time minus scheduled_time',
+    buckets=(0.1, 0.5, 1, 2, 5, 10, 30, 60, 120, 300, 900, 3600)
+)
+PUBLISH_ATTEMPTS = Counter('bot_publish_attempts_total', 'Publish attempts per target', ['outcome'])
+
+# Telegram Bot API
+TELEGRAM_API_LATENCY = Histogram(
+    'bot_telegram_api_latency_seconds', 'Telegram Bot API call latency', ['method']
+)
+TELEGRAM_API_ERRORS = Counter('bot_telegram_api_errors_total', 'Failed Telegram Bot API calls', ['method'])
+
+# Deepseek
+DEEPSEEK_LATENCY = Histogram(
+    'bot_deepseek_edit_latency_seconds', 'DeepseekService.edit_text latency', ['outcome'],
+    buckets=(0.5, 1, 2, 5, 10, 15, 20, 30, 60, 120)
+)
+DEEPSEEK_TOKENS = Counter('bot_deepseek_tokens_total', 'Deepseek token usage', ['kind'])
+SPECULATIVE_EDITS = Counter(
+    'bot_speculative_edits_total', 'Background edits started before the user picked a template',
+    ['outcome']  # started, hit, miss, cancelled, over_budget
+)
+
+PUBLISHER_CALLS = Counter('bot_publisher_calls_total', 'Bot API calls made while publishing, by token', ['publisher'])
+
+# Throttling
+THROTTLED_UPDATES = Counter(
+    'bot_throttled_updates_total', 'User updates not handled individually by ThrottlingMiddleware',
+    ['reason']  # rate, in_flight, coalesced
+)
+
+# Database
+DB_QUERY_LATENCY = Histogram(
+    'bot_db_query_latency_seconds', 'SQL statement execution time', ['operation'],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1)
+)
+
+# Conversation
+FSM_STATES = Gauge('bot_fsm_states', 'Users per FSM state', ['state'])
+
+class TelegramMetricsMiddleware(BaseRequestMiddleware):
+    """Bot session middleware measuring Telegram API call latency by method"""
+
+    async def __call__(self, make_request, bot, method):
+        api_method = getattr(method, '__api_method__', type(method).__name__)
+        start = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except Exception:
+            TELEGRAM_API_ERRORS.labels(api_method).inc()
+            raise
+        finally:
+            TELEGRAM_API_LATENCY.labels(api_method).observe(time.perf_counter() - start)
+
+def instrument_engine(engine):
+    """Record SQL statement timings via SQLAlchemy cursor events"""
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_start_time', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        start_times = conn.info.get('query_start_time')
+        if not start_times:
+            return
+        operation = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else 'UNKNOWN'
+        DB_QUERY_LATENCY.labels(operation).observe(time.perf_counter() - start_times.pop())
+
+    @event.listens_for(engine, 'handle_error')
+    def _handle_error(context):
+        # after_cursor_execute is not called for a failed statement
+        start_times = context.connection.info.get('query_start_time') if context.connection else None
+        if start_times:
+            start_times.pop()
+
+def record_publish(outcome: str, lag_seconds: float = None):
+    """Record a publish attempt for a single target"""
+    PUBLISH_ATTEMPTS.labels(outcome).inc()
+    if lag_seconds is not None:
+        PUBLISH_LAG.observe(max(0.0, lag_seconds))
+
+def record_deepseek_usage(prompt_tokens: int, cached_tokens: int, completion_tokens: int):
+    """Add token counts of a Deepseek call"""
+    DEEPSEEK_TOKENS.labels('prompt').inc(prompt_tokens)
+    DEEPSEEK_TOKENS.labels('cached').inc(cached_tokens)
+    DEEPSEEK_TOKENS.labels('completion').inc(completion_tokens)
+
+class MetricsServer:
+    """Serves /metrics in Prometheus text format from the bot process"""
+
+    def __init__(self, host: str, port: int, storage=None):
+        self.host = host
+        self.port = port
+        self.storage = storage
+        self.runner = None
+
+    def _collect_backlog(self):
+        from sqlalchemy import func
+        from database.database import get_db
+        from database.models import Post
+
+        db_gen = get_db()
+        db = next(db_gen)
+        try:
+            SCHEDULED_BACKLOG.set(
+                db.query(func.count(Post.id)).filter(Post.status == 'scheduled').scalar() or 0
+            )
+        finally:
+            db_gen.close()
+
+    def _collect_fsm_states(self):
+        # MemoryStorage keeps records in a dict, other storages are not enumerable
+        records = getattr(self.storage, 'storage', None)
+        if records is None:
+            return
+        counts = StateCounter(record.state for record in list(records.values()) if record.state)
+        FSM_STATES.clear()
+        for state, count in counts.items():
+            FSM_STATES.labels(state).set(count)
+
+    async def handle_metrics(self, request: web.Request) -> web.Response:
+        try:
+            self._collect_backlog()
+            self._collect_fsm_states()
+        except Exception as e:
+            logger.error(f"Error collecting metrics: {str(e)}")
+        return web.Response(body=generate_latest(), headers={'Content-Type': CONTENT_TYPE_LATEST})
+
+    async def start(self):
+        """Start the HTTP endpoint"""
+        app = web.Application()
+        app.router.add_get('/metrics', self.handle_metrics)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        try:
+            await web.TCPSite(self.runner, self.host, self.port).start()
+        except OSError as e:
+            # A busy port must not stop the bot, metrics are still collected
+            logger.error(f"Metrics endpoint not started on {self.host}:{self.port}: {str(e)}")
+            await self.stop()
+            return
+        logger.info(f"Metrics available at http://{self.host}:{self.port}/metrics")
+
+    async def stop(self):
+        """Stop the HTTP endpoint"""
+        if self.runner:
+            await self.runner.cleanup()
+            self.runner = None
@@ -0,0 +1,118 @@
+import io
+import logging
+import os
+from datetime import datetime
+from typing import Optional
+
+from aiogram import BaseMiddleware
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+class UpdateProfiler:
+    """Profiles the next N updates on demand with cProfile or yappi"""
+
+    def __init__(self, backend: str = 'cprofile', output_dir: str = 'profiles'):
+        self.backend = backend
+        self.output_dir = output_dir
+        self.remaining = 0
+        self.in_flight = 0
+        self.requested_by: Optional[int] = None
+        self.profiler = None
+        # Backend of the running session, 'yappi' or 'cprofile' after a fallback
+        self.active_backend: Optional[str] = None
+
+    @property
+    def armed(self) -> bool:
+        return self.remaining > 0 or self.profiler is not None
+
+    def arm(self, updates: int, requested_by: int) -> bool:
+        """Request profiling of the next N updates, False if a session is already running"""
+        if self.armed:
+            return False
+        self.remaining = updates
+        self.requested_by = requested_by
+        return True
+
+    def _start(self):
+        if self.backend == 'yappi':
+            try:
+                import yappi
+                yappi.set_clock_type('wall')
+                yappi.start()
+                self.profiler = yappi
+                self.active_backend = 'yappi'
+                return
+            except ImportError:
+                logger.warning("yappi is not installed, falling back to cProfile")
+        import cProfile
+        self.profiler = cProfile.Profile()
+        self.active_backend = 'cprofile'
+        self.profiler.enable()
+
+    def _stop(self) -> str:
+        """Stop profiling, dump stats to a file and return a short text summary"""
+        os.makedirs(self.output_dir, exist_ok=True)
+        path = os.path.join(self.output_dir, f"profile_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}")
+        profiler, self.profiler = self.profiler, None
+        backend, self.active_backend = self.active_backend, None
+        if backend == 'cprofile':
+            import pstats
+            profiler.disable()
+            path += '.prof'
+            profiler.dump_stats(path)
+            stream = io.StringIO()
+            pstats.Stats(profiler, stream=stream).sort_stats('cumulative').print_stats(15)
+            summary = stream.getvalue()
+        else:
+            profiler.stop()
+            path += '.pstat'
+            stats = profiler.get_func_stats()
+            stats.save(path, type='pstat')
+            stream = io.StringIO()
+            stats.sort('ttot').print_all(out=stream)
+            summary = '\n'.join(stream.getvalue().splitlines()[:25])
+            profiler.clear_stats()
+        logger.info(f"Profile saved to {path}")
+        return f"{path}\n\n{summary}"
+
+    def before_update(self) -> bool:
+        if self.remaining <= 0:
+            return False
+        if self.profiler is None:
+            self._start()
+        self.remaining -= 1
+        self.in_flight += 1
+        return True
+
+    def after_update(self) -> Optional[str]:
+        self.in_flight -= 1
+        if self.remaining <= 0 and self.in_flight == 0 and self.profiler is not None:
+            return self._stop()
+        return None
+
+class ProfilingMiddleware(BaseMiddleware):
+    """Outer dispatcher middleware feeding updates into UpdateProfiler"""
+
+    def __init__(self, profiler: UpdateProfiler):
+        self.profiler = profiler
+
+    async def __call__(self, handler, event, data):
+        if not self.profiler.before_update():
+            return await handler(event, data)
+        try:
+            return await handler(event, data)
+        finally:
+            summary = self.profiler.after_update()
+            if summary and self.profiler.requested_by:
+                try:
+                    await data['bot'].send_message(
+                        self.profiler.requested_by,
+                        f"📊 Профилирование завершено: {summary[:3500]}",
+                        parse_mode=None
+                    )
+                except Exception as e:
+                    logger.error(f"Error sending profile summary: {str(e)}")
+
+update_profiler = UpdateProfiler(Config.PROFILER_BACKEND, Config.PROFILE_DIR)
@@ -0,0 +1,108 @@
+import asyncio
+import hashlib
+import json
+import logging
+from typing import Dict, List, Optional, Set, Tuple
+
+from config import Config
+from database.database import get_db
+from database.models import PublishJournalEntry
+
+logger = logging.getLogger(__name__)
+
+def step_keys(methods: List) -> List[str]:
+    """
+    Stable identity of each call of a target: the method and a hash of its payload
+
+    The payload is rebuilt on every attempt and may lose unavailable media, so positions shift;
+    identical calls are told apart by their occurrence number.
+    """
+    keys = []
+    seen: Dict[str, int] = {}
+    for method in methods:
+        # repr() covers unresolved bot defaults such as Default('parse_mode')
+        payload = json.dumps(method.model_dump(), sort_keys=True, default=repr)
+        digest = hashlib.sha256(payload.encode('utf-8')).hexdigest()[:32]
+        base = f"{method.__api_method__}:{digest}"
+        seen[base] = seen.get(base, 0) + 1
+        keys.append(f"{base}:{seen[base]}")
+    return keys
+
+class PublishJournal:
+    """
+    Write-ahead record of publish calls
+
+    Every call is journaled as 'intent' before it is made and as 'sent' (with message_id) or 'failed'
+    after it, each row committed on its own. A publish that restarts after a crash or a failed attempt
+    skips the steps already sent, so a post is never published twice and an album is never half-resent.
+
+    Delivery is at-most-once for a call interrupted by a crash: its 'intent' row has no outcome and the
+    Bot API offers no way to check a channel for the message, so the step is assumed sent. A failure
+    whose 'failed' row could not be written is kept in memory, and retries in this process still resend it.
+    """
+
+    def __init__(self, enabled: bool = None):
+        self.enabled = Config.PUBLISH_JOURNAL_ENABLED if enabled is None else enabled
+        # (post_id, target_id, step_key) of failed calls left in 'intent' because the row was not written
+        self.unrecorded_failures: Set[Tuple[int, int, str]] = set()
+
+    def load(self, post_id: int) -> Dict[int, Dict[str, Tuple[str, Optional[int]]]]:
+        """
+        Latest state of each journaled step of a post
+
+        Returns:
+            {target_id: {step_key: (state, message_id)}}
+        """
+        if not self.enabled:
+            return {}
+        db_gen = get_db()
+        try:
+            db = next(db_gen)
+            rows = db.query(
+                PublishJournalEntry.target_id, PublishJournalEntry.step_key,
+                PublishJournalEntry.state, PublishJournalEntry.message_id
+            ).filter(
+                PublishJournalEntry.post_id == post_id,
+                PublishJournalEntry.step_key.isnot(None)
+            ).order_by(PublishJournalEntry.id).all()
+        finally:
+            db_gen.close()
+        steps: Dict[int, Dict[str, Tuple[str, Optional[int]]]] = {}
+        for target_id, step_key, state, message_id in rows:
+            steps.setdefault(target_id, {})[step_key] = (state, message_id)
+        for failed_post_id, target_id, step_key in self.unrecorded_failures:
+            target_steps = steps.get(target_id, {})
+            if failed_post_id == post_id and target_steps.get(step_key, (None,))[0] == 'intent':
+                target_steps[step_key] = ('failed', None)
+        return steps
+
+    async def append(self, post_id: int, target_id: int, step: int, step_key: str, method: str, state: str,
+                     message_id: Optional[int] = None, error: Optional[str] = None):
+        """Durably record one step, returns once the row is committed"""
+        if not self.enabled:
+            return
+        key = (post_id, target_id, step_key)
+        try:
+            await asyncio.to_thread(self._append, post_id, target_id, step, step_key, method, state, message_id, error)
+        except Exception as e:
+            if state != 'failed':
+                raise
+            # The call did not go through, do not let the 'intent' row pass it off as sent
+            logger.error(f"Error journaling failed step of post {post_id}: {str(e)}", extra={'post_id': post_id})
+            self.unrecorded_failures.add(key)
+            return
+        if state != 'intent':
+            self.unrecorded_failures.discard(key)
+
+    @staticmethod
+    def _append(post_id, target_id, step, step_key, method, state, message_id, error):
+        db_gen = get_db()
+        try:
+            db = next(db_gen)
+            db.add(PublishJournalEntry(
+                post_id=post_id, target_id=target_id, step=step, step_key=step_key, method=method,
+                state=state, message_id=message_id, error=error
+            ))
+            db.commit()
+        finally:
+            db_gen.close()
@@ -0,0 +1,112 @@
+import logging
+import time
+from typing import Dict, List, Optional
+
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
+
+from config import Config
+from services.metrics import PUBLISHER_CALLS
+from services.rate_limiter import RateLimiter
+
+logger = logging.getLogger(__name__)
+
+class Publisher:
+    """One bot token used for publishing, with its own rate bucket"""
+
+    def __init__(self, bot, name: str, rate: float):
+        self.bot = bot
+        self.name = name
+        self.rate_limiter = RateLimiter(rate, burst=max(1, int(rate)))
+        self.in_flight = 0
+        self.chats = 0
+
+    async def call(self, method):
+        """Send one Bot API request through this token's bucket"""
+        self.in_flight += 1
+        try:
+            async with self.rate_limiter:
+                result = await self.bot(method)
+            PUBLISHER_CALLS.labels(self.name).inc()
+            return result
+        finally:
+            self.in_flight -= 1
+
+class PublisherPool:
+    """
+    Bot tokens that publish to channels, so the per-bot send limit does not cap total throughput
+
+    Each channel sticks to one publisher (message order, per-chat limits), a channel seen for the first
+    time goes to the least busy publisher unless PUBLISHER_AFFINITY pins it. The interactive bot publishes
+    only when no publisher tokens are configured and for posts with media, since file_ids are per bot.
+    """
+
+    def __init__(self, primary_bot, bots: List = (), rate: float = None, affinity: Optional[str] = None,
+                 exclude_ttl: float = None):
+        rate = Config.PUBLISH_RATE_LIMIT if rate is None else rate
+        self.exclude_ttl = Config.PUBLISHER_EXCLUDE_TTL if exclude_ttl is None else exclude_ttl
+        self.primary = Publisher(primary_bot, 'main', rate)
+        self.publishers = [Publisher(bot, f"publisher{index}", rate) for index, bot in enumerate(bots, 1)]
+        self.affinity: Dict[str, Publisher] = {}
+        # Publishers that turned out to have no rights in a chat, with the monotonic time the exclusion ends
+        self.excluded: Dict[str, Dict[Publisher, float]] = {}
+        for chat_id, index in self._parse_affinity(Config.PUBLISHER_AFFINITY if affinity is None else affinity):
+            if 1 <= index <= len(self.publishers):
+                self._assign(chat_id, self.publishers[index - 1])
+            else:
+                logger.warning(f"PUBLISHER_AFFINITY: no publisher #{index} for {chat_id}")
+
+    @staticmethod
+    def _parse_affinity(value: str):
+        for item in (value or '').split(','):
+            chat_id, _, index = item.strip().rpartition(':')
+            if chat_id and index.isdigit():
+                yield chat_id, int(index)
+
+    def _assign(self, chat_id: str, publisher: Publisher):
+        self.affinity[chat_id] = publisher
+        publisher.chats += 1
+
+    def _excluded(self, chat_id: str) -> Dict[Publisher, float]:
+        """Current exclusions of a chat, expired ones are dropped so rights granted later are picked up"""
+        excluded = self.excluded.get(chat_id)
+        if not excluded:
+            return {}
+        now = time.monotonic()
+        for publisher in [p for p, until in excluded.items() if until <= now]:
+            del excluded[publisher]
+        if not excluded:
+            del self.excluded[chat_id]
+        return excluded
+
+    def for_chat(self, chat_id: str, uses_files: bool = False) -> Publisher:
+        """Publisher for a chat, media posts stay on the bot that received the files"""
+        if uses_files or not self.publishers:
+            return self.primary
+        publisher = self.affinity.get(chat_id)
+        if publisher is None:
+            excluded = self._excluded(chat_id)
+            candidates = [p for p in self.publishers if p not in excluded]
+            if not candidates:
+                return self.primary
+            publisher = min(candidates, key=lambda p: (p.in_flight, p.chats))
+            self._assign(chat_id, publisher)
+            logger.info(f"Publishing to {chat_id} via {publisher.name}")
+        return publisher
+
+    def report_error(self, chat_id: str, publisher: Publisher, error: Exception):
+        """Move a chat to another publisher when this one cannot post there"""
+        if publisher is self.primary:
+            return
+        no_access = isinstance(error, TelegramForbiddenError) or (
+            isinstance(error, TelegramBadRequest) and 'chat not found' in str(error).lower()
+        )
+        if not no_access or self.affinity.get(chat_id) is not publisher:
+            return
+        logger.warning(f"{publisher.name} cannot post to {chat_id}, reassigning: {str(error)}")
+        self.excluded.setdefault(chat_id, {})[publisher] = time.monotonic() + self.exclude_ttl
+        del self.affinity[chat_id]
+        publisher.chats -= 1
+
+    async def close(self):
+        for publisher in self.publishers:
+            await publisher.bot.session.close()
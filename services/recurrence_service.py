@@ -0,0 +1,200 @@
+import logging
+import re
+from datetime import datetime
+from typing import List, Optional
+
+import pytz
+from dateutil.rrule import rrule, rrulestr, DAILY
+from sqlalchemy.orm import Session
+
+from config import Config
+from database.models import Post, PostMedia, PostTarget, Recurrence
+
+logger = logging.getLogger(__name__)
+
+CRON_FIELD_RE = re.compile(r'^[\d*/,\-]+$')
+
+# Statuses of an occurrence that has not run yet, a recurrence keeps at most one of them
+PENDING_STATUSES = ('scheduled', 'awaiting_approval')
+
+# (min, max) for minute, hour, day of month, month, day of week
+CRON_RANGES = [(0, 59), (0, 23), (1, 31), (1, 12), (0, 7)]
+
+class RecurrenceService:
+    """Evaluates RRULE/cron rules and materializes only the next occurrence of a recurring post"""
+
+    @staticmethod
+    def is_rule(text: str) -> bool:
+        """Check whether text looks like an RRULE or a 5-field cron expression"""
+        text = text.strip()
+        if 'FREQ=' in text.upper():
+            return True
+        fields = text.split()
+        return len(fields) == 5 and all(CRON_FIELD_RE.match(field) for field in fields)
+
+    @staticmethod
+    def _parse_cron_field(field: str, low: int, high: int) -> Optional[List[int]]:
+        """Parse a single cron field, None means '*' (any value)"""
+        if field == '*':
+            return None
+        values = set()
+        for part in field.split(','):
+            step = 1
+            if '/' in part:
+                part, step_str = part.split('/', 1)
+                step = int(step_str)
+                if step <= 0:
+                    raise ValueError(f"Invalid cron step: {step_str}")
+            if part == '*':
+                start, end = low, high
+            elif '-' in part:
+                start_str, end_str = part.split('-', 1)
+                start, end = int(start_str), int(end_str)
+            else:
+                start = int(part)
+                end = high if step > 1 else start
+            if start < low or end > high or start > end:
+                raise ValueError(f"Cron value out of range: {part}")
+            values.update(range(start, end + 1, step))
+        return sorted(values)
+
+    @classmethod
+    def _cron_to_rrule(cls, expression: str, dtstart: datetime) -> rrule:
+        """Convert a 5-field cron expression to an equivalent daily rrule"""
+        fields = expression.split()
+        minutes, hours, days, months, weekdays = (
+            cls._parse_cron_field(field, low, high)
+            for field, (low, high) in zip(fields, CRON_RANGES)
+        )
+        if weekdays is not None:
+            # cron: 0 and 7 are Sunday; dateutil: 0 is Monday
+            weekdays = sorted({(day - 1) % 7 for day in weekdays})
+        # Note: when both day-of-month and day-of-week are restricted, cron matches either one,
+        # rrule requires both. This combination is rare for channel rubrics and is not emulated.
+        return rrule(
+            DAILY,
+            dtstart=dtstart.replace(second=0, microsecond=0),
+            byhour=hours if hours is not None else range(24),
+            byminute=minutes if minutes is not None else range(60),
+            bysecond=0,
+            bymonthday=days,
+            bymonth=months,
+            byweekday=weekdays,
+            cache=False
+        )
+
+    @classmethod
+    def build_rule(cls, rule: str, timezone: str, dtstart_utc: datetime):
+        """Build a dateutil rule evaluated in naive local time of the given timezone"""
+        tz = pytz.timezone(timezone)
+        dtstart_local = pytz.utc.localize(dtstart_utc).astimezone(tz).replace(tzinfo=None)
+        if 'FREQ=' in rule.upper():
+            return rrulestr(rule, dtstart=dtstart_local, ignoretz=True, cache=False)
+        return cls._cron_to_rrule(rule, dtstart_local)
+
+    @classmethod
+    def next_occurrence(cls, rule: str, timezone: str, dtstart_utc: datetime,
+                        after_utc: datetime) -> Optional[datetime]:
+        """
+        Get the first occurrence strictly after the given moment
+
+        Args:
+            rule: RRULE string or cron expression
+            timezone: Timezone name the rule is evaluated in
+            dtstart_utc: Naive UTC anchor of the rule
+            after_utc: Naive UTC moment to search from
+
+        Returns:
+            Naive UTC datetime or None if the rule is exhausted
+        """
+        tz = pytz.timezone(timezone)
+        after_local = pytz.utc.localize(after_utc).astimezone(tz).replace(tzinfo=None)
+        local = cls.build_rule(rule, timezone, dtstart_utc).after(after_local)
+        if local is None:
+            return None
+        return tz.localize(local).astimezone(pytz.utc).replace(tzinfo=None)
+
+    def create_recurrence(self, db: Session, template_post: Post, rule: str,
+                          timezone: Optional[str] = None, dtstart: Optional[datetime] = None) -> Optional[Post]:
+        """
+        Create a recurrence for a template post and materialize its first occurrence
+
+        Args:
+            dtstart: Naive UTC anchor, the moment the first occurrence was previewed; now by default
+
+        Returns:
+            The first scheduled occurrence or None if the rule yields no dates
+        """
+        now = dtstart or datetime.utcnow()
+        recurrence = Recurrence(
+            user_id=template_post.user_id,
+            rule=rule.strip(),
+            timezone=timezone or Config.TIMEZONE,
+            dtstart=now
+        )
+        db.add(recurrence)
+        db.flush()
+        template_post.recurrence_id = recurrence.id
+        template_post.status = 'template'
+        db.flush()
+        return self.materialize_next(db, recurrence, now)
+
+    def materialize_next(self, db: Session, recurrence: Recurrence, after_utc: datetime) -> Optional[Post]:
+        """
+        Create the next occurrence post unless one is already pending
+
+        Returns:
+            The scheduled occurrence, None when there is nothing to schedule: the rule is exhausted or
+            an occurrence waits for its author after downtime and the next one follows the answer
+        """
+        pending = db.query(Post).filter(
+            Post.recurrence_id == recurrence.id,
+            Post.status.in_(PENDING_STATUSES)
+        ).first()
+        if pending:
+            return pending if pending.status == 'scheduled' else None
+
+        template = db.query(Post).filter(
+            Post.recurrence_id == recurrence.id,
+            Post.status == 'template'
+        ).first()
+        if not template or not recurrence.is_active:
+            return None
+
+        next_time = self.next_occurrence(recurrence.rule, recurrence.timezone, recurrence.dtstart, after_utc)
+        if next_time is None:
+            recurrence.is_active = False
+            recurrence.next_run = None
+            db.commit()
+            logger.info(f"Recurrence {recurrence.id} has no more occurrences")
+            return None
+
+        occurrence = Post(
+            user_id=template.user_id,
+            original_hash=template.original_hash,
+            edited_hash=template.edited_hash,
+            preview=template.preview,
+            template_used=template.template_used,
+            custom_prompt=template.custom_prompt,
+            media_items=[PostMedia(media_id=item.media_id, position=item.position) for item in template.media_items],
+            scheduled_time=next_time,
+            target_channel=template.target_channel,
+            recurrence_id=recurrence.id,
+            targets=[PostTarget(chat_id=target.chat_id) for target in template.targets],
+            status='scheduled'
+        )
+        db.add(occurrence)
+        recurrence.next_run = next_time
+        db.commit()
+        logger.info(f"Materialized occurrence {occurrence.id} of recurrence {recurrence.id} for {next_time}")
+        return occurrence
+
+    def ensure_pending_occurrences(self, db: Session) -> List[Post]:
+        """Make sure every active recurrence has exactly one pending occurrence"""
+        created = []
+        now = datetime.utcnow()
+        for recurrence in db.query(Recurrence).filter(Recurrence.is_active == True).all():
+            occurrence = self.materialize_next(db, recurrence, max(now, recurrence.last_run or now))
+            if occurrence:
+                created.append(occurrence)
+        return created
@@ -0,0 +1,158 @@
+"""
+Rendering of post texts for Telegram: HTML escaping and splitting to the message/caption limits
+
+Limits are counted on the visible text (what Telegram counts after entity parsing) in UTF-16 code
+units like Telegram does, so an emoji counts twice. Chunks are escaped only after splitting so an
+entity like &amp; is never cut in half.
+"""
+
+import html
+import re
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+TEXT_LIMIT = 4096
+CAPTION_LIMIT = 1024
+# Each text in the edit preview shows two texts plus headers in one message
+PREVIEW_LIMIT = 1500
+CAPTION_ALBUM_MAX = 10
+
+SENTENCE_END_RE = re.compile(r'(?<=[.!?…])\s+')
+
+def escape(text: str) -> str:
+    """Escape user text for ParseMode.HTML"""
+    return html.escape(text or '', quote=False)
+
+def tg_len(text: str) -> int:
+    """Length as Telegram counts it, in UTF-16 code units"""
+    return len(text.encode('utf-16-le')) // 2
+
+def _cut(text: str, limit: int) -> str:
+    """Longest prefix of at most limit UTF-16 code units, never splitting a surrogate pair"""
+    return text.encode('utf-16-le')[:limit * 2].decode('utf-16-le', errors='ignore')
+
+def _pieces(text: str, separator) -> Tuple[List[str], str]:
+    if isinstance(separator, str):
+        return text.split(separator), separator
+    return separator.split(text), ' '
+
+def _split_raw(text: str, limit: int) -> List[str]:
+    if tg_len(text) <= limit:
+        return [text]
+    # Prefer paragraph, then line, then sentence, then word boundaries
+    for separator in ('\n\n', '\n', SENTENCE_END_RE, ' '):
+        pieces, joiner = _pieces(text, separator)
+        if len(pieces) < 2:
+            continue
+        chunks = []
+        current = ''
+        for piece in pieces:
+            if tg_len(piece) > limit:
+                # Too long even alone, split it on finer boundaries
+                if current:
+                    chunks.append(current)
+                    current = ''
+                chunks.extend(_split_raw(piece, limit))
+                continue
+            candidate = f"{current}{joiner}{piece}" if current else piece
+            if tg_len(candidate) <= limit:
+                current = candidate
+            else:
+                chunks.append(current)
+                current = piece
+        if current:
+            chunks.append(current)
+        return chunks
+    # A single word longer than the limit
+    chunks = []
+    while text:
+        chunk = _cut(text, limit)
+        chunks.append(chunk)
+        text = text[len(chunk):]
+    return chunks
+
+def split_text(text: str, limit: int = TEXT_LIMIT) -> List[str]:
+    """
+    Split text into HTML-escaped chunks of at most limit visible characters
+
+    Returns:
+        Escaped chunks in order, empty list for empty text
+    """
+    text = (text or '').strip()
+    if not text:
+        return []
+    return [escape(chunk.strip()) for chunk in _split_raw(text, limit) if chunk.strip()]
+
+def truncate(text: str, limit: int) -> str:
+    """Escaped text cut to limit visible characters on a word boundary, with a note about the rest"""
+    text = (text or '').strip()
+    if tg_len(text) <= limit:
+        return escape(text)
+    cut = _cut(text, limit)
+    if ' ' in cut[len(cut) // 2:]:
+        cut = cut[:cut.rindex(' ')]
+    return f"{escape(cut)}… <i>(ещё {len(text) - len(cut)} символов)</i>"
+
+def collapsed(text: str, limit: int = PREVIEW_LIMIT) -> str:
+    """Preview block that Telegram clients show collapsed, truncated to fit next to other content"""
+    return f"<blockquote expandable>{truncate(text, limit)}</blockquote>"
+
+def plan_post(text: str, has_media: bool) -> Tuple[Optional[str], List[str]]:
+    """
+    Decide where the post text goes
+
+    Returns:
+        (caption, messages): a short text rides on the first media as its caption,
+        otherwise it is sent as separate messages before the media
+    """
+    text = (text or '').strip()
+    if has_media and tg_len(text) <= CAPTION_LIMIT:
+        return (escape(text) or None), []
+    return None, split_text(text)
+
+def build_requests(chat_id: str, caption: Optional[str], messages: List[str], albums: List[List]) -> List[Tuple[object, bool]]:
+    """
+    Build the Bot API calls for one chat from a plan_post result and media groups
+
+    Returns:
+        (method, required) pairs in send order, a failed optional call (extra media) does not fail the post
+    """
+    from aiogram.enums import ParseMode
+    from aiogram.methods import SendMediaGroup, SendMessage, SendPhoto, SendVideo
+    from aiogram.types import InputMediaPhoto, InputMediaVideo
+
+    requests = [(SendMessage(chat_id=chat_id, text=chunk, parse_mode=ParseMode.HTML), True) for chunk in messages]
+    for index, album in enumerate(albums):
+        album_caption = caption if index == 0 else None
+        # The caption is the post text, without it nothing was published
+        required = album_caption is not None
+        if len(album) == 1:
+            item = album[0]
+            method_class = SendPhoto if item.type == 'photo' else SendVideo
+            field = 'photo' if item.type == 'photo' else 'video'
+            method = method_class(chat_id=chat_id, caption=album_caption, parse_mode=ParseMode.HTML, **{field: item.file_id})
+        else:
+            if len(album) > CAPTION_ALBUM_MAX:
+                raise ValueError(f"Album of {len(album)} items exceeds {CAPTION_ALBUM_MAX}")
+            method = SendMediaGroup(chat_id=chat_id, media=[
+                (InputMediaPhoto if item.type == 'photo' else InputMediaVideo)(
+                    media=item.file_id,
+                    caption=album_caption if position == 0 else None,
+                    parse_mode=ParseMode.HTML
+                )
+                for position, item in enumerate(album)
+            ])
+        requests.append((method, required))
+    return requests
+
+class PreparedPost:
+    """Requests of a post built ahead of its deadline, keyed by PostTarget.id"""
+
+    def __init__(self, post_id: int, user_id: int, telegram_id: int, scheduled_time: datetime,
+                 requests: Dict[int, Tuple[str, List[Tuple[object, bool]]]]):
+        self.post_id = post_id
+        self.user_id = user_id
+        self.telegram_id = telegram_id
+        self.scheduled_time = scheduled_time
+        self.requests = requests
+        self.due_ts = None
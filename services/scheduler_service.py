@@ -1,201 +1,471 @@
 import asyncio
+import heapq
 import logging
+import time
 from datetime import datetime, timedelta
-from typing import Dict, List
+from typing import Dict, List, Optional, Tuple
+from config import Config
 from database.database import get_db
-from database.models import Post
+from aiogram.methods import SendMessage, TelegramMethod
+from database.models import Post, PostTarget
+from services.media_service import build_albums
+from services.metrics import SCHEDULER_WINDOW_SIZE, record_publish
+from services.publish_journal import PublishJournal, step_keys
+from services.publisher_pool import PublisherPool
+from services.renderer import PreparedPost, build_requests, plan_post
+from services.tracing import traced
+from services.catchup_service import CatchUpService
+from services.recurrence_service import RecurrenceService
 from sqlalchemy.orm import Session
 
 logger = logging.getLogger(__name__)
 
+EPOCH = datetime(1970, 1, 1)
+
+def to_timestamp(moment: datetime) -> float:
+    """Naive UTC datetime to a unix timestamp"""
+    return (moment - EPOCH).total_seconds()
+
 class SchedulerService:
-    def __init__(self, bot):
+    def __init__(self, bot, publisher_pool: Optional[PublisherPool] = None):
+        # The interactive bot notifies authors, the pool's tokens publish
         self.bot = bot
+        self.publishers = publisher_pool or PublisherPool(bot)
         self.running = False
-        self.scheduled_tasks: Dict[int, asyncio.Task] = {}
+        # Sliding window: only posts due before window_end are kept, as compact (due_ts, post_id) tuples
+        self.window: List[Tuple[float, int]] = []
+        self.window_ids: Dict[int, float] = {}
+        self.window_end: Optional[datetime] = None
+        self.wakeup = asyncio.Event()
+        # Payloads are built PUBLISH_PREPARE_LEAD seconds ahead: (prepare_ts, due_ts, post_id)
+        self.prepare_queue: List[Tuple[float, float, int]] = []
+        self.prepared: Dict[int, PreparedPost] = {}
+        self.recurrence_service = RecurrenceService()
+        self.catchup_service = CatchUpService(bot, self.recurrence_service)
+        self.journal = PublishJournal()
+        # Bounded below the DB connection pool size, each publish holds a session
+        self.publish_semaphore = asyncio.Semaphore(Config.PUBLISH_CONCURRENCY)
+        self.publishing = set()
+        self.publish_tasks = set()
+        self.warmup_task = None
+        self.loop_task = None
         
     async def start(self):
         """Start the scheduler service"""
         self.running = True
         logger.info("Scheduler service started")
         
-        # Load existing scheduled posts
-        await self.load_scheduled_posts()
+        # Load the first window in the background so polling can start right away
+        self.warmup_task = asyncio.create_task(self.load_scheduled_posts())
         
         # Start the main loop
-        asyncio.create_task(self._main_loop())
+        self.loop_task = asyncio.create_task(self._main_loop())
         
     async def stop(self):
         """Stop the scheduler service"""
         self.running = False
-        for task in self.scheduled_tasks.values():
-            task.cancel()
-        self.scheduled_tasks.clear()
+        for task in (self.warmup_task, self.loop_task, *self.publish_tasks):
+            if task:
+                task.cancel()
+        self.window.clear()
+        self.window_ids.clear()
+        self.prepare_queue.clear()
+        self.prepared.clear()
         logger.info("Scheduler service stopped")
         
     async def _main_loop(self):
-        """Main scheduler loop"""
+        """Main scheduler loop: fire due posts, refill the window periodically"""
+        if self.warmup_task:
+            await asyncio.gather(self.warmup_task, return_exceptions=True)
+        next_refill = time.monotonic() + Config.SCHEDULER_REFILL_INTERVAL
         while self.running:
             try:
-                await self._check_scheduled_posts()
-                await asyncio.sleep(30)  # Check every 30 seconds
+                if time.monotonic() >= next_refill:
+                    await self._refill_window()
+                    next_refill = time.monotonic() + Config.SCHEDULER_REFILL_INTERVAL
+                    
+                self._dispatch_prepare()
+                self._dispatch_due()
+                
+                # Sleep until the next due post or payload, the next refill or a wake-up from schedule_post
+                timeout = next_refill - time.monotonic()
+                if self.window:
+                    timeout = min(timeout, self.window[0][0] - time.time())
+                if self.prepare_queue:
+                    timeout = min(timeout, self.prepare_queue[0][0] - time.time())
+                self.wakeup.clear()
+                if timeout > 0:
+                    try:
+                        await asyncio.wait_for(self.wakeup.wait(), timeout)
+                    except asyncio.TimeoutError:
+                        pass
+            except asyncio.CancelledError:
+                raise
             except Exception as e:
                 logger.error(f"Error in scheduler main loop: {str(e)}")
                 await asyncio.sleep(60)
                 
     async def load_scheduled_posts(self):
-        """Load existing scheduled posts from database"""
+        """Load the first window of scheduled posts"""
+        db_gen = get_db()
         try:
-            db = next(get_db())
-            scheduled_posts = db.query(Post).filter(
-                Post.status == 'scheduled',
-                Post.scheduled_time > datetime.utcnow()
-            ).all()
-            
-            for post in scheduled_posts:
-                await self._schedule_post(post)
-                
-            logger.info(f"Loaded {len(scheduled_posts)} scheduled posts")
+            db = next(db_gen)
             
+            # Recurrences keep a single pending occurrence, restore it if a crash lost it
+            self.recurrence_service.ensure_pending_occurrences(db)
         except Exception as e:
-            logger.error(f"Error loading scheduled posts: {str(e)}")
+            logger.error(f"Error restoring recurring posts: {str(e)}")
+        finally:
+            db_gen.close()
             
-    async def _schedule_post(self, post: Post):
-        """Schedule a post for publishing"""
+        # Posts missed during downtime are rescheduled or skipped before the window picks them up
         try:
-            # Calculate delay until scheduled time
-            now = datetime.utcnow()
-            delay = (post.scheduled_time - now).total_seconds()
-            
-            if delay <= 0:
-                # Post is overdue, publish immediately
-                await self._publish_post(post)
-            else:
-                # Schedule for later
-                task = asyncio.create_task(self._delayed_publish(post, delay))
-                self.scheduled_tasks[post.id] = task
-                logger.info(f"Scheduled post {post.id} for {post.scheduled_time}")
-                
+            await self.catchup_service.run()
         except Exception as e:
-            logger.error(f"Error scheduling post {post.id}: {str(e)}")
+            logger.error(f"Error catching up overdue posts: {str(e)}")
             
-    async def _delayed_publish(self, post: Post, delay: float):
-        """Publish post after delay"""
+        await self._refill_window()
+        logger.info(f"Loaded {len(self.window_ids)} scheduled posts due within {Config.SCHEDULER_WINDOW}s")
+        
+    async def _refill_window(self):
+        """Add posts due within the horizon (overdue included) using the (status, scheduled_time) index"""
+        db_gen = get_db()
         try:
-            await asyncio.sleep(delay)
-            await self._publish_post(post)
-        except asyncio.CancelledError:
-            logger.info(f"Post {post.id} publishing was cancelled")
+            db = next(db_gen)
+            window_end = datetime.utcnow() + timedelta(seconds=Config.SCHEDULER_WINDOW)
+            rows = db.query(Post.id, Post.scheduled_time).filter(
+                Post.status == 'scheduled',
+                Post.scheduled_time <= window_end
+            ).all()
+            self.window_end = window_end
+            for post_id, scheduled_time in rows:
+                if post_id not in self.window_ids and post_id not in self.publishing:
+                    self._push(post_id, to_timestamp(scheduled_time))
+            SCHEDULER_WINDOW_SIZE.set(len(self.window_ids))
         except Exception as e:
-            logger.error(f"Error in delayed publish for post {post.id}: {str(e)}")
+            logger.error(f"Error refilling scheduler window: {str(e)}")
+        finally:
+            db_gen.close()
             
-    async def _publish_post(self, post: Post):
-        """Publish post to target channel"""
+    def _push(self, post_id: int, due_ts: float):
+        """Insert a post into the window, replacing an earlier entry for the same post"""
+        self.window_ids[post_id] = due_ts
+        heapq.heappush(self.window, (due_ts, post_id))
+        heapq.heappush(self.prepare_queue, (due_ts - Config.PUBLISH_PREPARE_LEAD, due_ts, post_id))
+        self.wakeup.set()
+        
+    def _dispatch_due(self) -> List[asyncio.Task]:
+        """Start publishing every post whose due time has passed"""
+        tasks = []
+        now_ts = time.time()
+        while self.window and self.window[0][0] <= now_ts:
+            due_ts, post_id = heapq.heappop(self.window)
+            # Entries of cancelled or rescheduled posts are dropped lazily
+            if self.window_ids.get(post_id) != due_ts:
+                continue
+            del self.window_ids[post_id]
+            task = asyncio.create_task(self._publish_bounded(post_id, due_ts))
+            self.publish_tasks.add(task)
+            task.add_done_callback(self.publish_tasks.discard)
+            tasks.append(task)
+        SCHEDULER_WINDOW_SIZE.set(len(self.window_ids))
+        return tasks
+        
+    async def _publish_bounded(self, post_id: int, due_ts: Optional[float] = None):
+        async with self.publish_semaphore:
+            await self._publish_post(post_id, due_ts)
+            
+    def _prepare_payload(self, post_id: int, fire_at: datetime) -> Optional[PreparedPost]:
+        """Read the post and build the exact Telegram requests for every target due at fire_at"""
+        db_gen = get_db()
         try:
-            db = next(get_db())
+            db = next(db_gen)
             
             # Get the post from database to ensure we have latest data
-            current_post = db.query(Post).filter(Post.id == post.id).first()
+            current_post = db.query(Post).filter(Post.id == post_id).first()
             if not current_post or current_post.status != 'scheduled':
-                return
+                return None
                 
             # Prepare text for publishing
             text_to_publish = current_post.edited_text if current_post.edited_text else current_post.original_text
             
-            if not text_to_publish:
-                logger.error(f"Post {post.id} has no text to publish")
-                return
-                
-            # Publish to target channel
-            target_channel = current_post.target_channel or self.bot.config.TARGET_CHANNEL_ID
-            if not target_channel:
+            # Posts created before multi-channel support only have target_channel
+            if not current_post.targets:
+                chats = [chat.strip() for chat in (current_post.target_channel or '').split(',') if chat.strip()]
+                for chat_id in chats or Config.TARGET_CHANNEL_IDS:
+                    current_post.targets.append(PostTarget(chat_id=chat_id))
+                db.commit()
+            if not current_post.targets:
                 logger.error("No target channel configured")
-                return
+                return None
                 
-            # Send text message
-            message = await self.bot.send_message(target_channel, text_to_publish)
+            due_targets = [
+                target for target in current_post.targets
+                if target.status != 'published'
+                and target.attempts < Config.PUBLISH_MAX_ATTEMPTS
+                and (target.next_attempt_at is None or target.next_attempt_at <= fire_at)
+            ]
             
-            # Send media files if any
-            if current_post.media_files:
-                for media_item in current_post.media_files:
-                    try:
-                        if media_item['type'] == 'photo':
-                            await self.bot.send_photo(target_channel, media_item['file_id'])
-                        elif media_item['type'] == 'video':
-                            await self.bot.send_video(target_channel, media_item['file_id'])
-                    except Exception as e:
-                        logger.error(f"Error sending media {media_item['file_id']}: {str(e)}")
-                        
-            # Update post status
-            current_post.status = 'published'
-            current_post.published_time = datetime.utcnow()
-            db.commit()
+            # Media metadata was registered and validated ahead of time, albums need no API lookups
+            media = [item.media for item in current_post.media_items]
+            broken = [item for item in media if item.is_valid is False]
+            if broken:
+                logger.warning(f"Post {post_id}: skipping {len(broken)} unavailable media file(s)", extra={'post_id': post_id})
+            albums = build_albums([item for item in media if item.is_valid is not False])
             
-            # Remove from scheduled tasks
-            if post.id in self.scheduled_tasks:
-                del self.scheduled_tasks[post.id]
+            if not text_to_publish and not albums:
+                logger.error(f"Post {post_id} has no text to publish")
+                return None
                 
-            # Notify user
+            # Split to Telegram limits once for all targets, short texts become the media caption
+            caption, messages = plan_post(text_to_publish, bool(albums))
+            
+            return PreparedPost(
+                post_id=post_id,
+                user_id=current_post.user_id,
+                telegram_id=current_post.user.telegram_id,
+                scheduled_time=current_post.scheduled_time,
+                requests={
+                    target.id: (target.chat_id, build_requests(target.chat_id, caption, messages, albums))
+                    for target in due_targets
+                }
+            )
+        finally:
+            db_gen.close()
+            
+    def _dispatch_prepare(self):
+        """Build payloads of posts due within PUBLISH_PREPARE_LEAD so publishing only sends requests"""
+        now_ts = time.time()
+        while self.prepare_queue and self.prepare_queue[0][0] <= now_ts:
+            prepare_ts, due_ts, post_id = heapq.heappop(self.prepare_queue)
+            if self.window_ids.get(post_id) != due_ts:
+                continue
             try:
-                await self.bot.send_message(
-                    current_post.user.telegram_id,
-                    f"✅ Пост успешно опубликован в {target_channel}!"
-                )
+                prepared = self._prepare_payload(post_id, datetime.utcfromtimestamp(due_ts))
             except Exception as e:
-                logger.error(f"Error notifying user about published post: {str(e)}")
+                # Publishing prepares again at the deadline
+                logger.error(f"Error preparing post {post_id}: {str(e)}", extra={'post_id': post_id})
+                continue
+            if prepared:
+                prepared.due_ts = due_ts
+                self.prepared[post_id] = prepared
                 
-            logger.info(f"Post {post.id} published successfully")
+    @traced()
+    async def _publish_post(self, post_id: int, due_ts: Optional[float] = None):
+        """Publish post to all of its target channels"""
+        if post_id in self.publishing:
+            return
+        self.publishing.add(post_id)
+        try:
+            prepared = self.prepared.pop(post_id, None)
+            if prepared is None or prepared.due_ts != due_ts:
+                prepared = self._prepare_payload(post_id, datetime.utcnow())
+            if prepared is None:
+                return
+                
+            # Steps confirmed by an earlier attempt or before a crash are not sent again
+            journaled = await asyncio.to_thread(self.journal.load, post_id)
+            
+            # Fan out to all due targets concurrently, the rate limiter paces the API calls
+            results = await asyncio.gather(*(
+                self._send_requests(post_id, target_id, chat_id, requests, journaled.get(target_id, {}))
+                for target_id, (chat_id, requests) in prepared.requests.items()
+            ))
+            await self._record_results(prepared, dict(zip(prepared.requests, results)))
             
         except Exception as e:
-            logger.error(f"Error publishing post {post.id}: {str(e)}")
+            logger.error(f"Error publishing post {post_id}: {str(e)}", extra={'post_id': post_id})
             
             # Update post status to error
+            error_db_gen = get_db()
             try:
-                db = next(get_db())
-                current_post = db.query(Post).filter(Post.id == post.id).first()
+                db = next(error_db_gen)
+                current_post = db.query(Post).filter(Post.id == post_id).first()
                 if current_post:
                     current_post.status = 'error'
                     db.commit()
+                    await self._schedule_next_occurrence(db, current_post)
             except Exception as db_error:
                 logger.error(f"Error updating post status: {str(db_error)}")
-                
-    async def _check_scheduled_posts(self):
-        """Check for posts that need to be published"""
+            finally:
+                error_db_gen.close()
+        finally:
+            self.publishing.discard(post_id)
+            
+    async def _send_requests(self, post_id: int, target_id: int, chat_id: str,
+                             requests: List[Tuple[TelegramMethod, bool]],
+                             journaled: Dict[str, Tuple[str, Optional[int]]]):
+        """
+        Fire the pre-built requests of one target in order, skipping steps the journal has as sent
+        
+        Returns:
+            (message_id, error): id of the first sent message, or the error that stopped publishing
+        """
+        message_id = None
+        delivered = False
+        uses_files = any(not isinstance(method, SendMessage) for method, _ in requests)
+        publisher = self.publishers.for_chat(chat_id, uses_files)
         try:
-            db = next(get_db())
-            now = datetime.now()
+            keys = step_keys([method for method, _ in requests])
+            for step, ((method, required), step_key) in enumerate(zip(requests, keys)):
+                state, sent_id = journaled.get(step_key, (None, None))
+                if state == 'intent':
+                    # The process stopped during this call and the Bot API cannot tell whether it reached
+                    # the channel: assume it did, a lost message is preferred to a duplicate
+                    logger.warning(
+                        f"Step {step} of post {post_id} to {chat_id} was interrupted, assuming it was sent",
+                        extra={'post_id': post_id, 'target': chat_id}
+                    )
+                if state in ('sent', 'intent'):
+                    delivered = True
+                    if message_id is None:
+                        message_id = sent_id
+                    continue
+
+                api_method = method.__api_method__
+                await self.journal.append(post_id, target_id, step, step_key, api_method, 'intent')
+                try:
+                    result = await publisher.call(method)
+                except Exception as e:
+                    self.publishers.report_error(chat_id, publisher, e)
+                    await self.journal.append(post_id, target_id, step, step_key, api_method, 'failed', error=str(e))
+                    if required:
+                        raise
+                    logger.error(f"Error sending media to {chat_id}: {str(e)}", extra={'post_id': post_id, 'target': chat_id})
+                    continue
+                sent_id = (result[0] if isinstance(result, list) else result).message_id
+                await self.journal.append(post_id, target_id, step, step_key, api_method, 'sent', message_id=sent_id)
+                delivered = True
+                if message_id is None:
+                    message_id = sent_id
+            if not delivered:
+                raise RuntimeError("Nothing was sent")
+            return message_id, None
+        except Exception as e:
+            logger.error(f"Error publishing post {post_id} to {chat_id}: {str(e)}", extra={'post_id': post_id, 'target': chat_id})
+            return None, str(e)
             
-            # Find posts that should be published now
-            posts_to_publish = db.query(Post).filter(
-                Post.status == 'scheduled',
-                Post.scheduled_time <= now
-            ).all()
+    async def _record_results(self, prepared: PreparedPost, results: Dict[int, Tuple[Optional[int], Optional[str]]]):
+        """Store per-target outcomes, finish the post once no target is waiting for retry"""
+        post_id = prepared.post_id
+        db_gen = get_db()
+        try:
+            db = next(db_gen)
+            current_post = db.query(Post).filter(Post.id == post_id).first()
+            now = datetime.utcnow()
+            for target in current_post.targets:
+                if target.id not in results:
+                    continue
+                message_id, error = results[target.id]
+                target.attempts = (target.attempts or 0) + 1
+                if error is None:
+                    target.status = 'published'
+                    target.message_id = message_id
+                    target.published_time = now
+                    target.next_attempt_at = None
+                    target.last_error = None
+                    record_publish('success', (now - prepared.scheduled_time).total_seconds())
+                else:
+                    record_publish('failure')
+                    target.status = 'error'
+                    target.last_error = error
+                    target.next_attempt_at = now + timedelta(seconds=Config.PUBLISH_RETRY_DELAY * target.attempts)
+            db.commit()
             
-            for post in posts_to_publish:
-                await self._publish_post(post)
+            published = [target for target in current_post.targets if target.status == 'published']
+            retrying = [
+                target for target in current_post.targets
+                if target.status != 'published' and target.attempts < Config.PUBLISH_MAX_ATTEMPTS
+            ]
+            if retrying:
+                # Failed targets are retried once the earliest next_attempt_at passes
+                next_attempt = min(target.next_attempt_at for target in retrying if target.next_attempt_at)
+                self._push(post_id, to_timestamp(next_attempt))
+                logger.info(f"Post {post_id}: {len(published)} target(s) published, {len(retrying)} waiting for retry")
+                return
                 
+            # Update post status
+            current_post.status = 'published' if published else 'error'
+            current_post.published_time = now if published else None
+            db.commit()
+            
+            await self._schedule_next_occurrence(db, current_post)
+            failed = [target for target in current_post.targets if target.status != 'published']
+        finally:
+            db_gen.close()
+            
+        # Notify user
+        try:
+            if not failed:
+                notification = f"✅ Пост успешно опубликован в {', '.join(t.chat_id for t in published)}!"
+            elif published:
+                notification = (
+                    f"⚠️ Пост опубликован в {', '.join(t.chat_id for t in published)}, "
+                    f"но не удалось опубликовать в {', '.join(t.chat_id for t in failed)}."
+                )
+            else:
+                notification = f"❌ Не удалось опубликовать пост в {', '.join(t.chat_id for t in failed)}."
+            await self.bot.send_message(prepared.telegram_id, notification)
         except Exception as e:
-            logger.error(f"Error checking scheduled posts: {str(e)}")
+            logger.error(f"Error notifying user about published post: {str(e)}")
             
+        lag_ms = round((now - prepared.scheduled_time).total_seconds() * 1000)
+        logger.info(
+            f"Post {post_id} finished: {len(published)} published, {len(failed)} failed",
+            extra={'post_id': post_id, 'user_id': prepared.user_id, 'latency_ms': lag_ms}
+        )
+        
+    async def _schedule_next_occurrence(self, db: Session, post: Post):
+        """Materialize and schedule the next occurrence of a recurring post"""
+        if not post.recurrence_id:
+            return
+        try:
+            recurrence = post.recurrence
+            recurrence.last_run = post.scheduled_time
+            after = max(post.scheduled_time, datetime.utcnow())
+            next_post = self.recurrence_service.materialize_next(db, recurrence, after)
+            if next_post:
+                self._schedule_post(next_post)
+        except Exception as e:
+            logger.error(f"Error scheduling next occurrence for post {post.id}: {str(e)}", extra={'post_id': post.id})
+            
+    def _schedule_post(self, post: Post):
+        """Add a post to the window if it falls before the current window end"""
+        if self.window_end is None or post.scheduled_time > self.window_end:
+            # Picked up by a later refill
+            return
+        self._push(post.id, to_timestamp(post.scheduled_time))
+        SCHEDULER_WINDOW_SIZE.set(len(self.window_ids))
+        
     def schedule_post(self, post: Post):
         """Schedule a new post"""
-        asyncio.create_task(self._schedule_post(post))
+        self._schedule_post(post)
+        
+    def publish_now(self, post_id: int):
+        """Put a post that was just marked scheduled at the front of the window"""
+        self._push(post_id, time.time())
+        SCHEDULER_WINDOW_SIZE.set(len(self.window_ids))
         
     def cancel_post(self, post_id: int):
         """Cancel a scheduled post"""
-        if post_id in self.scheduled_tasks:
-            self.scheduled_tasks[post_id].cancel()
-            del self.scheduled_tasks[post_id]
+        # The heap entry is skipped when it comes due
+        self.prepared.pop(post_id, None)
+        if self.window_ids.pop(post_id, None) is not None:
+            SCHEDULER_WINDOW_SIZE.set(len(self.window_ids))
             logger.info(f"Post {post_id} cancelled")
             
     def get_scheduled_posts(self, user_id: int) -> List[Post]:
         """Get scheduled posts for a user"""
         try:
-            db = next(get_db())
-            return db.query(Post).filter(
-                Post.user_id == user_id,
-                Post.status == 'scheduled'
-            ).order_by(Post.scheduled_time).all()
+            db_gen = get_db()
+            db = next(db_gen)
+            try:
+                return db.query(Post).filter(
+                    Post.user_id == user_id,
+                    Post.status == 'scheduled'
+                ).order_by(Post.scheduled_time).all()
+            finally:
+                db_gen.close()
         except Exception as e:
             logger.error(f"Error getting scheduled posts: {str(e)}")
             return [] 
\ No newline at end of file
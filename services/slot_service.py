@@ -0,0 +1,89 @@
+import calendar
+import logging
+from datetime import datetime, timedelta
+from typing import List, Tuple
+
+from sqlalchemy import Integer, cast, func, literal_column
+from sqlalchemy.orm import Session
+
+from config import Config
+from database.models import Post, PostTarget
+
+logger = logging.getLogger(__name__)
+
+class SlotAllocator:
+    """Spreads posts of the same channel at least SLOT_SPACING seconds apart"""
+
+    def __init__(self, spacing: int = None, max_shift: int = None):
+        self.spacing = timedelta(seconds=Config.SLOT_SPACING if spacing is None else spacing)
+        self.max_shift = timedelta(seconds=Config.SLOT_MAX_SHIFT if max_shift is None else max_shift)
+
+    def _scheduled_times(self, db: Session, chat_ids: List[str], start: datetime, end: datetime) -> List[datetime]:
+        """Scheduled times of posts to any of chat_ids in [start, end), a range scan on (status, scheduled_time)"""
+        rows = db.query(Post.scheduled_time).join(PostTarget, PostTarget.post_id == Post.id).filter(
+            Post.status == 'scheduled',
+            Post.scheduled_time >= start,
+            Post.scheduled_time < end,
+            PostTarget.chat_id.in_(chat_ids)
+        ).order_by(Post.scheduled_time).all()
+        return [scheduled_time for (scheduled_time,) in rows]
+
+    def allocate(self, db: Session, chat_ids: List[str], requested: datetime) -> datetime:
+        """
+        Earliest time at or after requested that is SLOT_SPACING away from other posts to the same channels
+
+        Returns:
+            The adjusted time, or requested itself when no free slot exists within SLOT_MAX_SHIFT
+        """
+        if not chat_ids or self.spacing.total_seconds() <= 0:
+            return requested
+        taken = self._scheduled_times(db, chat_ids, requested - self.spacing, requested + self.max_shift + self.spacing)
+        candidate = requested
+        for scheduled_time in taken:
+            if scheduled_time - candidate >= self.spacing:
+                # Sorted, so every later post is even further away
+                break
+            if candidate - scheduled_time < self.spacing:
+                candidate = scheduled_time + self.spacing
+        if candidate - requested > self.max_shift:
+            logger.info(f"No free slot within {self.max_shift} of {requested} for {', '.join(chat_ids)}")
+            return requested
+        return candidate
+
+    @staticmethod
+    def _seconds_since(db: Session, start: datetime):
+        """Whole seconds from start to Post.scheduled_time as an SQL expression, None for other dialects"""
+        dialect = db.get_bind().dialect.name
+        if dialect == 'sqlite':
+            # Naive datetimes are stored as UTC text, strftime('%s') reads them as UTC
+            epoch = calendar.timegm(start.timetuple())
+            return cast(func.strftime('%s', Post.scheduled_time), Integer) - epoch
+        if dialect == 'postgresql':
+            return cast(func.floor(func.extract('epoch', Post.scheduled_time - start)), Integer)
+        if dialect == 'mysql':
+            return func.timestampdiff(literal_column('SECOND'), start, Post.scheduled_time)
+        return None
+
+    def channel_load(self, db: Session, chat_id: str, start: datetime, end: datetime,
+                     slot_seconds: int) -> List[Tuple[datetime, int]]:
+        """Number of scheduled posts to chat_id per slot of slot_seconds between start and end"""
+        slot = timedelta(seconds=slot_seconds)
+        slots = int((end - start) / slot) + 1
+        counts = [0] * slots
+        seconds = self._seconds_since(db, start)
+        if seconds is None:
+            # No date arithmetic for this dialect, bucket the range scan in Python
+            for scheduled_time in self._scheduled_times(db, [chat_id], start, start + slot * slots):
+                counts[int((scheduled_time - start) / slot)] += 1
+            return [(start + slot * index, count) for index, count in enumerate(counts)]
+        # Grouped in SQL, only one row per busy slot comes back
+        bucket = (seconds // slot_seconds).label('slot_index')
+        rows = db.query(bucket, func.count(Post.id)).join(PostTarget, PostTarget.post_id == Post.id).filter(
+            Post.status == 'scheduled',
+            Post.scheduled_time >= start,
+            Post.scheduled_time < start + slot * slots,
+            PostTarget.chat_id == chat_id
+        ).group_by(bucket).all()
+        for slot_index, count in rows:
+            counts[int(slot_index)] = count
+        return [(start + slot * index, count) for index, count in enumerate(counts)]
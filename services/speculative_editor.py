@@ -0,0 +1,123 @@
+import asyncio
+import hashlib
+import logging
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from config import Config
+from database.models import Post, Template, User
+from services.deepseek_service import DeepseekService
+from services.metrics import SPECULATIVE_EDITS
+
+logger = logging.getLogger(__name__)
+
+# Finished speculative edits kept at most, oldest are evicted first
+CACHE_SIZE = 1000
+
+class SpeculativeEditor:
+    """
+    Starts the most likely AI edit in the background while the user is still choosing an edit method
+
+    Results go to a single-use edit cache keyed by (text, prompt), so picking the speculated template
+    returns at once and "re-edit" still gets a fresh variant. One speculation runs per user at a time
+    and every user has a daily budget of speculative calls.
+    """
+
+    def __init__(self, deepseek_service: DeepseekService):
+        self.deepseek_service = deepseek_service
+        self.tasks: Dict[int, Tuple[str, asyncio.Task]] = {}
+        self.cache: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self.spent: Dict[int, Tuple[datetime, int]] = {}
+
+    @staticmethod
+    def _key(text: str, prompt: str) -> str:
+        return hashlib.sha256(f"{prompt}\0{text}".encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def pick_template(db: Session, telegram_id: int) -> Optional[Tuple[str, str]]:
+        """(name, prompt) of the user's most used template, or of the configured/first default template"""
+        name = db.query(Post.template_used).join(User, User.id == Post.user_id).filter(
+            User.telegram_id == telegram_id,
+            Post.template_used.isnot(None)
+        ).group_by(Post.template_used).order_by(func.count(Post.id).desc()).limit(1).scalar()
+        query = db.query(Template.name, Template.prompt)
+        if name or Config.SPECULATIVE_EDIT_TEMPLATE:
+            template = query.filter(Template.name == (name or Config.SPECULATIVE_EDIT_TEMPLATE)).order_by(Template.id).first()
+            if template:
+                return template.name, template.prompt
+        template = query.filter(Template.is_default == True).order_by(Template.id).first()
+        return (template.name, template.prompt) if template else None
+
+    def _take_budget(self, user_id: int) -> bool:
+        today = datetime.utcnow().date()
+        day, count = self.spent.get(user_id, (today, 0))
+        if day != today:
+            count = 0
+        if count >= Config.SPECULATIVE_EDIT_DAILY_BUDGET:
+            return False
+        self.spent[user_id] = (today, count + 1)
+        return True
+
+    def speculate(self, user_id: int, text: str, prompt: str, template: Optional[str] = None):
+        """Start editing text with prompt in the background, replacing the user's previous speculation"""
+        self.cancel(user_id)
+        key = self._key(text, prompt)
+        if key in self.cache:
+            return
+        if not self._take_budget(user_id):
+            SPECULATIVE_EDITS.labels('over_budget').inc()
+            return
+        SPECULATIVE_EDITS.labels('started').inc()
+        task = asyncio.create_task(self._run(key, user_id, text, prompt, template))
+        self.tasks[user_id] = (key, task)
+        task.add_done_callback(lambda _: self._forget(user_id, task))
+
+    async def _run(self, key: str, user_id: int, text: str, prompt: str, template: Optional[str]):
+        try:
+            result = await self.deepseek_service.edit_text(text, prompt, user_id, template, speculative=True)
+        except Exception as e:
+            logger.error(f"Error in speculative edit: {str(e)}")
+            return
+        if result:
+            self.cache[key] = (time.monotonic(), result)
+            while len(self.cache) > CACHE_SIZE:
+                self.cache.popitem(last=False)
+
+    def _forget(self, user_id: int, task: asyncio.Task):
+        if user_id in self.tasks and self.tasks[user_id][1] is task:
+            del self.tasks[user_id]
+
+    def cancel(self, user_id: int):
+        """Stop the user's running speculation, e.g. when they picked another edit method"""
+        entry = self.tasks.pop(user_id, None)
+        if entry and not entry[1].done():
+            entry[1].cancel()
+            SPECULATIVE_EDITS.labels('cancelled').inc()
+
+    def _take_cached(self, key: str) -> Optional[str]:
+        entry = self.cache.pop(key, None)
+        if entry and time.monotonic() - entry[0] <= Config.SPECULATIVE_EDIT_TTL:
+            return entry[1]
+        return None
+
+    async def edit(self, user_id: int, text: str, prompt: str, template: Optional[str] = None) -> Optional[str]:
+        """Edit text with prompt, reusing a finished or running speculation when it matches"""
+        key = self._key(text, prompt)
+        cached = self._take_cached(key)
+        if cached is None:
+            entry = self.tasks.get(user_id)
+            if entry and entry[0] == key:
+                # Join the running call instead of starting a second one
+                await asyncio.gather(entry[1], return_exceptions=True)
+                cached = self._take_cached(key)
+        if cached is not None:
+            SPECULATIVE_EDITS.labels('hit').inc()
+            return cached
+        SPECULATIVE_EDITS.labels('miss').inc()
+        self.cancel(user_id)
+        return await self.deepseek_service.edit_text(text, prompt, user_id, template)
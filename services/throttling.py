@@ -0,0 +1,143 @@
+"""
+Per-user backpressure for incoming updates, so one flooding user cannot starve the others
+"""
+
+import asyncio
+import logging
+import time
+from typing import Dict, Iterable, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.types import Message
+
+from config import Config
+from services.metrics import THROTTLED_UPDATES
+from services.rate_limiter import RateLimiter
+
+logger = logging.getLogger(__name__)
+
+# Seconds between "too many messages" replies to the same user
+WARN_INTERVAL = 30
+# Seconds between sweeps of idle buckets
+SWEEP_INTERVAL = 300
+# Texts merged into one draft at most, the burst is handed over when full and the next text starts a new one
+COALESCE_MAX_MESSAGES = 20
+
+class _Burst:
+    """Texts of one user arriving less than THROTTLE_COALESCE_DELAY apart"""
+    __slots__ = ('texts', 'last_at')
+
+    def __init__(self, text: str, now: float):
+        self.texts = [text]
+        self.last_at = now
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """
+    Outer dispatcher middleware, runs after aiogram has resolved the user and FSM state
+
+    - a token bucket per user (THROTTLE_RATE updates/s, THROTTLE_BURST back to back)
+    - at most THROTTLE_MAX_IN_FLIGHT updates of a user handled at once
+    - plain texts that start a draft are handled right away, but texts following within
+      THROTTLE_COALESCE_DELAY (a long paste split by the client) are merged with it and the
+      draft is rebuilt once from all of them
+    Updates over the limits are dropped and counted in bot_throttled_updates_total.
+    """
+
+    def __init__(self, coalesce_states: Iterable[Optional[str]] = (None,), rate: float = None,
+                 burst: int = None, max_in_flight: int = None, coalesce_delay: float = None):
+        self.coalesce_states = set(coalesce_states)
+        self.rate = Config.THROTTLE_RATE if rate is None else rate
+        self.burst = Config.THROTTLE_BURST if burst is None else burst
+        self.max_in_flight = Config.THROTTLE_MAX_IN_FLIGHT if max_in_flight is None else max_in_flight
+        self.coalesce_delay = Config.THROTTLE_COALESCE_DELAY if coalesce_delay is None else coalesce_delay
+        self.buckets: Dict[int, RateLimiter] = {}
+        self.in_flight: Dict[int, int] = {}
+        self.bursts: Dict[int, _Burst] = {}
+        self.warned_at: Dict[int, float] = {}
+        self.swept_at = time.monotonic()
+
+    async def __call__(self, handler, event, data):
+        user = data.get('event_from_user')
+        if user is None or user.id == Config.ADMIN_USER_ID:
+            return await handler(event, data)
+        user_id = user.id
+        message = getattr(event, 'message', None)
+
+        if self._coalescible(message, data):
+            now = time.monotonic()
+            burst = self.bursts.get(user_id)
+            if burst and now - burst.last_at < self.coalesce_delay:
+                burst.texts.append(message.text)
+                burst.last_at = now
+                count = len(burst.texts)
+                if count < COALESCE_MAX_MESSAGES:
+                    await asyncio.sleep(self.coalesce_delay)
+                    if self.bursts.get(user_id) is not burst or len(burst.texts) != count:
+                        # A later text carries the merged draft
+                        THROTTLED_UPDATES.labels('coalesced').inc()
+                        return None
+                # A full burst goes out at once, the waiting texts before it see it is gone
+                del self.bursts[user_id]
+                merged = message.model_copy(update={'text': '\n'.join(burst.texts), 'entities': None})
+                event = event.model_copy(update={'message': merged})
+            else:
+                # The first text is never delayed, only texts that follow it are
+                self.bursts[user_id] = _Burst(message.text, now)
+
+        if not self._bucket(user_id).try_acquire():
+            return await self._drop('rate', user_id, event, data)
+        if self.in_flight.get(user_id, 0) >= self.max_in_flight:
+            return await self._drop('in_flight', user_id, event, data)
+
+        self.in_flight[user_id] = self.in_flight.get(user_id, 0) + 1
+        try:
+            return await handler(event, data)
+        finally:
+            self.in_flight[user_id] -= 1
+            if not self.in_flight[user_id]:
+                del self.in_flight[user_id]
+
+    def _coalescible(self, message: Optional[Message], data: dict) -> bool:
+        return (
+            self.coalesce_delay > 0
+            and message is not None
+            and bool(message.text)
+            and not message.text.startswith('/')
+            and data.get('raw_state') in self.coalesce_states
+        )
+
+    def _bucket(self, user_id: int) -> RateLimiter:
+        now = time.monotonic()
+        if now - self.swept_at > SWEEP_INTERVAL:
+            # A bucket idle long enough to be full again holds no state worth keeping
+            idle = self.burst / self.rate if self.rate > 0 else 0
+            self.buckets = {
+                key: bucket for key, bucket in self.buckets.items()
+                if now - bucket.updated_at < idle
+            }
+            self.bursts = {key: burst for key, burst in self.bursts.items() if now - burst.last_at < self.coalesce_delay}
+            self.warned_at = {key: at for key, at in self.warned_at.items() if now - at < WARN_INTERVAL}
+            self.swept_at = now
+        bucket = self.buckets.get(user_id)
+        if bucket is None:
+            bucket = self.buckets[user_id] = RateLimiter(self.rate, burst=self.burst)
+        return bucket
+
+    async def _drop(self, reason: str, user_id: int, event, data: dict):
+        THROTTLED_UPDATES.labels(reason).inc()
+        bot = data['bot']
+        callback = getattr(event, 'callback_query', None)
+        try:
+            if callback is not None:
+                # Every callback needs an answer or the button keeps spinning
+                await bot.answer_callback_query(callback.id, text="⏳ Слишком часто. Подождите немного.")
+                return None
+            now = time.monotonic()
+            if now - self.warned_at.get(user_id, -WARN_INTERVAL) < WARN_INTERVAL:
+                return None
+            self.warned_at[user_id] = now
+            logger.info(f"Throttling user {user_id}: {reason}")
+            await bot.send_message(user_id, "⏳ Слишком много сообщений. Подождите немного и повторите.")
+        except Exception as e:
+            logger.error(f"Error sending throttling notice: {str(e)}")
+        return None
@@ -0,0 +1,187 @@
+import functools
+import json
+import logging
+import os
+import sys
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from sqlalchemy import event
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Spans are written by a dedicated logger so they never mix with bot.log
+span_logger = logging.getLogger('tracing.spans')
+span_logger.propagate = False
+
+_current_span: ContextVar[Optional['Span']] = ContextVar('current_span', default=None)
+
+class Span:
+    """A finished-or-running unit of work, exported in the OpenTelemetry console exporter JSON layout"""
+
+    __slots__ = ('name', 'trace_id', 'span_id', 'parent', 'parent_id', 'start_ns', 'end_ns', 'attributes', 'status', 'token')
+
+    def __init__(self, name: str, parent: Optional['Span'], attributes: Dict[str, Any]):
+        self.name = name
+        self.trace_id = parent.trace_id if parent else os.urandom(16).hex()
+        self.span_id = os.urandom(8).hex()
+        self.parent = parent
+        self.parent_id = parent.span_id if parent else None
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.attributes = attributes
+        self.status = 'UNSET'
+        self.token = None
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def to_json(self) -> str:
+        def iso(ns: int) -> str:
+            return datetime.fromtimestamp(ns / 1e9, tz=timezone.utc).isoformat().replace('+00:00', 'Z')
+
+        return json.dumps({
+            'name': self.name,
+            'context': {'trace_id': f"0x{self.trace_id}", 'span_id': f"0x{self.span_id}", 'trace_state': '[]'},
+            'kind': 'SpanKind.INTERNAL',
+            'parent_id': f"0x{self.parent_id}" if self.parent_id else None,
+            'start_time': iso(self.start_ns),
+            'end_time': iso(self.end_ns),
+            'duration_ms': round((self.end_ns - self.start_ns) / 1e6, 3),
+            'status': {'status_code': self.status},
+            'attributes': self.attributes,
+            'events': [],
+            'links': [],
+            'resource': {'attributes': {'service.name': Config.TRACING_SERVICE_NAME}, 'schema_url': ''}
+        }, ensure_ascii=False, default=str)
+
+class Tracer:
+    """Minimal contextvar-based tracer, a no-op unless TRACING_ENABLED is set"""
+
+    def __init__(self, enabled: bool):
+        self.enabled = enabled
+        self.listener = None
+
+    def configure(self, exporter: str, path: str):
+        """Attach the span exporter: 'console' (stdout) or 'file' (JSON lines)"""
+        if not self.enabled:
+            return
+        handler = logging.FileHandler(path) if exporter == 'file' else logging.StreamHandler(sys.stdout)
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        if Config.LOG_ASYNC:
+            from logging_config import queue_handlers
+            handler, self.listener = queue_handlers([handler])
+        span_logger.handlers = [handler]
+        span_logger.setLevel(logging.INFO)
+
+    def shutdown(self):
+        """Flush spans queued for the background writer"""
+        if self.listener:
+            self.listener.stop()
+            self.listener = None
+
+    def start_span(self, name: str, **attributes) -> Optional[Span]:
+        if not self.enabled:
+            return None
+        span = Span(name, _current_span.get(), attributes)
+        span.token = _current_span.set(span)
+        return span
+
+    def end_span(self, span: Optional[Span], error: Optional[BaseException] = None):
+        if span is None:
+            return
+        span.end_ns = time.time_ns()
+        if error is not None:
+            span.status = 'ERROR'
+            span.attributes['exception.type'] = type(error).__name__
+            span.attributes['exception.message'] = str(error)
+        try:
+            _current_span.reset(span.token)
+        except ValueError:
+            # Ended from a different context than it was started in, restore the parent explicitly
+            _current_span.set(span.parent)
+        span_logger.info(span.to_json())
+
+    @contextmanager
+    def span(self, name: str, **attributes):
+        span = self.start_span(name, **attributes)
+        try:
+            yield span
+        except BaseException as e:
+            self.end_span(span, e)
+            raise
+        else:
+            self.end_span(span)
+
+tracer = Tracer(Config.TRACING_ENABLED)
+
+def traced(name: Optional[str] = None):
+    """Decorator wrapping a coroutine function in a span"""
+    def decorator(func):
+        span_name = name or func.__qualname__
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            if not tracer.enabled:
+                return await func(*args, **kwargs)
+            with tracer.span(span_name):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+class UpdateTracingMiddleware(BaseMiddleware):
+    """Outer dispatcher middleware: one root span per incoming update"""
+
+    async def __call__(self, handler, event, data):
+        with tracer.span('aiogram.update', **{'update.id': getattr(event, 'update_id', None),
+                                              'update.type': getattr(event, 'event_type', None)}):
+            return await handler(event, data)
+
+class HandlerTracingMiddleware(BaseMiddleware):
+    """Inner router middleware: a span named after the UserHandlers method that handles the event"""
+
+    async def __call__(self, handler, event, data):
+        handler_object = data.get('handler')
+        callback = getattr(handler_object, 'callback', None)
+        name = getattr(callback, '__qualname__', 'handler')
+        user = getattr(event, 'from_user', None)
+        with tracer.span(name, **{'user.id': getattr(user, 'id', None)}):
+            return await handler(event, data)
+
+class TelegramTracingMiddleware(BaseRequestMiddleware):
+    """Bot session middleware: a span per Telegram Bot API call"""
+
+    async def __call__(self, make_request, bot, method):
+        api_method = getattr(method, '__api_method__', type(method).__name__)
+        with tracer.span(f"telegram.{api_method}", **{'http.method': 'POST', 'rpc.method': api_method}):
+            return await make_request(bot, method)
+
+def trace_engine(engine):
+    """Emit a span for every SQL statement"""
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        operation = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else 'UNKNOWN'
+        span = tracer.start_span(f"db.{operation}", **{'db.system': engine.dialect.name,
+                                                      'db.statement': statement[:200]})
+        conn.info.setdefault('trace_spans', []).append(span)
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        spans = conn.info.get('trace_spans')
+        if spans:
+            tracer.end_span(spans.pop())
+
+    @event.listens_for(engine, 'handle_error')
+    def _handle_error(exception_context):
+        connection = exception_context.connection
+        spans = connection.info.get('trace_spans') if connection is not None else None
+        if spans:
+            tracer.end_span(spans.pop(), exception_context.original_exception)
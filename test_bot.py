@@ -24,7 +24,7 @@ async def test_deepseek_api():
         return False
         
     # Тест подключения
-    if await deepseek_service.test_connection():
+    if await deepseek_service.probe():
         print("✅ Подключение к Deepseek API успешно")
         
         # Тест редактирования текста
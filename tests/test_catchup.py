@@ -0,0 +1,57 @@
+import asyncio
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from database.models import Base, Post, User
+from services import catchup_service
+from services.catchup_service import CatchUpService
+from services.recurrence_service import RecurrenceService
+
+class FakeBot:
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.sent.append((chat_id, text))
+
+def test_missed_recurring_post_waiting_for_author_is_not_duplicated(monkeypatch):
+    engine = create_engine('sqlite://', poolclass=StaticPool, connect_args={'check_same_thread': False})
+    Base.metadata.create_all(engine)
+    Session = sessionmaker(bind=engine, expire_on_commit=False)
+
+    def get_db():
+        db = Session()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    monkeypatch.setattr(catchup_service, 'get_db', get_db)
+    recurrence_service = RecurrenceService()
+    db = Session()
+    user = User(telegram_id=42)
+    db.add(user)
+    db.flush()
+    template = Post(user_id=user.id, scheduled_time=datetime.utcnow(), preview='daily')
+    db.add(template)
+    db.flush()
+    # Hourly from 90 minutes ago: the first occurrence was due 30 minutes ago, while the bot was down
+    missed = recurrence_service.create_recurrence(
+        db, template, 'FREQ=HOURLY', dtstart=datetime.utcnow() - timedelta(minutes=90)
+    )
+    missed_id = missed.id
+    db.close()
+
+    bot = FakeBot()
+    summary = asyncio.run(CatchUpService(bot, recurrence_service, policy='ask').run())
+    assert summary['asked'] == 1 and len(bot.sent) == 1
+
+    # A restart before the author answers must not materialize another occurrence
+    db = Session()
+    assert recurrence_service.ensure_pending_occurrences(db) == []
+    occurrences = db.query(Post).filter(Post.status != 'template').all()
+    assert [(post.id, post.status) for post in occurrences] == [(missed_id, 'awaiting_approval')]
+    db.close()
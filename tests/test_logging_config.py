@@ -0,0 +1,32 @@
+import json
+import logging
+
+from logging_config import JsonFormatter, queue_handlers
+
+class Collector(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.lines = []
+
+    def emit(self, record):
+        self.lines.append(self.format(record))
+
+def test_queued_json_records_keep_the_exception():
+    collector = Collector()
+    collector.setFormatter(JsonFormatter())
+    handler, listener = queue_handlers([collector])
+    logger = logging.getLogger('test_logging_config')
+    logger.propagate = False
+    logger.addHandler(handler)
+    try:
+        try:
+            1 / 0
+        except ZeroDivisionError:
+            logger.exception("failed %s", 'post', extra={'post_id': 5})
+    finally:
+        listener.stop()
+        logger.removeHandler(handler)
+    entry = json.loads(collector.lines[0])
+    assert entry['message'] == 'failed post'
+    assert entry['post_id'] == 5
+    assert 'ZeroDivisionError' in entry['exception']
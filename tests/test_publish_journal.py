@@ -0,0 +1,57 @@
+import asyncio
+
+from aiogram.methods import SendMessage, SendPhoto
+from sqlalchemy import create_engine
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from database.models import Base
+from services import publish_journal
+from services.publish_journal import PublishJournal, step_keys
+
+def test_keys_survive_a_dropped_step():
+    photo = SendPhoto(chat_id='@c', photo='photo-1')
+    other = SendPhoto(chat_id='@c', photo='photo-2')
+    text = SendMessage(chat_id='@c', text='hello')
+    first = step_keys([photo, other, text])
+    # photo-1 became unavailable and was left out of the rebuilt payload
+    second = step_keys([other, text])
+    assert second == first[1:]
+
+def test_identical_steps_get_distinct_keys():
+    text = SendMessage(chat_id='@c', text='hello')
+    keys = step_keys([text, text])
+    assert len(set(keys)) == 2
+
+def test_unrecorded_failure_is_not_taken_for_sent(monkeypatch):
+    engine = create_engine('sqlite://', poolclass=StaticPool, connect_args={'check_same_thread': False})
+    Base.metadata.create_all(engine)
+    Session = sessionmaker(bind=engine)
+
+    def get_db():
+        db = Session()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    def append(*args):
+        if args[5] == 'failed':
+            raise OperationalError('INSERT', {}, Exception('database is locked'))
+        write(*args)
+
+    monkeypatch.setattr(publish_journal, 'get_db', get_db)
+    write = PublishJournal._append
+    monkeypatch.setattr(PublishJournal, '_append', staticmethod(append))
+    journal = PublishJournal(enabled=True)
+
+    async def attempt():
+        await journal.append(1, 10, 0, 'key', 'sendMessage', 'intent')
+        await journal.append(1, 10, 0, 'key', 'sendMessage', 'failed', error='Bad Request')
+
+    asyncio.run(attempt())
+    assert journal.load(1) == {10: {'key': ('failed', None)}}
+    asyncio.run(journal.append(1, 10, 0, 'key', 'sendMessage', 'sent', message_id=99))
+    assert journal.load(1) == {10: {'key': ('sent', 99)}}
+    assert not journal.unrecorded_failures
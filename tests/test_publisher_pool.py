@@ -0,0 +1,22 @@
+import time
+
+from aiogram.exceptions import TelegramForbiddenError
+from aiogram.methods import SendMessage
+
+from services.publisher_pool import PublisherPool
+
+def forbidden() -> TelegramForbiddenError:
+    return TelegramForbiddenError(method=SendMessage(chat_id='@c', text='x'), message='bot is not a member')
+
+def test_excluded_publishers_are_retried_after_ttl():
+    pool = PublisherPool(object(), [object(), object()], rate=10, affinity='', exclude_ttl=0.05)
+    first = pool.for_chat('@c')
+    pool.report_error('@c', first, forbidden())
+    second = pool.for_chat('@c')
+    assert second is not first
+    pool.report_error('@c', second, forbidden())
+    # Both are excluded, the main bot publishes until the exclusions expire
+    assert pool.for_chat('@c') is pool.primary
+    time.sleep(0.06)
+    assert pool.for_chat('@c') in pool.publishers
+    assert '@c' not in pool.excluded
@@ -0,0 +1,22 @@
+from services.renderer import CAPTION_LIMIT, plan_post, split_text, tg_len, truncate
+
+def test_emoji_count_as_two_units():
+    assert tg_len('a😀') == 3
+
+def test_split_respects_utf16_limit():
+    text = ' '.join(['😀😀😀'] * 1000)
+    chunks = split_text(text, 100)
+    assert all(tg_len(chunk) <= 100 for chunk in chunks)
+    assert ' '.join(chunks) == text
+
+def test_long_word_is_not_split_inside_a_surrogate_pair():
+    chunks = split_text('😀' * 75, 101)
+    assert [tg_len(chunk) for chunk in chunks] == [100, 50]
+
+def test_caption_limit_counts_utf16():
+    # 600 code points but 1200 UTF-16 units: too long for a caption
+    caption, messages = plan_post('😀' * 600, has_media=True)
+    assert caption is None and messages
+
+def test_truncate_counts_utf16():
+    assert tg_len(truncate('😀' * CAPTION_LIMIT, CAPTION_LIMIT).split('…')[0]) <= CAPTION_LIMIT
@@ -0,0 +1,136 @@
+import asyncio
+import time
+from datetime import datetime
+
+from aiogram.types import CallbackQuery, Chat, Message, Update, User
+from prometheus_client import REGISTRY
+
+from services.throttling import COALESCE_MAX_MESSAGES, ThrottlingMiddleware
+
+USER_ID = 7
+
+class FakeBot:
+    def __init__(self):
+        self.sent = []
+        self.answered = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.sent.append((chat_id, text))
+
+    async def answer_callback_query(self, callback_query_id, text=None, **kwargs):
+        self.answered.append((callback_query_id, text))
+
+def _user():
+    return User(id=USER_ID, is_bot=False, first_name='test')
+
+def message_update(update_id: int, text: str) -> Update:
+    return Update(update_id=update_id, message=Message(
+        message_id=update_id, date=datetime.now(), chat=Chat(id=USER_ID, type='private'),
+        from_user=_user(), text=text
+    ))
+
+def callback_update(update_id: int, data: str) -> Update:
+    return Update(update_id=update_id, callback_query=CallbackQuery(
+        id=str(update_id), from_user=_user(), chat_instance='test', data=data
+    ))
+
+def dropped(reason: str) -> float:
+    return REGISTRY.get_sample_value('bot_throttled_updates_total', {'reason': reason}) or 0
+
+class Recorder:
+    """Handler that records what reached it"""
+
+    def __init__(self, duration: float = 0):
+        self.duration = duration
+        self.texts = []
+        self.started_at = []
+
+    async def __call__(self, event, data):
+        self.started_at.append(time.monotonic())
+        message = event.message
+        self.texts.append(message.text if message else event.callback_query.data)
+        if self.duration:
+            await asyncio.sleep(self.duration)
+
+def make_data(bot: FakeBot, raw_state=None) -> dict:
+    return {'event_from_user': _user(), 'bot': bot, 'raw_state': raw_state}
+
+def run_updates(middleware, handler, updates, bot, gap: float = 0):
+    async def main():
+        tasks = []
+        for update in updates:
+            tasks.append(asyncio.create_task(middleware(handler, update, make_data(bot))))
+            await asyncio.sleep(gap)
+        await asyncio.gather(*tasks)
+    asyncio.run(main())
+
+def test_first_text_is_not_delayed():
+    middleware = ThrottlingMiddleware(rate=0, max_in_flight=10, coalesce_delay=0.5)
+    handler = Recorder()
+    start = time.monotonic()
+    run_updates(middleware, handler, [message_update(1, 'hello')], FakeBot())
+    assert handler.texts == ['hello']
+    assert handler.started_at[0] - start < 0.1
+
+def test_rapid_texts_are_merged_into_one_draft():
+    middleware = ThrottlingMiddleware(rate=0, max_in_flight=10, coalesce_delay=0.2)
+    handler = Recorder()
+    before = dropped('coalesced')
+    updates = [message_update(i, f"part {i}") for i in range(1, 5)]
+    run_updates(middleware, handler, updates, FakeBot(), gap=0.01)
+    # The first part right away, then one draft rebuilt from all parts
+    assert handler.texts == ['part 1', 'part 1\npart 2\npart 3\npart 4']
+    assert dropped('coalesced') - before == 2
+
+def test_spaced_texts_are_not_merged():
+    middleware = ThrottlingMiddleware(rate=0, max_in_flight=10, coalesce_delay=0.05)
+    handler = Recorder()
+    run_updates(middleware, handler, [message_update(1, 'one'), message_update(2, 'two')], FakeBot(), gap=0.1)
+    assert handler.texts == ['one', 'two']
+
+def test_commands_are_not_merged():
+    middleware = ThrottlingMiddleware(rate=0, max_in_flight=10, coalesce_delay=0.5)
+    handler = Recorder()
+    run_updates(middleware, handler, [message_update(1, '/start'), message_update(2, '/help')], FakeBot())
+    assert handler.texts == ['/start', '/help']
+
+def test_rate_limit_drops_and_warns_once():
+    middleware = ThrottlingMiddleware(rate=1, burst=3, max_in_flight=10, coalesce_delay=0)
+    handler = Recorder()
+    bot = FakeBot()
+    before = dropped('rate')
+    run_updates(middleware, handler, [message_update(i, '/help') for i in range(1, 11)], bot)
+    assert len(handler.texts) == 3
+    assert dropped('rate') - before == 7
+    assert len(bot.sent) == 1
+
+def test_in_flight_bound():
+    middleware = ThrottlingMiddleware(rate=0, max_in_flight=2, coalesce_delay=0)
+    handler = Recorder(duration=0.05)
+    before = dropped('in_flight')
+    run_updates(middleware, handler, [message_update(i, '/help') for i in range(1, 6)], FakeBot())
+    assert len(handler.texts) == 2
+    assert dropped('in_flight') - before == 3
+
+def test_dropped_callbacks_are_answered():
+    middleware = ThrottlingMiddleware(rate=1, burst=1, max_in_flight=10, coalesce_delay=0)
+    handler = Recorder()
+    bot = FakeBot()
+    run_updates(middleware, handler, [callback_update(i, 'edit_skip') for i in range(1, 4)], bot)
+    assert handler.texts == ['edit_skip']
+    assert [callback_id for callback_id, _ in bot.answered] == ['2', '3']
+
+def test_full_burst_is_handed_over_before_a_new_one():
+    middleware = ThrottlingMiddleware(rate=0, max_in_flight=10, coalesce_delay=0.2)
+    handler = Recorder()
+    count = COALESCE_MAX_MESSAGES + 2
+    updates = [message_update(i, f"part {i}") for i in range(1, count + 1)]
+    run_updates(middleware, handler, updates, FakeBot(), gap=0.005)
+    parts = [f"part {i}" for i in range(1, count + 1)]
+    # Nothing is lost: the full burst, then a new burst of the remaining texts
+    assert handler.texts == [
+        parts[0],
+        '\n'.join(parts[:COALESCE_MAX_MESSAGES]),
+        parts[COALESCE_MAX_MESSAGES],
+        '\n'.join(parts[COALESCE_MAX_MESSAGES:]),
+    ]